@@ -0,0 +1,338 @@
+#!/usr/bin/env python3.5
+#
+# Load generator measuring throughput and latency of the exchange server.
+#
+# Opens many participant connections on the private channel, sends orders with configurable mix
+# of passive, aggressive, cancel and replace messages, and at the same time listens on the public channel.
+# Reports logins and orders per second, latency of orderCreated acknowledgments and propagation latency
+# of trades to the public channel, optionally compared with saved baseline results.
+# With --binary, the ports are expected to be the binary ports of the server
+# and messages are sent by the binary protocol of the starter kit.
+#
+# Usage: loadgen.py PrivateChannelHostname PrivateChannelPort PublicChannelPort [options]
+import argparse
+import asyncio
+import bisect
+import json
+import os
+import random
+import sys
+import time
+from collections import deque
+from typing import Any, Dict, List, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'starter_kit'))
+import binary_protocol
+
+MIX_PRESETS = {
+    'passive': {'passive': 1.0},
+    'aggressive': {'passive': 0.5, 'aggressive': 0.5},
+    'cancel-heavy': {'passive': 0.45, 'aggressive': 0.05, 'cancel': 0.5},
+    'replace-heavy': {'passive': 0.25, 'aggressive': 0.05, 'replace': 0.6, 'cancel': 0.1},
+}
+
+# Metrics compared with baseline, and whether higher value is better.
+COMPARED_METRICS = (
+    ('logins_per_sec', True),
+    ('orders_per_sec', True),
+    ('ack_latency_ms.p50', False),
+    ('ack_latency_ms.p99', False),
+    ('ack_latency_ms.p999', False),
+    ('public_latency_ms.p50', False),
+    ('public_latency_ms.p99', False),
+)
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    '''
+    Parses order mix, either name of preset or comma separated kind=weight pairs,
+    eg. "passive=70,aggressive=20,cancel=5,replace=5".
+    '''
+    if mix in MIX_PRESETS:
+        return MIX_PRESETS[mix]
+    weights = {}
+    for part in mix.split(','):
+        kind, weight = part.split('=')
+        assert kind in ('passive', 'aggressive', 'cancel', 'replace'), 'Unknown order kind {!r}'.format(kind)
+        weights[kind] = float(weight)
+    total = sum(weights.values())
+    return {kind: weight / total for kind, weight in weights.items()}
+
+
+def encode_message(msg: Dict[str, Any], binary: bool) -> bytes:
+    ''' Encodes message by json or binary protocol. '''
+    if binary:
+        return binary_protocol.encode(msg)
+    return (json.dumps(msg) + '\n').encode('utf-8')
+
+
+async def read_message(reader: asyncio.StreamReader, binary: bool) -> Dict[str, Any]:
+    ''' Reads message of json or binary protocol, None at the end of the stream. '''
+    if binary:
+        return await binary_protocol.read(reader)
+    line = await reader.readline()
+    if not line:
+        return None
+    return json.loads(line.decode('utf-8'))
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    ''' Returns summary of given latencies. '''
+    if not values:
+        return {}
+    values = sorted(values)
+
+    def pick(q):
+        return values[min(len(values) - 1, int(q * len(values)))]
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values),
+        'p50': pick(0.5),
+        'p90': pick(0.9),
+        'p99': pick(0.99),
+        'p999': pick(0.999),
+        'max': values[-1],
+    }
+
+
+class Participant:
+    ''' One simulated market participant on the private channel. '''
+
+    def __init__(self, index: int, args: argparse.Namespace, mix: Dict[str, float], stats: 'Stats') -> None:
+        self.index = index
+        self.args = args
+        self.kinds = list(mix)
+        self.cumulative_weights = []  # type: List[float]
+        for kind in self.kinds:
+            self.cumulative_weights.append(mix[kind] + (self.cumulative_weights[-1] if self.cumulative_weights else 0))
+        self.stats = stats
+        self.random = random.Random(args.seed + index)
+        self.reader = None  # type: asyncio.StreamReader
+        self.writer = None  # type: asyncio.StreamWriter
+        self.sent_creates = deque()  # type: deque[Tuple[float, str, str]]
+        self.resting = []  # type: List[Tuple[int, str, str]]
+        self.acked = asyncio.Event()
+
+    async def connect(self) -> None:
+        self.reader, self.writer = await asyncio.open_connection(self.args.host, self.args.private_port)
+        self.send({'message': 'login',
+                   'username': '{}{}'.format(self.args.user_prefix, self.index),
+                   'password': 'bench'})
+        reply = await read_message(self.reader, self.args.binary)
+        assert reply is not None and reply.get('action') in ('registered', 'logged_in'), 'Login failed: {!r}'.format(reply)
+
+    def send(self, msg: Dict[str, Any]) -> None:
+        self.writer.write(encode_message(msg, self.args.binary))
+
+    def next_message(self) -> Dict[str, Any]:
+        ''' Chooses next message according to the order mix. '''
+        index = bisect.bisect(self.cumulative_weights, self.random.random() * self.cumulative_weights[-1])
+        kind = self.kinds[min(index, len(self.kinds) - 1)]
+        if kind == 'cancel' and self.resting:
+            order_id, symbol, side = self.resting.pop(self.random.randrange(len(self.resting)))
+            msg = {'message': 'cancelOrder', 'orderId': order_id}
+        elif kind == 'replace' and self.resting:
+            order_id, symbol, side = self.resting[self.random.randrange(len(self.resting))]
+            msg = {'message': 'replaceOrder',
+                   'orderId': order_id,
+                   'price': self.price(side, 'passive'),
+                   'quantity': self.random.randint(1, self.args.max_quantity)}
+        else:
+            if kind in ('cancel', 'replace'):
+                kind = 'passive'
+            side = self.random.choice(('BUY', 'SELL'))
+            symbol = self.random.choice(self.args.symbols) if self.args.symbols else None
+            msg = {'message': 'createOrder',
+                   'side': side,
+                   'price': self.price(side, kind),
+                   'quantity': self.random.randint(1, self.args.max_quantity)}
+        if symbol is not None:
+            msg['symbol'] = symbol
+        return msg
+
+    def price(self, side: str, kind: str) -> str:
+        ''' Returns random price of passive order resting in the book, or of aggressive one crossing the spread. '''
+        offset = self.random.randint(1, self.args.depth) * self.args.tick
+        if kind == 'aggressive':
+            offset = -offset
+        return str(self.args.mid - offset if side == 'BUY' else self.args.mid + offset)
+
+    async def run_sender(self) -> None:
+        for _ in range(self.args.orders):
+            while len(self.sent_creates) >= self.args.window:
+                self.acked.clear()
+                await self.acked.wait()
+            msg = self.next_message()
+            if msg['message'] == 'createOrder':
+                self.sent_creates.append((time.perf_counter(), msg.get('symbol', None), msg['side']))
+            elif msg['message'] == 'replaceOrder':
+                self.stats.replaces += 1
+            else:
+                self.stats.cancels += 1
+            self.send(msg)
+            await self.writer.drain()
+        while self.sent_creates:
+            self.acked.clear()
+            await self.acked.wait()
+
+    async def run_receiver(self) -> None:
+        while True:
+            msg = await read_message(self.reader, self.args.binary)
+            if msg is None:
+                break
+            if msg['type'] == 'orderCreated':
+                sent, symbol, side = self.sent_creates.popleft()
+                self.stats.ack_latencies.append((time.perf_counter() - sent) * 1000)
+                self.resting.append((msg['id'], symbol, side))
+                self.acked.set()
+            elif msg['type'] == 'trade':
+                self.stats.private_trades += 1
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+
+
+class Stats:
+    ''' Measurements collected during the run. '''
+
+    def __init__(self) -> None:
+        self.ack_latencies = []  # type: List[float]
+        self.public_latencies = []  # type: List[float]
+        self.cancels = 0
+        self.replaces = 0
+        self.private_trades = 0
+        self.public_messages = 0
+
+
+async def run_public(args: argparse.Namespace, stats: Stats) -> None:
+    ''' Listens on the public channel, measuring how long trades take to get there. '''
+    reader, writer = await asyncio.open_connection(args.host, args.public_port)
+    try:
+        while True:
+            msg = await read_message(reader, args.binary)
+            if msg is None:
+                break
+            stats.public_messages += 1
+            if msg['type'] == 'trade':
+                stats.public_latencies.append((time.time() - msg['time']) * 1000)
+    finally:
+        writer.close()
+
+
+async def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    ''' Runs one benchmark and returns its results. '''
+    mix = parse_mix(args.mix)
+    stats = Stats()
+    public_tasks = []
+    if args.public_port:
+        public_tasks = [asyncio.ensure_future(run_public(args, stats)) for _ in range(args.public_clients)]
+
+    participants = [Participant(i, args, mix, stats) for i in range(args.clients)]
+    login_started = time.perf_counter()
+    for i in range(0, len(participants), args.connect_batch):
+        await asyncio.gather(*(p.connect() for p in participants[i:i + args.connect_batch]))
+    login_elapsed = time.perf_counter() - login_started
+    receivers = [asyncio.ensure_future(p.run_receiver()) for p in participants]
+
+    started = time.perf_counter()
+    await asyncio.gather(*(p.run_sender() for p in participants))
+    elapsed = time.perf_counter() - started
+
+    await asyncio.sleep(args.settle)
+    for task in public_tasks + receivers:
+        task.cancel()
+    for p in participants:
+        p.close()
+
+    return {
+        'clients': args.clients,
+        'mix': args.mix,
+        'protocol': 'binary' if args.binary else 'json',
+        'orders': len(stats.ack_latencies),
+        'cancels': stats.cancels,
+        'replaces': stats.replaces,
+        'login_sec': login_elapsed,
+        'logins_per_sec': args.clients / login_elapsed,
+        'elapsed_sec': elapsed,
+        'orders_per_sec': (len(stats.ack_latencies) + stats.cancels + stats.replaces) / elapsed,
+        'ack_latency_ms': percentiles(stats.ack_latencies),
+        'public_latency_ms': percentiles(stats.public_latencies),
+        'private_trades': stats.private_trades,
+        'public_messages': stats.public_messages,
+    }
+
+
+def get_metric(results: Dict[str, Any], name: str) -> float:
+    value = results
+    for part in name.split('.'):
+        value = value.get(part, {}) if isinstance(value, dict) else {}
+    return value if isinstance(value, (int, float)) else None
+
+
+def print_results(results: Dict[str, Any]) -> None:
+    print('{orders} orders, {cancels} cancels and {replaces} replaces from {clients} clients in {elapsed_sec:.2f} s'
+          ' ({protocol} protocol)'.format(**results))
+    print('logins: {:.0f}/s'.format(results['logins_per_sec']))
+    print('throughput: {:.0f} messages/s'.format(results['orders_per_sec']))
+    for name in ('ack_latency_ms', 'public_latency_ms'):
+        summary = results[name]
+        if summary:
+            print('{}: p50 {p50:.3f}  p90 {p90:.3f}  p99 {p99:.3f}  p99.9 {p999:.3f}  max {max:.3f}'.format(
+                name, **summary))
+
+
+def print_comparison(results: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    print('\ncomparison with baseline:')
+    for name, higher_is_better in COMPARED_METRICS:
+        new, old = get_metric(results, name), get_metric(baseline, name)
+        if new is None or old is None or old == 0:
+            continue
+        change = (new - old) / old * 100
+        better = (change > 0) == higher_is_better
+        print('{:24} {:12.3f} -> {:12.3f}  {:+7.1f}% {}'.format(
+            name, old, new, change, 'better' if better else 'worse'))
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Exchange server load generator.')
+    parser.add_argument('host')
+    parser.add_argument('private_port', type=int)
+    parser.add_argument('public_port', type=int, nargs='?', help='Public channel port, not measured if missing.')
+    parser.add_argument('--clients', type=int, default=100, help='Number of participant connections.')
+    parser.add_argument('--orders', type=int, default=100, help='Messages sent by each participant.')
+    parser.add_argument('--window', type=int, default=1, help='Unacknowledged orders allowed per participant.')
+    parser.add_argument('--mix', default='passive',
+                        help='Order mix, one of {} or kind=weight list, '
+                             'eg. passive=70,aggressive=20,cancel=5,replace=5.'.format(', '.join(MIX_PRESETS)))
+    parser.add_argument('--symbols', type=lambda value: value.split(','), help='Comma separated symbols to trade.')
+    parser.add_argument('--mid', type=float, default=100, help='Middle price of the generated orders.')
+    parser.add_argument('--tick', type=float, default=1, help='Price step of the generated orders.')
+    parser.add_argument('--depth', type=int, default=20, help='Number of price steps used on each side.')
+    parser.add_argument('--max-quantity', type=int, default=100)
+    parser.add_argument('--public-clients', type=int, default=1, help='Number of public channel listeners.')
+    parser.add_argument('--connect-batch', type=int, default=100, help='Connections opened at once.')
+    parser.add_argument('--settle', type=float, default=0.5, help='Seconds to wait for late public messages.')
+    parser.add_argument('--binary', action='store_true', help='Use binary protocol (ports have to be the binary ones).')
+    parser.add_argument('--user-prefix', default='bench')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', metavar='FILE', help='Save results as JSON into FILE.')
+    parser.add_argument('--baseline', metavar='FILE', help='Compare results with JSON results saved in FILE.')
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str]) -> None:
+    args = parse_args(argv)
+    loop = asyncio.get_event_loop()
+    results = loop.run_until_complete(run_benchmark(args))
+    print_results(results)
+    if args.baseline:
+        with open(args.baseline) as file:
+            print_comparison(results, json.load(file))
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
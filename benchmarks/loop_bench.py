@@ -0,0 +1,131 @@
+#!/usr/bin/env python3.5
+#
+# Compares event loop implementations of the exchange server.
+#
+# Starts the server once for each event loop implementation (with in-memory DB), runs the same
+# load generator benchmark against it (see loadgen.py), and prints the results side by side.
+# Login throughput shows the gain of the login path, public latency with many --public-clients
+# shows the gain of the broadcast path. Server falling back to asyncio, because uvloop is not installed,
+# is reported in the table header.
+#
+# Usage: loop_bench.py PrivateChannelHostname PrivateChannelPort PublicChannelPort [options] [loadgen options]
+import argparse
+import asyncio
+import json
+import os
+import shlex
+import signal
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+import loadgen
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'challenge', 'server.py')
+
+# Metrics shown in the table, and whether higher value is better.
+SHOWN_METRICS = (
+    ('logins_per_sec', True),
+    ('orders_per_sec', True),
+    ('ack_latency_ms.p50', False),
+    ('ack_latency_ms.p99', False),
+    ('public_latency_ms.p50', False),
+    ('public_latency_ms.p99', False),
+)
+
+
+def start_server(args: argparse.Namespace, event_loop: str) -> Tuple[subprocess.Popen, str]:
+    ''' Starts the server and waits until it serves both channels. Returns the process and the loop it runs on. '''
+    command = [args.python, '-u', args.server, args.host, str(args.private_port), str(args.public_port),
+               '--memory-db', '--event-loop', event_loop] + shlex.split(args.server_args)
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, universal_newlines=True)
+    running_on = event_loop
+    serving = 0
+    deadline = time.time() + args.startup_timeout
+    while serving < 2:
+        line = server.stdout.readline()
+        if not line or time.time() > deadline:
+            server.kill()
+            raise RuntimeError('Server with {} event loop did not start'.format(event_loop))
+        if line.startswith('Running on '):
+            running_on = line.split()[2]
+        elif line.startswith('Serving private') or line.startswith('Serving public'):
+            serving += 1
+    return server, running_on
+
+
+def stop_server(server: subprocess.Popen) -> None:
+    server.send_signal(signal.SIGINT)
+    try:
+        server.wait(5)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+def run_loop(args: argparse.Namespace, loadgen_args: argparse.Namespace, event_loop: str) -> Dict[str, Any]:
+    ''' Runs the benchmark against server using given event loop. '''
+    server, running_on = start_server(args, event_loop)
+    try:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            results = loop.run_until_complete(loadgen.run_benchmark(loadgen_args))
+        finally:
+            loop.close()
+    finally:
+        stop_server(server)
+    results['event_loop'] = running_on
+    return results
+
+
+def print_table(results: Dict[str, Dict[str, Any]]) -> None:
+    loops = list(results)
+    print('{:<24}'.format('') + ''.join('{:>18}'.format('{} ({})'.format(name, results[name]['event_loop'])
+                                                        if results[name]['event_loop'] != name else name)
+                                        for name in loops))
+    for name, higher_is_better in SHOWN_METRICS:
+        values = [loadgen.get_metric(results[loop], name) for loop in loops]
+        row = '{:<24}'.format(name) + ''.join('{:>18}'.format('-' if value is None else '{:.3f}'.format(value))
+                                              for value in values)
+        first, last = values[0], values[-1]
+        if len(values) > 1 and first and last is not None:
+            change = (last - first) / first * 100
+            better = (change > 0) == higher_is_better
+            row += '  {:+.1f}% {}'.format(change, 'better' if better else 'worse')
+        print(row)
+
+
+def parse_args(argv: List[str]) -> Tuple[argparse.Namespace, argparse.Namespace]:
+    parser = argparse.ArgumentParser(description='Compare event loops of the exchange server.',
+                                     epilog='Other options are passed to loadgen.py.')
+    parser.add_argument('host')
+    parser.add_argument('private_port', type=int)
+    parser.add_argument('public_port', type=int)
+    parser.add_argument('--loops', type=lambda value: value.split(','), default=['asyncio', 'uvloop'],
+                        help='Comma separated event loops to compare.')
+    parser.add_argument('--server', default=SERVER, help='Path of the server script.')
+    parser.add_argument('--python', default=sys.executable, help='Python interpreter running the server.')
+    parser.add_argument('--server-args', default='', help='Additional server options, eg. "--journal j.log".')
+    parser.add_argument('--startup-timeout', type=float, default=30)
+    parser.add_argument('--save', metavar='FILE', help='Save results of all loops as JSON into FILE.')
+    args, rest = parser.parse_known_args(argv)
+    loadgen_args = loadgen.parse_args([args.host, str(args.private_port), str(args.public_port)] + rest)
+    return args, loadgen_args
+
+
+def main(argv: List[str]) -> None:
+    args, loadgen_args = parse_args(argv)
+    results = OrderedDict()
+    for event_loop in args.loops:
+        results[event_loop] = run_loop(args, loadgen_args, event_loop)
+    print_table(results)
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3.5
+#
+# Microbenchmark of the matching engine, without server and network.
+#
+# Drives MatchingEngine.insert_order/process_order/delete_order by synthetic streams of messages,
+# against orderbook prefilled to configurable depth. For each scenario reports time per message,
+# memory blocks and bytes left allocated per message (net of freed ones, as counted by
+# sys.getallocatedblocks and tracemalloc), and DB commits and stored objects per message.
+# Each message is committed separately, as the server does.
+#
+# Usage: matching_bench.py [options]
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, List, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'challenge'))
+
+import transaction
+import ZODB
+from BTrees.OOBTree import OOBTree
+
+from matching import MatchingEngine
+from models import Order, OrderType, User
+
+# Scenario name: (share of aggressive orders, share of cancels, None meaning --cancel-ratio)
+SCENARIOS = {
+    'passive': (0.0, 0.0),
+    'aggressive': (0.5, 0.0),
+    'cancel': (0.0, None),
+    'mixed': (0.2, None),
+}
+
+Message = Tuple[str, Any]
+
+
+class NullServer:
+    ''' Stands in for ExchangeServer, only counts messages produced by the engine. '''
+
+    def __init__(self) -> None:
+        self.messages = 0
+
+    def send_data(self, data: Dict[str, Any], user: User = None, writer=None) -> None:
+        self.messages += 1
+
+    def add_to_broadcast(self, data: Dict[str, Any]) -> None:
+        self.messages += 1
+
+
+class CommitCounter:
+    ''' Transaction synchronizer counting finished commits. '''
+
+    def __init__(self) -> None:
+        self.commits = 0
+
+    def beforeCompletion(self, txn) -> None:
+        pass
+
+    def afterCompletion(self, txn) -> None:
+        if txn.status == 'Committed':
+            self.commits += 1
+
+    def newTransaction(self, txn) -> None:
+        pass
+
+
+class Generator:
+    ''' Creates orders and streams of messages for the engine. '''
+
+    def __init__(self, args: argparse.Namespace, seed: int) -> None:
+        self.args = args
+        self.random = random.Random(seed)
+        self.user = User()
+        self.user.set_username('bench')
+        self.next_id = 0
+        self.resting = []  # type: List[int]
+
+    def order(self, order_type: OrderType, ticks: int, quantity: int) -> Order:
+        '''
+        :param order_type: Internal type of the order (bid is SELL, ask is BUY).
+        :param ticks: Distance of the price from the middle price, positive towards the own side of the book.
+        :param quantity: Quantity of the order.
+        '''
+        self.next_id += 1
+        half_spread = self.args.spread // 2
+        if order_type == OrderType.bid:
+            price = self.args.mid + half_spread + ticks
+        else:
+            price = self.args.mid - half_spread - ticks
+        order = Order()
+        order.set_id(self.next_id)
+        order.set_type(order_type)
+        order.set_price(price)
+        order.set_quantity(quantity)
+        return order
+
+    def prefill(self) -> List[Order]:
+        ''' Returns resting orders filling both sides of the book to the configured depth. '''
+        orders = []
+        for level in range(self.args.depth):
+            for _ in range(self.args.orders_per_level):
+                for order_type in (OrderType.bid, OrderType.ask):
+                    order = self.order(order_type, level, self.random.randint(1, self.args.max_quantity))
+                    self.resting.append(order.id)
+                    orders.append(order)
+        return orders
+
+    def messages(self, aggressive_ratio: float, cancel_ratio: float) -> List[Message]:
+        ''' Returns stream of create and cancel messages. '''
+        messages = []
+        for _ in range(self.args.ops):
+            dice = self.random.random()
+            if dice < cancel_ratio and self.resting:
+                index = self.random.randrange(len(self.resting))
+                self.resting[index], self.resting[-1] = self.resting[-1], self.resting[index]
+                messages.append(('cancel', self.resting.pop()))
+                continue
+            order_type = self.random.choice((OrderType.bid, OrderType.ask))
+            if dice < cancel_ratio + aggressive_ratio:
+                # crosses the spread and takes liquidity from the first few levels on the other side
+                ticks = -self.args.spread - self.random.randint(0, 2)
+                order = self.order(order_type, ticks, self.random.randint(1, 2 * self.args.max_quantity))
+            else:
+                order = self.order(order_type, self.random.randrange(self.args.depth),
+                                   self.random.randint(1, self.args.max_quantity))
+                self.resting.append(order.id)
+            messages.append(('create', order))
+        return messages
+
+
+def make_engine(args: argparse.Namespace, server: NullServer) -> Tuple[MatchingEngine, Any]:
+    ''' Returns new engine, and DB connection if the engine stores orders into DB. '''
+    if args.storage == 'memory':
+        return MatchingEngine(None, None, server), None
+    connection = ZODB.DB(None).open()
+    root = connection.root()
+    root['biddb'] = OOBTree()
+    root['askdb'] = OOBTree()
+    transaction.commit()
+    return MatchingEngine(root['biddb'], root['askdb'], server), connection
+
+
+def run_messages(engine: MatchingEngine, generator: Generator, messages: List[Message], commit: bool) -> None:
+    for kind, value in messages:
+        if kind == 'create':
+            engine.insert_order(value, generator.user, None)
+            engine.process_order(value, None)
+        else:
+            order = engine.get_order(value)
+            if order is not None:
+                engine.delete_order(order)
+        if commit:
+            transaction.commit()
+
+
+def prepare(args: argparse.Namespace, scenario: str) -> Tuple[MatchingEngine, Any, Generator, List[Message]]:
+    ''' Returns engine with prefilled book, and messages of the scenario to run against it. '''
+    aggressive_ratio, cancel_ratio = SCENARIOS[scenario]
+    if cancel_ratio is None:
+        cancel_ratio = args.cancel_ratio
+    generator = Generator(args, args.seed)
+    engine, connection = make_engine(args, NullServer())
+    for order in generator.prefill():
+        engine.insert_order(order, generator.user, None)
+    if connection is not None:
+        transaction.commit()
+    return engine, connection, generator, generator.messages(aggressive_ratio, cancel_ratio)
+
+
+def run_scenario(args: argparse.Namespace, scenario: str) -> Dict[str, float]:
+    '''
+    Runs the scenario three times, once for timing, once for memory blocks and once traced by tracemalloc,
+    so that tracing does not distort the timing.
+    '''
+    commit = args.storage == 'zodb'
+
+    engine, connection, generator, messages = prepare(args, scenario)
+    counter = CommitCounter()
+    transaction.manager.registerSynch(counter)
+    engine.server.messages = 0
+    if connection is not None:
+        connection.getTransferCounts(True)
+    gc.collect()
+    started = time.perf_counter()
+    run_messages(engine, generator, messages, commit)
+    elapsed = time.perf_counter() - started
+    transaction.manager.unregisterSynch(counter)
+    stores = connection.getTransferCounts(True)[1] if connection is not None else 0
+    produced = engine.server.messages
+    resting = len(engine.order_index)
+
+    engine, connection, generator, messages = prepare(args, scenario)
+    gc.collect()
+    gc.disable()
+    blocks = sys.getallocatedblocks()
+    run_messages(engine, generator, messages, commit)
+    blocks = sys.getallocatedblocks() - blocks
+    gc.enable()
+
+    engine, connection, generator, messages = prepare(args, scenario)
+    gc.collect()
+    tracemalloc.start()
+    run_messages(engine, generator, messages, commit)
+    allocated, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    ops = len(messages)
+    return {
+        'ns_per_op': elapsed * 1e9 / ops,
+        'blocks_per_op': blocks / ops,
+        'bytes_per_op': allocated / ops,
+        'peak_bytes': peak,
+        'commits_per_op': counter.commits / ops,
+        'stores_per_op': stores / ops,
+        'messages_per_op': produced / ops,
+        'resting_orders': resting,
+    }
+
+
+def print_results(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]] = None) -> None:
+    print('{:12} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+        'scenario', 'ns/op', 'blocks/op', 'bytes/op', 'commits/op', 'stores/op', 'msgs/op'))
+    for scenario, row in results.items():
+        print('{:12} {ns_per_op:10.0f} {blocks_per_op:10.2f} {bytes_per_op:10.1f} {commits_per_op:10.2f} '
+              '{stores_per_op:10.2f} {messages_per_op:10.2f}'.format(scenario, **row))
+        old = (baseline or {}).get(scenario, None)
+        if old:
+            print('{:12} {:+9.1f}% {:+9.1f}% {:+9.1f}% {:+10.2f} {:+10.2f}'.format(
+                '  vs base',
+                (row['ns_per_op'] - old['ns_per_op']) / old['ns_per_op'] * 100,
+                (row['blocks_per_op'] - old['blocks_per_op']) / max(abs(old['blocks_per_op']), 1e-9) * 100,
+                (row['bytes_per_op'] - old['bytes_per_op']) / max(abs(old['bytes_per_op']), 1e-9) * 100,
+                row['commits_per_op'] - old['commits_per_op'],
+                row['stores_per_op'] - old['stores_per_op']))
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Matching engine microbenchmark.')
+    parser.add_argument('--scenarios', type=lambda value: value.split(','), default=list(SCENARIOS),
+                        help='Comma separated scenarios to run, from {}.'.format(', '.join(SCENARIOS)))
+    parser.add_argument('--ops', type=int, default=20000, help='Messages in each scenario.')
+    parser.add_argument('--depth', type=int, default=50, help='Prefilled price levels on each side.')
+    parser.add_argument('--orders-per-level', type=int, default=4, help='Prefilled orders on each level.')
+    parser.add_argument('--spread', type=int, default=2, help='Ticks between best bid and best ask (even number).')
+    parser.add_argument('--mid', type=int, default=1000, help='Middle price in ticks.')
+    parser.add_argument('--cancel-ratio', type=float, default=0.5,
+                        help='Share of cancels in the cancel and mixed scenarios.')
+    parser.add_argument('--max-quantity', type=int, default=100)
+    parser.add_argument('--storage', choices=('zodb', 'memory'), default='zodb',
+                        help='Store orders into in-memory ZODB and commit each message, or keep them only in memory.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', metavar='FILE', help='Save results as JSON into FILE.')
+    parser.add_argument('--baseline', metavar='FILE', help='Compare results with JSON results saved in FILE.')
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str]) -> None:
+    args = parse_args(argv)
+    for scenario in args.scenarios:
+        assert scenario in SCENARIOS, 'Unknown scenario {!r}'.format(scenario)
+    results = {scenario: run_scenario(args, scenario) for scenario in args.scenarios}
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    print_results(results, baseline)
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3.5
+import logging
+from asyncio import AbstractEventLoop, StreamReader, StreamWriter, sleep
+from typing import List
+
+from profiler import SamplingProfiler, StallMonitor, StallWatchdog
+
+
+class Admin:
+    """
+    Commands of the local control socket, used to inspect running server without restarting it.
+
+    Each line sent to the socket is one command, its answer are lines followed by an empty line.
+    Commands run while the server keeps serving clients:
+
+    - ``profile SECONDS [INTERVAL_MS]`` samples the event loop thread for SECONDS
+      (see :class:`profiler.SamplingProfiler`) and answers collapsed stacks for flame graph tools,
+    - ``stalls SECONDS [THRESHOLD_MS]`` measures event loop stalls for SECONDS
+      (see :class:`profiler.StallMonitor`) and answers stalls longer than THRESHOLD_MS with summary,
+    - ``slow`` answers the last stalls recorded by the watchdog (see :class:`profiler.StallWatchdog`)
+      with the handler and message type which caused them, if the server runs the watchdog.
+
+    Only one profiling runs at a time.
+    """
+    def __init__(self, loop: AbstractEventLoop, thread_id: int, watchdog: StallWatchdog = None) -> None:
+        self.loop = loop  # type: AbstractEventLoop
+        self.watchdog = watchdog  # type: StallWatchdog
+        self.profiler = SamplingProfiler(thread_id)  # type: SamplingProfiler
+        self.log = logging.getLogger('Admin')  # type: logging.Logger
+
+    async def handle_client(self, reader: StreamReader, writer: StreamWriter) -> None:
+        """
+        Coroutine which answers commands of connected client until it disconnects.
+
+        :param reader: Reader of the client.
+        :param writer: Writer of the client.
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                words = line.decode('utf-8').split()
+                if not words:
+                    continue
+                try:
+                    lines = await self.execute(words[0], words[1:])
+                except (ValueError, IndexError) as e:
+                    lines = ['error: {}'.format(e)]
+                writer.write(('\n'.join(lines) + '\n\n').encode('utf-8'))
+                await writer.drain()
+        except ConnectionError:
+            self.log.debug("Admin client disconnected")
+        finally:
+            writer.close()
+
+    async def execute(self, command: str, args: List[str]) -> List[str]:
+        """
+        Coroutine which executes one command.
+
+        :param command: Name of the command.
+        :param args: Arguments of the command.
+        :return: Lines of the answer. Raises ValueError for invalid commands.
+        """
+        if command == 'profile':
+            return await self.profile(float(args[0]), float(args[1]) / 1000 if len(args) > 1 else 0.001)
+        elif command == 'stalls':
+            return await self.stalls(float(args[0]), float(args[1]) / 1000 if len(args) > 1 else 0.01)
+        elif command == 'slow':
+            if self.watchdog is None:
+                raise ValueError("Watchdog is not running, start server with --stall-threshold-ms")
+            return self.watchdog.report()
+        raise ValueError("Unknown command \"{}\", use profile, stalls or slow".format(command))
+
+    async def profile(self, seconds: float, interval: float) -> List[str]:
+        """
+        :param seconds: Duration of the profiling.
+        :param interval: Seconds between samples.
+        :return: Collapsed stacks with their number of samples.
+        """
+        if self.profiler.running:
+            raise ValueError("Profiler is already running")
+        self.profiler.interval = interval
+        self.profiler.start()
+        self.log.info("Profiling for %s seconds", seconds)
+        try:
+            await sleep(seconds, loop=self.loop)
+        finally:
+            self.profiler.stop()
+        return self.profiler.collapsed()
+
+    async def stalls(self, seconds: float, threshold: float) -> List[str]:
+        """
+        :param seconds: Duration of the measurement.
+        :param threshold: Shortest reported stall in seconds.
+        :return: Reported stalls, followed by summary line.
+        """
+        monitor = StallMonitor(self.loop, threshold, min(threshold / 2, 0.01))
+        monitor.start()
+        try:
+            await sleep(seconds, loop=self.loop)
+        finally:
+            monitor.stop()
+        return monitor.report()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3.5
+import struct
+from asyncio import StreamReader, IncompleteReadError
+from typing import Dict, Any, Tuple
+
+from ticks import TickSize
+
+VERSION = 2
+PRICE_PLACES = 8
+
+HEADER = struct.Struct('<HB')
+
+# Message types, login frame is sent by both sides, create, cancel, replace and retransmit frames by clients,
+# the rest by the server.
+LOGIN = 1
+CREATE_ORDER = 2
+CANCEL_ORDER = 3
+REPLACE_ORDER = 4
+ORDER_CREATED = 5
+ORDER_REPLACED = 6
+TRADE = 7
+ORDERBOOK = 8
+RETRANSMIT = 9
+SNAPSHOT = 10
+ERROR = 11
+CONFLATED = 12
+
+LOGIN_REQUEST = struct.Struct('<BBB')
+LOGIN_RESPONSE = struct.Struct('<BB')
+CREATE_ORDER_BODY = struct.Struct('<8sBqQ')
+CANCEL_ORDER_BODY = struct.Struct('<8sQ')
+REPLACE_ORDER_BODY = struct.Struct('<8sQBqQ')
+ORDER_ID_BODY = struct.Struct('<Q')
+SEQUENCE_BODY = struct.Struct('<Q')
+TRADE_BODY = struct.Struct('<Q8sdqQ')
+ORDERBOOK_BODY = struct.Struct('<Q8sBqQ')
+# Sequence numbers carried by one conflated frame at most, so that its body length fits into the header.
+MAX_CONFLATED = 8191
+
+LOGIN_ACTIONS = {'denied': 0, 'logged_in': 1, 'registered': 2}
+ORDER_SIDES = {1: 'BUY', 2: 'SELL'}
+BOOK_SIDES = {'bid': 1, 'ask': 2}
+REPLACE_PRICE = 1
+REPLACE_QUANTITY = 2
+
+
+class BinaryProtocol:
+    """
+    Fixed layout binary protocol, alternative to json lines used on the binary private and public ports.
+
+    Each frame starts with header containing length of the body and message type, followed by the body
+    packed by one of the structs in this module. Symbols are ASCII, zero padded to 8 bytes (empty for the default
+    instrument). Prices are fixed point integers with *PRICE_PLACES* decimal places, they are converted
+    to ticks of the instrument when decoded, without going through Decimal.
+
+    Public messages start with their sequence number (see :class:`fanout.Fanout`), public clients can send
+    retransmit frame with sequence number of the first message they miss. Trades reported to private clients
+    are not part of the public feed, their sequence number is 0.
+
+    Login frame carries protocol version requested by the client (followed by username and password),
+    the response carries result of the login and *VERSION* spoken by the server. Login with different version
+    is denied.
+
+    Decoded messages are the same dictionaries as json messages, except that prices are already in ticks
+    and are stored as *priceTicks*.
+
+    Error frame, answering rejected client message, carries the reason as UTF-8 text filling the whole body.
+    Conflated frame carries sequence numbers of public messages conflated for the client, as uint64 values
+    filling the whole body, more of them are split into several frames.
+    """
+    def __init__(self, tick_sizes: Dict[str, TickSize], default_symbol: str = None) -> None:
+        self.default_symbol = default_symbol  # type: str
+        self.symbols = {}  # type: Dict[bytes, str]
+        self.symbol_bytes = {}  # type: Dict[str, bytes]
+        self.price_factors = {}  # type: Dict[str, int]
+        for symbol, tick_size in tick_sizes.items():
+            if tick_size.places > PRICE_PLACES:
+                raise ValueError("Tick size {} is too small for binary protocol".format(tick_size.size))
+            encoded = b'' if symbol is None else symbol.encode('ascii')
+            if len(encoded) > 8:
+                raise ValueError("Symbol \"{}\" is too long for binary protocol".format(symbol))
+            self.symbols[encoded] = symbol
+            self.symbol_bytes[symbol] = encoded
+            self.price_factors[symbol] = tick_size.units * 10 ** (PRICE_PLACES - tick_size.places)
+
+    async def read(self, reader: StreamReader) -> Dict[str, Any]:
+        """
+        Coroutine which reads and decodes one frame.
+
+        :param reader: Reader of the client.
+        :return: Decoded message, None if the client disconnected.
+        """
+        msg_type, body = await self.read_frame(reader)
+        if body is None:
+            return None
+        return self.decode(msg_type, body)
+
+    @staticmethod
+    async def read_frame(reader: StreamReader) -> Tuple[int, bytes]:
+        """
+        Coroutine which reads one frame without decoding it.
+
+        :param reader: Reader of the client.
+        :return: Message type and body of the frame, body is None if the client disconnected.
+        """
+        try:
+            length, msg_type = HEADER.unpack(await reader.readexactly(HEADER.size))
+            return msg_type, await reader.readexactly(length)
+        except IncompleteReadError:
+            return None, None
+
+    def decode(self, msg_type: int, body: bytes) -> Dict[str, Any]:
+        """
+        Decodes body of frame sent by client.
+
+        :param msg_type: Message type from the frame header.
+        :param body: Body of the frame.
+        :return: Dictionary representing the message. Raises ValueError for invalid frames.
+        """
+        try:
+            if msg_type == LOGIN:
+                version, username_length, password_length = LOGIN_REQUEST.unpack_from(body)
+                strings = body[LOGIN_REQUEST.size:].decode('utf-8')
+                data = {'message': 'login' if version == VERSION else 'unsupportedLogin',
+                        'username': strings[:username_length],
+                        'password': strings[username_length:username_length + password_length]}
+            elif msg_type == CREATE_ORDER:
+                symbol, side, price, quantity = CREATE_ORDER_BODY.unpack(body)
+                data = self._symbol_dict('createOrder', symbol)
+                data['side'] = ORDER_SIDES[side]
+                data['priceTicks'] = self._to_ticks(data, price)
+                data['quantity'] = quantity
+            elif msg_type == CANCEL_ORDER:
+                symbol, order_id = CANCEL_ORDER_BODY.unpack(body)
+                data = self._symbol_dict('cancelOrder', symbol)
+                data['orderId'] = order_id
+            elif msg_type == REPLACE_ORDER:
+                symbol, order_id, flags, price, quantity = REPLACE_ORDER_BODY.unpack(body)
+                data = self._symbol_dict('replaceOrder', symbol)
+                data['orderId'] = order_id
+                if flags & REPLACE_PRICE:
+                    data['priceTicks'] = self._to_ticks(data, price)
+                if flags & REPLACE_QUANTITY:
+                    data['quantity'] = quantity
+            elif msg_type == RETRANSMIT:
+                data = {'message': 'retransmit', 'from': SEQUENCE_BODY.unpack(body)[0]}
+            else:
+                raise ValueError("Unknown binary message type {}".format(msg_type))
+        except (struct.error, KeyError, UnicodeDecodeError) as e:
+            raise ValueError("Invalid binary message of type {}: {}".format(msg_type, e))
+        return data
+
+    def _symbol_dict(self, msg_type: str, symbol: bytes) -> Dict[str, Any]:
+        """
+        :param msg_type: Name of the message.
+        :param symbol: Zero padded symbol from the frame.
+        :return: New message dictionary, with symbol unless it is the default instrument.
+        """
+        symbol = symbol.rstrip(b'\0')
+        data = {'message': msg_type}
+        if symbol:
+            if symbol not in self.symbols:
+                raise ValueError("Unknown symbol \"{}\"".format(symbol.decode('ascii', 'replace')))
+            data['symbol'] = self.symbols[symbol]
+        return data
+
+    def _to_ticks(self, data: Dict[str, Any], price: int) -> int:
+        """
+        :param data: Message the price belongs to.
+        :param price: Fixed point price.
+        :return: Price in ticks of the instrument of the message.
+        """
+        factor = self.price_factors[data.get('symbol', self.default_symbol)]
+        if price % factor:
+            raise ValueError("Price {} is not a multiple of tick size".format(price))
+        return price // factor
+
+    def encode(self, data: Dict[str, Any]) -> bytes:
+        """
+        Encodes message for client into frame. Prices of the message are in ticks.
+
+        :param data: Dictionary of data to be encoded.
+        :return: Raw frame.
+        """
+        msg_type = data['type']
+        if msg_type == 'orderbook':
+            symbol = data.get('symbol', None)
+            return self._frame(ORDERBOOK, ORDERBOOK_BODY.pack(data['seq'], self.symbol_bytes[symbol],
+                                                              BOOK_SIDES[data['side']],
+                                                              data['price'] * self.price_factors[symbol],
+                                                              data['quantity']))
+        elif msg_type == 'trade':
+            symbol = data.get('symbol', None)
+            return self._frame(TRADE, TRADE_BODY.pack(data.get('seq', 0), self.symbol_bytes[symbol], data['time'],
+                                                      data['price'] * self.price_factors[symbol],
+                                                      data['quantity']))
+        elif msg_type == 'snapshot':
+            return self._frame(SNAPSHOT, SEQUENCE_BODY.pack(data['seq']))
+        elif msg_type == 'orderCreated':
+            return self._frame(ORDER_CREATED, ORDER_ID_BODY.pack(data['id']))
+        elif msg_type == 'orderReplaced':
+            return self._frame(ORDER_REPLACED, ORDER_ID_BODY.pack(data['id']))
+        elif msg_type == 'login':
+            return self._frame(LOGIN, LOGIN_RESPONSE.pack(LOGIN_ACTIONS[data['action']], VERSION))
+        elif msg_type == 'error':
+            return self._frame(ERROR, data['reason'].encode('utf-8'))
+        elif msg_type == 'conflated':
+            seqs = data['seqs']
+            return b''.join(self._frame(CONFLATED, struct.pack('<{}Q'.format(len(chunk)), *chunk))
+                            for chunk in (seqs[i:i + MAX_CONFLATED] for i in range(0, len(seqs), MAX_CONFLATED)))
+        raise ValueError("Message \"{}\" cannot be encoded by binary protocol".format(msg_type))
+
+    @staticmethod
+    def _frame(msg_type: int, body: bytes) -> bytes:
+        """
+        :param msg_type: Message type.
+        :param body: Packed body of the message.
+        :return: Frame with header.
+        """
+        return HEADER.pack(len(body), msg_type) + body
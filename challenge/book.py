@@ -0,0 +1,193 @@
+#!/usr/bin/env python3.5
+from typing import Iterator
+
+from BTrees.LOBTree import LOBTree
+from models import OrderType, Order
+
+
+class OrderNode:
+    """
+    Position of one resting order in the queue of its price level.
+    """
+    __slots__ = ('order', 'level', 'prev', 'next')
+
+    def __init__(self, order: Order, level: 'PriceLevel') -> None:
+        self.order = order  # type: Order
+        self.level = level  # type: PriceLevel
+        self.prev = None  # type: OrderNode
+        self.next = None  # type: OrderNode
+
+
+class PriceLevel:
+    """
+    All resting orders with the same price, kept in doubly linked queue in the order they arrived,
+    so that any order can be removed without searching for it.
+    Keeps running total of their quantity and their count, so that the public orderbook entry
+    for this price can be created without walking through the orders.
+    """
+    def __init__(self, price: int, order_type: OrderType) -> None:
+        self.price = price  # type: int
+        self.type = order_type  # type: OrderType
+        self.head = None  # type: OrderNode
+        self.tail = None  # type: OrderNode
+        self.quantity = 0  # type: int
+        self.count = 0  # type: int
+
+    def append(self, order: Order) -> OrderNode:
+        """
+        Adds order to the end of the queue.
+
+        :param order: Order to be added.
+        :return: Node holding the order.
+        """
+        node = OrderNode(order, self)
+        if self.tail is None:
+            self.head = node
+        else:
+            node.prev = self.tail
+            self.tail.next = node
+        self.tail = node
+        self.quantity += order.quantity
+        self.count += 1
+        return node
+
+    def remove(self, node: OrderNode) -> None:
+        """
+        Unlinks node from the queue.
+
+        :param node: Node to be removed.
+        """
+        if node.prev is None:
+            self.head = node.next
+        else:
+            node.prev.next = node.next
+        if node.next is None:
+            self.tail = node.prev
+        else:
+            node.next.prev = node.prev
+        node.prev = node.next = None
+        self.quantity -= node.order.quantity
+        self.count -= 1
+
+    def decrease(self, node: OrderNode, quantity: int) -> None:
+        """
+        Decreases quantity of order resting in this level.
+
+        :param node: Node of the order whose quantity is decreased.
+        :param quantity: Amount by which the quantity is decreased.
+        """
+        node.order.decrease_quantity(quantity)
+        self.quantity -= quantity
+
+    def first(self) -> Order:
+        """
+        :return: Order with the highest time priority.
+        """
+        return self.head.order
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> Iterator[Order]:
+        node = self.head
+        while node is not None:
+            yield node.order
+            node = node.next
+
+
+class OrderBook:
+    """
+    In-memory orderbook for one side (orders of one type), keyed by price.
+
+    Keeps pointer to its best level (the one new orders of the opposite type are matched against first),
+    which is updated as levels are created and emptied, so that top of the book is available without
+    searching the tree. Best level of book of *ask* orders (BUY orders) has the highest price,
+    best level of book of *bid* orders (SELL orders) has the lowest price.
+    """
+    def __init__(self, order_type: OrderType) -> None:
+        self.type = order_type  # type: OrderType
+        self.levels = LOBTree()  # type: LOBTree[int, PriceLevel]
+        self.best = None  # type: PriceLevel
+        self.highest_is_best = order_type == OrderType.ask  # type: bool
+
+    def add(self, order: Order) -> OrderNode:
+        """
+        Adds order to the end of the level with its price, creating the level if needed.
+
+        :param order: Order to be added.
+        :return: Node holding the order.
+        """
+        level = self.levels.get(order.price, None)
+        if level is None:
+            level = PriceLevel(order.price, self.type)
+            self.levels[order.price] = level
+            if self.best is None or self._is_better(order.price, self.best.price):
+                self.best = level
+        return level.append(order)
+
+    def remove(self, node: OrderNode) -> PriceLevel:
+        """
+        Removes order from its level, removing the level if it becomes empty.
+
+        :param node: Node of the order to be removed.
+        :return: Level the order was removed from.
+        """
+        level = node.level
+        level.remove(node)
+        if level.count == 0:
+            del self.levels[level.price]
+            if level is self.best:
+                self._update_best()
+        return level
+
+    def _is_better(self, price: int, other_price: int) -> bool:
+        """
+        :return: True if level with *price* would come before level with *other_price* in matching.
+        """
+        if self.highest_is_best:
+            return price > other_price
+        return price < other_price
+
+    def _update_best(self) -> None:
+        """
+        Finds new best level in the tree, after the previous one was removed.
+        """
+        if not self.levels:
+            self.best = None
+        elif self.highest_is_best:
+            self.best = self.levels[self.levels.maxKey()]
+        else:
+            self.best = self.levels[self.levels.minKey()]
+
+    def best_price(self) -> int:
+        """
+        :return: Price of the best level, None if the book is empty.
+        """
+        if self.best is None:
+            return None
+        return self.best.price
+
+    def crosses(self, price: int) -> bool:
+        """
+        :param price: Price of new order of the opposite type.
+        :return: True if the new order can be matched against the best level of this book.
+        """
+        best = self.best
+        if best is None:
+            return False
+        if self.highest_is_best:
+            return best.price >= price
+        return best.price <= price
+
+    def get(self, price: int) -> PriceLevel:
+        """
+        :param price: Price of the level.
+        :return: Level with given price, or None if there is no order with such price.
+        """
+        return self.levels.get(price, None)
+
+    def __len__(self) -> int:
+        return len(self.levels)
+
+    def __iter__(self) -> Iterator[PriceLevel]:
+        return iter(self.levels.values())
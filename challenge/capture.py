@@ -0,0 +1,147 @@
+#!/usr/bin/env python3.5
+import json
+from asyncio import AbstractEventLoop, Handle
+from struct import Struct
+from time import time
+from typing import Dict, Any, List, Tuple
+
+MAGIC = b'XCAP'
+VERSION = 1
+# Magic, version and length of JSON with settings of the server.
+FILE_HEADER = Struct('<4sBI')
+# Wall clock time, connection id, kind and length of the payload.
+RECORD = Struct('<dIBI')
+
+LOGIN = 1
+MESSAGE = 2
+DISCONNECT = 3
+PUBLIC = 4
+
+Record = Tuple[float, int, int, Any]
+
+
+class Capture:
+    """
+    Capture of order flow, ie. of every inbound private message with its time and id of the connection
+    it came by, stored in compact binary file which can be replayed offline (see :class:`replay.Replay`).
+
+    File starts with header holding settings the messages depend on (symbols and their tick sizes), followed by
+    records of fixed size header (see *RECORD*) and payload. Kinds of records are login of connection
+    (payload is the username), decoded client message (compact JSON), disconnect of connection (no payload)
+    and public message published by the server (compact JSON, connection 0), which is the outcome
+    the replay is checked against.
+
+    Records are encoded when they are captured, so later changes of the messages do not affect them,
+    and written together every *window_ms* milliseconds.
+    """
+    def __init__(self, path: str, loop: AbstractEventLoop, settings: Dict[str, Any], window_ms: int = 100) -> None:
+        self.path = path  # type: str
+        self.loop = loop  # type: AbstractEventLoop
+        self.settings = settings  # type: Dict[str, Any]
+        self.window_ms = window_ms  # type: int
+        self.file = None
+        self.buffer = bytearray()  # type: bytearray
+        self.flush_handle = None  # type: Handle
+        self.connections = {}  # type: Dict[Any, int]
+        self.last_connection = 0  # type: int
+
+    def open(self) -> None:
+        """
+        Creates the capture file, overwriting existing one.
+        """
+        settings = json.dumps(self.settings, separators=(',', ':')).encode('utf-8')
+        self.file = open(self.path, 'wb')
+        self.file.write(FILE_HEADER.pack(MAGIC, VERSION, len(settings)) + settings)
+        self.file.flush()
+
+    def login(self, writer: Any, username: str) -> None:
+        """
+        Assigns id to newly logged in connection.
+
+        :param writer: Writer (or transport) of the connection.
+        :param username: User logged in by the connection.
+        """
+        self.last_connection += 1
+        self.connections[writer] = self.last_connection
+        self._append(self.last_connection, LOGIN, username.encode('utf-8'))
+
+    def message(self, writer: Any, data: Dict[str, Any]) -> None:
+        """
+        :param writer: Writer (or transport) of the connection the message came by.
+        :param data: Decoded client message.
+        """
+        self._append(self.connections.get(writer, 0), MESSAGE, json.dumps(data, separators=(',', ':')).encode('utf-8'))
+
+    def disconnect(self, writer: Any) -> None:
+        """
+        :param writer: Writer (or transport) of the disconnected connection.
+        """
+        connection = self.connections.pop(writer, None)
+        if connection is not None:
+            self._append(connection, DISCONNECT, b'')
+
+    def public(self, messages: List[Dict[str, Any]]) -> None:
+        """
+        :param messages: Public messages published together.
+        """
+        for data in messages:
+            self._append(0, PUBLIC, json.dumps(data, separators=(',', ':')).encode('utf-8'))
+
+    def _append(self, connection: int, kind: int, payload: bytes) -> None:
+        self.buffer += RECORD.pack(time(), connection, kind, len(payload))
+        self.buffer += payload
+        if self.flush_handle is None:
+            self.flush_handle = self.loop.call_later(self.window_ms / 1000, self.flush)
+
+    def flush(self) -> None:
+        """
+        Writes all buffered records to the file.
+        """
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if self.buffer:
+            self.file.write(self.buffer)
+            self.file.flush()
+            self.buffer = bytearray()
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
+
+    @staticmethod
+    def read(path: str) -> Tuple[Dict[str, Any], List[Record]]:
+        """
+        Reads capture file. Incomplete record at the end (left there eg. by crash during write) is ignored.
+
+        :param path: Path of the capture file.
+        :return: Settings of the server and records as tuples of time, connection id, kind and payload
+                 (username for logins, decoded message for client and public messages, None for disconnects).
+        """
+        with open(path, 'rb') as file:
+            data = file.read()
+        if len(data) < FILE_HEADER.size:
+            raise ValueError("File \"{}\" is not a capture".format(path))
+        magic, version, length = FILE_HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("File \"{}\" is not a capture of version {}".format(path, VERSION))
+        offset = FILE_HEADER.size + length
+        settings = json.loads(data[FILE_HEADER.size:offset].decode('utf-8'))
+        records = []
+        while len(data) - offset >= RECORD.size:
+            timestamp, connection, kind, length = RECORD.unpack_from(data, offset)
+            offset += RECORD.size
+            if len(data) - offset < length:
+                break
+            payload = data[offset:offset + length]
+            offset += length
+            if kind == LOGIN:
+                payload = payload.decode('utf-8')
+            elif kind == DISCONNECT:
+                payload = None
+            else:
+                payload = json.loads(payload.decode('utf-8'))
+            records.append((timestamp, connection, kind, payload))
+        return settings, records
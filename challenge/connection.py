@@ -0,0 +1,144 @@
+#!/usr/bin/env python3.5
+import logging
+from asyncio import Protocol, Transport
+from time import perf_counter
+from typing import Dict, Any
+
+from binary import BinaryProtocol, HEADER
+from models import User
+
+
+class PrivateConnection(Protocol):
+    """
+    Private client connection implemented directly on top of the transport, alternative to the stream based
+    handling in :class:`server.ExchangeServer`.
+
+    Received data are appended to one buffer, from which all complete messages (json lines, or frames if
+    *binary_protocol* is given) are decoded in place and passed synchronously to the server, without
+    any coroutine being resumed for them. Consumed part of the buffer is dropped once per received chunk.
+
+    Data received while the login is being processed stay in the buffer and are handled once the client
+    is logged in. While the transport has too much data waiting to be sent to the client,
+    reading from the client is paused.
+
+    Transport is used as the writer of the client everywhere in the server.
+    Message rejected by the server is answered by error message, data which cannot be decoded close the connection.
+    """
+    def __init__(self, server, binary_protocol: BinaryProtocol = None) -> None:
+        self.server = server  # type: ExchangeServer
+        self.binary_protocol = binary_protocol  # type: BinaryProtocol
+        self.transport = None  # type: Transport
+        self.buffer = bytearray()  # type: bytearray
+        self.user = None  # type: User
+        self.logging_in = False  # type: bool
+        self.closed = False  # type: bool
+        self.log = logging.getLogger('PrivateConnection')  # type: logging.Logger
+
+    def connection_made(self, transport: Transport) -> None:
+        self.transport = transport
+        if self.binary_protocol is not None:
+            self.server.binary_writers.add(transport)
+
+    def connection_lost(self, exc: Exception) -> None:
+        self.closed = True
+        self.server.binary_writers.discard(self.transport)
+        if self.server.capture is not None:
+            self.server.capture.disconnect(self.transport)
+        if self.user is not None and self.server.private_clients.get(self.user.username, (None, None))[1] \
+                is self.transport:
+            del self.server.private_clients[self.user.username]
+
+    def pause_writing(self) -> None:
+        self.transport.pause_reading()
+
+    def resume_writing(self) -> None:
+        self.transport.resume_reading()
+
+    def data_received(self, data: bytes) -> None:
+        self.buffer.extend(data)
+        self._process_buffer()
+
+    def _process_buffer(self) -> None:
+        """
+        Handles all complete messages in the buffer, until the buffer is exhausted
+        or the login starts (then the rest is handled once the login is done).
+        """
+        offset = 0
+        try:
+            while not self.logging_in and not self.closed:
+                data, offset = self._next_message(offset)
+                if data is None:
+                    break
+                if self.user is None:
+                    self.logging_in = True
+                    self.server.loop.create_task(self._login(data))
+                else:
+                    try:
+                        self.server._process_message(self.transport, data, self.user)
+                    except ValueError as e:
+                        self.server._send_error(self.transport, e)
+        except Exception:
+            self.log.exception("Invalid message from client, closing connection")
+            self.transport.close()
+            self.closed = True
+        if offset:
+            del self.buffer[:offset]
+
+    def _next_message(self, offset: int) -> (Dict[str, Any], int):
+        """
+        Decodes next complete message from the buffer.
+
+        :param offset: Position in the buffer where the message starts.
+        :return: Decoded message (None if it is not complete yet) and position after it.
+        """
+        buffer = self.buffer
+        if self.binary_protocol is None:
+            while True:
+                end = buffer.find(b'\n', offset)
+                if end < 0:
+                    return None, offset
+                if end > offset:  # empty lines are skipped
+                    start = perf_counter()
+                    data = self.server._decode_msg(buffer[offset:end])
+                    self.server.json_decode_time.observe(perf_counter() - start)
+                    return data, end + 1
+                offset = end + 1
+        if len(buffer) - offset < HEADER.size:
+            return None, offset
+        length, msg_type = HEADER.unpack_from(buffer, offset)
+        start = offset + HEADER.size
+        if len(buffer) - start < length:
+            return None, offset
+        body = bytes(buffer[start:start + length])
+        decode_start = perf_counter()
+        data = self.binary_protocol.decode(msg_type, body)
+        self.server.binary_decode_time.observe(perf_counter() - decode_start)
+        return data, start + length
+
+    async def _login(self, login_data: Dict[str, Any]) -> None:
+        """
+        Coroutine which logs the client in, and then handles messages received in the meantime.
+
+        :param login_data: Decoded login message.
+        """
+        try:
+            user, login_response = await self.server._login(login_data)
+        except Exception:
+            self.log.exception("Invalid login message from client, closing connection")
+            user, login_response = None, None
+        if self.closed:
+            return
+        if login_response is not None:
+            self.server._send_data(self.transport, login_response)
+        if user is None:
+            self.transport.close()
+            self.closed = True
+            self.server.log.debug("Client connection has been denied")
+            return
+        self.user = user
+        self.server.private_clients[user.username] = (None, self.transport)
+        if self.server.capture is not None:
+            self.server.capture.login(self.transport, user.username)
+        self.server.log.info("Client connected as \"{}\"".format(user.username))
+        self.logging_in = False
+        self._process_buffer()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3.5
+from asyncio import AbstractEventLoop, Handle
+from concurrent.futures import ThreadPoolExecutor, Future
+from time import time
+from typing import List, Tuple
+
+Event = Tuple[float, str, str, int, int, int, int]
+
+
+class EventLog:
+    """
+    Structured audit log of orderbook events (see :attr:`matching.MatchingEngine.events`), written off the event loop.
+
+    Recording an event only appends a tuple (time, symbol, event, order id, price in ticks, quantity,
+    counterparty order id) to a buffer, nothing is formatted on the event loop. All events recorded within
+    *window_ms* milliseconds from the first buffered one (or *window_events* events, whichever comes first)
+    are handed over to a single writer thread, which formats them as space separated lines and writes them
+    to the file, so neither formatting nor the file system delays matching.
+
+    Events are: buy and sell for created orders, replace (with the new price and quantity),
+    fill (with the resting counterparty order) and delete (with the quantity the order had when deleted).
+    """
+    def __init__(self, path: str, loop: AbstractEventLoop, window_ms: int = 100, window_events: int = 10000) -> None:
+        self.path = path  # type: str
+        self.loop = loop  # type: AbstractEventLoop
+        self.window_ms = window_ms  # type: int
+        self.window_events = window_events  # type: int
+        self.buffer = []  # type: List[Event]
+        self.file = None
+        self.executor = None  # type: ThreadPoolExecutor
+        self.flush_handle = None  # type: Handle
+        self.written = None  # type: Future
+
+    def open(self) -> None:
+        """
+        Opens the log for appending and starts the writer thread.
+        """
+        self.file = open(self.path, 'a')
+        self.executor = ThreadPoolExecutor(1)
+
+    def record(self, symbol: str, event: str, order_id: int, price: int, quantity: int, other_id: int = 0) -> None:
+        """
+        Adds event to the buffer.
+
+        :param symbol: Symbol of the instrument, None for the unnamed one.
+        :param event: Type of the event.
+        :param order_id: Id of the order.
+        :param price: Price in ticks.
+        :param quantity: Quantity of the order, or of the fill.
+        :param other_id: Id of the counterparty order of fill, 0 for other events.
+        """
+        self.buffer.append((time(), symbol, event, order_id, price, quantity, other_id))
+        if len(self.buffer) >= self.window_events:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = self.loop.call_later(self.window_ms / 1000, self.flush)
+
+    def flush(self) -> None:
+        """
+        Hands buffered events over to the writer thread.
+        """
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if not self.buffer:
+            return
+        events = self.buffer
+        self.buffer = []
+        self.written = self.executor.submit(self._write, events)
+
+    def _write(self, events: List[Event]) -> None:
+        """
+        Formats and writes events, runs in the writer thread.
+
+        :param events: Events to be written.
+        """
+        self.file.write(''.join('{:.6f} {} {} {} {} {} {}\n'.format(timestamp, '-' if symbol is None else symbol,
+                                                                    event, order_id, price, quantity, other_id)
+                                for timestamp, symbol, event, order_id, price, quantity, other_id in events))
+        self.file.flush()
+
+    def close(self) -> None:
+        """
+        Writes all buffered events, waits for the writer thread and closes the log.
+        """
+        if self.file is not None:
+            self.flush()
+            self.executor.shutdown(wait=True)
+            self.file.close()
+            self.file = None
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3.5
+import logging
+from asyncio import AbstractEventLoop, StreamWriter, Future, Task
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import Dict, Any, List, Set, Callable, Hashable, Tuple
+
+from metrics import Counter, Gauge, Histogram, SIZE_BUCKETS
+
+
+class Subscriber:
+    """
+    Public client with its own queue of pending messages and its own task writing them,
+    so that slow client does not delay the others.
+
+    While the client is behind, pending orderbook messages for the same side and price are conflated,
+    only the latest one is kept. Trades are never dropped. Client which has more than *max_lag*
+    pending messages even after conflation is disconnected.
+
+    Sequence numbers of conflated messages are sent to the client by *conflated* message before the next
+    pending messages, so that the client can tell them from lost messages.
+    """
+    def __init__(self, writer: StreamWriter, fanout: 'Fanout') -> None:
+        self.writer = writer  # type: StreamWriter
+        self.fanout = fanout  # type: Fanout
+        self.pending = OrderedDict()  # type: OrderedDict[Hashable, Tuple[int, bytes]]
+        self.conflated = set()  # type: Set[int]
+        self.trade_counter = 0  # type: int
+        self.waiter = None  # type: Future
+        self.closed = False  # type: bool
+        self.task = fanout.loop.create_task(self._run())  # type: Task
+
+    def put(self, sequence: int, key: Hashable, msg: bytes) -> None:
+        """
+        Adds encoded message to the queue of pending messages.
+        Message is dropped if newer message with the same key is already pending (eg. when it is retransmitted).
+
+        :param sequence: Sequence number of the message.
+        :param key: Conflation key of the message, messages with the same key replace each other.
+            None for messages which cannot be conflated.
+        :param msg: Message to be sent.
+        """
+        if self.closed:
+            return
+        if key is None:
+            self.trade_counter += 1
+            key = self.trade_counter
+        elif key in self.pending:
+            pending_sequence = self.pending[key][0]
+            if pending_sequence >= sequence:
+                if pending_sequence != sequence:
+                    self.conflated.add(sequence)
+                return
+            del self.pending[key]
+            self.conflated.add(pending_sequence)
+        self.pending[key] = (sequence, msg)
+        if len(self.pending) > self.fanout.max_lag:
+            self.fanout.lag_disconnects.inc()
+            self.fanout.log.info("Disconnecting public client lagging by {} messages".format(len(self.pending)))
+            self.close()
+
+    def retransmit(self, from_sequence: int) -> None:
+        """
+        Sends again published messages starting with given sequence number, after the messages already pending.
+        Orderbook messages are conflated with the pending ones, so retransmission adds at most one message
+        for each price level besides the trades.
+        If some of them are no longer kept by the fanout, snapshot of the whole orderbook is sent instead.
+
+        :param from_sequence: Sequence number of the first message to be sent.
+        """
+        messages = self.fanout.replay(from_sequence)
+        if messages is None:
+            self.fanout.log.info("Messages from {} are no longer kept, sending snapshot".format(from_sequence))
+            messages = [(self.fanout.sequence, None, self.fanout.snapshot())]
+        for sequence, key, msg in messages:
+            self.put(sequence, key, msg)
+        self.wake()
+
+    def wake(self) -> None:
+        """
+        Wakes up writing task, if it is waiting for new messages.
+        """
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    async def _run(self) -> None:
+        """
+        Coroutine which writes pending messages to the client, waiting for the client to receive them
+        before writing next ones. All messages pending at the time are sent by one write.
+        """
+        try:
+            while not self.closed:
+                if not self.pending:
+                    self.waiter = self.fanout.loop.create_future()
+                    await self.waiter
+                    continue
+                self.fanout.lag.observe(len(self.pending))
+                msg = b''.join(msg for _, msg in self.pending.values())
+                self.pending.clear()
+                if self.conflated:
+                    msg = self.fanout.encode({'type': 'conflated', 'seqs': sorted(self.conflated)}) + msg
+                    self.conflated.clear()
+                self.writer.write(msg)
+                await self.writer.drain()
+        except ConnectionError:
+            self.close()
+
+    def close(self) -> None:
+        """
+        Disconnects the client and stops sending messages to it.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.pending.clear()
+        self.conflated.clear()
+        self.task.cancel()
+        self.writer.close()
+        self.fanout.unsubscribe(self)
+
+
+class Fanout:
+    """
+    Distributes public messages to all subscribed public clients.
+    Each message is encoded only once, and the same encoded message is passed to all subscribers.
+
+    Published messages carry sequence number *seq*, which increases by one with each public message.
+    Last *history* encoded messages are kept, so that subscriber which missed some of them can ask
+    for their retransmission (see :meth:`Subscriber.retransmit`). Orderbook messages conflated for lagging
+    subscriber are not lost, the subscriber is told their sequence numbers.
+
+    Keeps aggregated depth of the orderbook, the latest encoded orderbook message of each price level
+    which is not empty, updated incrementally by published orderbook messages. Each change increases
+    *depth_sequence*. New subscriber receives snapshot message with sequence number of the last published message,
+    followed by the depth as one buffer, by one write. The buffer is joined again only when the depth changed
+    since it was last used.
+
+    Number of messages pending for subscriber is observed in *lag* each time they are written to it,
+    see :meth:`metrics`.
+    """
+    def __init__(self, loop: AbstractEventLoop, encode: Callable[[Dict[str, Any]], bytes], max_lag: int = 10000,
+                 history: int = 10000) -> None:
+        self.loop = loop  # type: AbstractEventLoop
+        self.encode = encode  # type: Callable[[Dict[str, Any]], bytes]
+        self.max_lag = max_lag  # type: int
+        self.subscribers = []  # type: List[Subscriber]
+        self.sequence = 0  # type: int
+        self.history = deque(maxlen=history)  # type: deque[Tuple[int, Hashable, bytes]]
+        self.depth = OrderedDict()  # type: OrderedDict[Hashable, bytes]
+        self.depth_sequence = 0  # type: int
+        self.depth_buffer = b''  # type: bytes
+        self.depth_buffer_sequence = 0  # type: int
+        self.lag = Histogram('exchange_public_lag_messages', 'Messages pending for public client when written to it.',
+                             SIZE_BUCKETS)  # type: Histogram
+        self.lag_disconnects = Counter('exchange_public_lag_disconnects_total',
+                                       'Public clients disconnected for lagging.')  # type: Counter
+        self.log = logging.getLogger('Fanout')  # type: logging.Logger
+
+    def metrics(self) -> List[Any]:
+        """
+        :return: Metrics of the fanout, to be registered in :class:`metrics.Metrics`.
+        """
+        return [Gauge('exchange_public_subscribers', 'Connected public clients.', lambda: len(self.subscribers)),
+                Gauge('exchange_public_max_lag_messages', 'Messages pending for the most lagging public client.',
+                      lambda: max((len(subscriber.pending) for subscriber in self.subscribers), default=0)),
+                self.lag,
+                self.lag_disconnects]
+
+    def subscribe(self, writer: StreamWriter) -> Subscriber:
+        """
+        Sends current depth of the orderbook to given client and starts sending public messages to it.
+
+        :param writer: Writer of the client.
+        :return: New subscriber.
+        """
+        writer.write(self.snapshot())
+        subscriber = Subscriber(writer, self)
+        self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        """
+        Stops sending public messages to given subscriber.
+
+        :param subscriber: Subscriber to be removed.
+        """
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+
+    def load_depth(self, messages: List[Dict[str, Any]]) -> None:
+        """
+        Replaces depth of the orderbook, without sending anything to subscribers.
+        Used when the orderbook is loaded without publishing its changes (eg. on start).
+
+        :param messages: Orderbook messages of all price levels.
+        """
+        self.depth.clear()
+        for data in messages:
+            self._update_depth(self._conflation_key(data), data, self.encode(data))
+
+    def _update_depth(self, key: Hashable, data: Dict[str, Any], msg: bytes) -> None:
+        """
+        :param key: Conflation key of the orderbook message, identifying its price level.
+        :param data: Orderbook message.
+        :param msg: Encoded message.
+        """
+        if data['quantity']:
+            self.depth[key] = msg
+        else:
+            self.depth.pop(key, None)
+        self.depth_sequence += 1
+
+    def depth_snapshot(self) -> bytes:
+        """
+        :return: Encoded orderbook messages of all price levels which are not empty, as one buffer.
+        """
+        if self.depth_buffer_sequence != self.depth_sequence:
+            self.depth_buffer = b''.join(self.depth.values())
+            self.depth_buffer_sequence = self.depth_sequence
+        return self.depth_buffer
+
+    def snapshot(self) -> bytes:
+        """
+        :return: Snapshot message with sequence number of the last published message, followed by the depth.
+        """
+        return self.encode({'type': 'snapshot', 'seq': self.sequence}) + self.depth_snapshot()
+
+    def replay(self, from_sequence: int) -> List[Tuple[int, Hashable, bytes]]:
+        """
+        :param from_sequence: Sequence number of the first message.
+        :return: Sequence numbers, conflation keys and encoded published messages starting with given sequence
+            number, None if some of them are no longer kept.
+        """
+        first = self.sequence - len(self.history) + 1
+        if from_sequence < first:
+            return None
+        return list(islice(self.history, from_sequence - first, None))
+
+    def publish(self, messages: List[Dict[str, Any]]) -> None:
+        """
+        Adds messages to queues of all subscribers and updates depth of the orderbook.
+        Messages published together are sent to each subscriber together, by one write.
+        Messages which do not change the depth are not even encoded while there is no subscriber,
+        messages are also kept for retransmission only while there are subscribers.
+
+        :param messages: Messages to be sent, with their sequence numbers.
+        """
+        encoded = []
+        for data in messages:
+            self.sequence = data['seq']
+            key = self._conflation_key(data)
+            if key is None and not self.subscribers:
+                continue
+            msg = self.encode(data)
+            if key is not None:
+                self._update_depth(key, data, msg)
+            encoded.append((data['seq'], key, msg))
+        if self.subscribers:
+            self.history.extend(encoded)
+        else:
+            self.history.clear()
+        for subscriber in list(self.subscribers):
+            for sequence, key, msg in encoded:
+                subscriber.put(sequence, key, msg)
+            subscriber.wake()
+
+    @classmethod
+    def conflate(cls, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Drops orderbook messages superseded by later message of the same price level, so that messages
+        published together do not leave gaps in sequence numbers when conflated by subscribers.
+
+        :param messages: Messages to be published together.
+        :return: Messages which are not superseded, in the original order.
+        """
+        last = {}
+        for index, data in enumerate(messages):
+            key = cls._conflation_key(data)
+            if key is not None:
+                last[key] = index
+        return [data for index, data in enumerate(messages)
+                if last.get(cls._conflation_key(data), index) == index]
+
+    @staticmethod
+    def _conflation_key(data: Dict[str, Any]) -> Hashable:
+        """
+        :param data: Message to be sent.
+        :return: Key under which messages are conflated, None if the message cannot be conflated.
+        """
+        if data['type'] == 'orderbook':
+            return data.get('symbol', None), data['side'], data['price']
+        return None
+
+    def close(self) -> None:
+        """
+        Disconnects all subscribers.
+        """
+        for subscriber in list(self.subscribers):
+            subscriber.close()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3.5
+import json
+import os
+from asyncio import AbstractEventLoop, Handle
+from time import perf_counter
+from typing import Dict, Any, List, Callable
+
+from metrics import Histogram, SIZE_BUCKETS
+
+
+class Journal:
+    """
+    Append-only journal of processed client messages, stored as one JSON line per message.
+
+    Records are not written one by one, but in groups: all records appended within *window_us* microseconds
+    from the first unwritten one (or *window_messages* records, whichever comes first) are written
+    and fsynced together. Callback of a record is called only after the record is durable,
+    so it can be used to release acknowledgments to the clients.
+
+    Duration of each write with fsync is observed in *flush_time*, number of records written by it in *flush_records*.
+    """
+    def __init__(self, path: str, loop: AbstractEventLoop, window_us: int = 1000, window_messages: int = 100) -> None:
+        self.path = path  # type: str
+        self.loop = loop  # type: AbstractEventLoop
+        self.window_us = window_us  # type: int
+        self.window_messages = window_messages  # type: int
+        self.sequence = 0  # type: int
+        self.file = None
+        self.pending = []  # type: List[bytes]
+        self.callbacks = []  # type: List[Callable[[], None]]
+        self.flush_handle = None  # type: Handle
+        self.flush_time = Histogram('exchange_commit_seconds', 'Time of persisting results of client messages.',
+                                    labels={'store': 'journal'})  # type: Histogram
+        self.flush_records = Histogram('exchange_journal_flush_records', 'Journal records written by one fsync.',
+                                       SIZE_BUCKETS)  # type: Histogram
+
+    def open(self) -> List[Dict[str, Any]]:
+        """
+        Opens the journal for appending.
+        Incomplete record at the end of the journal (left there eg. by crash during write) is cut off.
+
+        :return: All complete records already stored in the journal, in the order they were appended.
+        """
+        records = []
+        size = 0
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as file:
+                for line in file:
+                    if not line.endswith(b'\n'):
+                        break
+                    try:
+                        record = json.loads(line.decode('utf-8'))
+                    except ValueError:
+                        break
+                    records.append(record)
+                    size += len(line)
+        self.file = open(self.path, 'ab')
+        self.file.truncate(size)
+        if records:
+            self.sequence = records[-1]['seq']
+        return records
+
+    def append(self, record: Dict[str, Any], callback: Callable[[], None] = None) -> int:
+        """
+        Appends record to the journal. Record is assigned next sequence number under the *seq* key.
+
+        :param record: Record to be appended, has to be serializable to JSON.
+        :param callback: Function called once the record is durably stored.
+        :return: Sequence number of the record.
+        """
+        self.sequence += 1
+        record['seq'] = self.sequence
+        self.pending.append((json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8'))
+        if callback is not None:
+            self.callbacks.append(callback)
+        if len(self.pending) >= self.window_messages:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = self.loop.call_later(self.window_us / 1000000, self.flush)
+        return self.sequence
+
+    def flush(self) -> None:
+        """
+        Writes and fsyncs all pending records, then calls their callbacks.
+        """
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if not self.pending:
+            return
+        start = perf_counter()
+        self.file.write(b''.join(self.pending))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.flush_time.observe(perf_counter() - start)
+        self.flush_records.observe(len(self.pending))
+        callbacks = self.callbacks
+        self.pending = []
+        self.callbacks = []
+        for callback in callbacks:
+            callback()
+
+    def truncate(self) -> None:
+        """
+        Flushes pending records and removes all records from the journal, eg. after they were included in snapshot.
+        Sequence numbering continues from the last removed record.
+        """
+        self.flush()
+        self.file.truncate(0)
+        os.fsync(self.file.fileno())
+
+    def close(self) -> None:
+        """
+        Flushes pending records and closes the journal.
+        """
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
@@ -1,25 +1,149 @@
 #!/usr/bin/env python3.5
 import logging
 import asyncio
-from typing import Dict, Any, List
+from typing import Dict, Any, Iterable, Iterator, Mapping
 
-import transaction
 from BTrees.OOBTree import OOBTree
-from decimal import Decimal
-from persistent.list import PersistentList
+from eventlog import EventLog
 from models import OrderType, Order, User
+from book import OrderBook, OrderNode, PriceLevel
 from datetime import datetime
 
 
 class MatchingEngine:
     """
     Class which manages work with the DB and orderbook, and also does matching new orders.
+    Matching is done against in-memory orderbook, DB is only written to.
+    DB stores records of resting orders of each type (see :meth:`Order.to_record`) keyed by their id,
+    records are rewritten whenever the order changes.
+    Each order gets increasing priority stamp whenever it is put to the end of the queue of its price level,
+    ie. when it is inserted or when replace makes it lose its time priority.
+    If no DB trees are supplied, orders are kept only in memory (eg. when they are persisted by journal).
+
+    Engine does not commit changes itself, committing them is left to the caller,
+    so that all changes caused by one client message can be committed at once.
+
+    Each engine manages orderbook of one instrument. If *symbol* of the instrument is given,
+    it is included in all messages produced by the engine.
+
+    *users* are needed only to load orders already stored in DB, to find their owners.
+
+    Number of trades and their total quantity are counted in *trades* and *traded_quantity*.
+    If *events* is set, changes of orders are recorded into it (see :class:`eventlog.EventLog`).
+    Log messages are formatted only if their level is enabled.
     """
-    def __init__(self, bids: OOBTree, asks: OOBTree, server):
+    def __init__(self, bids: OOBTree, asks: OOBTree, server, symbol: str = None, users: Mapping[str, User] = None):
         self.bids = bids  # type: OOBTree
         self.asks = asks  # type: OOBTree
         self.server = server  # type: ExchangeServer
+        self.symbol = symbol  # type: str
+        self.bid_book = OrderBook(OrderType.bid)  # type: OrderBook
+        self.ask_book = OrderBook(OrderType.ask)  # type: OrderBook
+        self.order_index = {}  # type: Dict[int, OrderNode]
+        self.trades = 0  # type: int
+        self.traded_quantity = 0  # type: int
+        self.events = None  # type: EventLog
+        self.last_priority = 0  # type: int
         self.log = logging.getLogger('MatchingEngine')  # type: logging.Logger
+        self._load_books(users)
+
+    def _load_books(self, users: Mapping[str, User]) -> None:
+        """
+        Fills the in-memory orderbooks with orders already stored in DB.
+        Orders are loaded by their priority stamps, so that replaced orders keep their place in the queues.
+
+        :param users: Users by their username.
+        """
+        for storage in (self.bids, self.asks):
+            if storage is not None:
+                orders = [Order.from_record(order_id, record, users) for order_id, record in storage.items()]
+                orders.sort(key=lambda order: order.priority)
+                self.load_orders(orders)
+
+    def load_orders(self, orders: Iterable[Order]) -> None:
+        """
+        Adds already existing orders into the in-memory orderbooks, without matching them,
+        writing them into DB or notifying anyone about them.
+
+        Orders without priority stamp get new ones.
+
+        :param orders: Orders to be added, in their time priority order.
+        """
+        for order in orders:
+            if order.priority is None:
+                order.set_priority(self._next_priority())
+            else:
+                self.last_priority = max(self.last_priority, order.priority)
+            self.order_index[order.id] = self._get_book(order.type).add(order)
+
+    def _next_priority(self) -> int:
+        """
+        :return: Priority stamp for order put to the end of the queue of its price level.
+        """
+        self.last_priority += 1
+        return self.last_priority
+
+    def orders(self) -> Iterator[Order]:
+        """
+        :return: Iterator over all resting orders, orders with the same price are in their time priority order.
+        """
+        for book in (self.bid_book, self.ask_book):
+            for level in book:
+                yield from level
+
+    def get_order(self, order_id: int) -> Order:
+        """
+        Finds resting order by its id.
+
+        :param order_id: Id of the order.
+        :return: Order with given id, or None if there is no such order in the orderbook.
+        """
+        node = self.order_index.get(order_id, None)
+        if node is None:
+            return None
+        return node.order
+
+    def best_bid(self) -> int:
+        """
+        :return: Highest price of resting BUY orders in ticks, None if there is no such order.
+        """
+        return self.ask_book.best_price()
+
+    def best_ask(self) -> int:
+        """
+        :return: Lowest price of resting SELL orders in ticks, None if there is no such order.
+        """
+        return self.bid_book.best_price()
+
+    def _get_storage(self, order_type: OrderType) -> OOBTree:
+        """
+        :param order_type: Type of orders stored in the tree.
+        :return: DB tree for given order type, None if orders are not stored in DB.
+        """
+        if order_type == OrderType.bid:
+            return self.bids
+        else:
+            return self.asks
+
+    def _store_order(self, order: Order) -> None:
+        """
+        Writes current state of given order into DB.
+
+        :param order: Order to be written.
+        """
+        storage = self._get_storage(order.type)
+        if storage is not None:
+            storage[order.id] = order.to_record()
+
+    def _get_book(self, order_type: OrderType) -> OrderBook:
+        """
+        :param order_type: Type of orders stored in the book.
+        :return: In-memory orderbook for given order type.
+        """
+        if order_type == OrderType.bid:
+            return self.bid_book
+        else:
+            return self.ask_book
 
     def insert_order(self, order: Order, user: User, writer: asyncio.StreamWriter) -> None:
         """
@@ -29,62 +153,97 @@ class MatchingEngine:
         :param user: User inserting the order.
         :param writer: Writer associated with the user, used to notify him of results (eg. id of newly created order).
         """
-        storage = None
-        if order.type == OrderType.bid:
-            storage = self.bids
-        elif order.type == OrderType.ask:
-            storage = self.asks
-        if order.price in storage.keys():
-            storage[order.price].append(order)
-        else:
-            storage[order.price] = PersistentList([order])
-        user.orders[order.id] = order
-        transaction.commit()
-        self.log.info("New order created \"{}\"".format(order))
+        order.set_user(user)
+        order.set_priority(self._next_priority())
+        self._store_order(order)
+        node = self._get_book(order.type).add(order)
+        self.order_index[order.id] = node
+        self.log.info("New order created \"%s\"", order)
+        if self.events is not None:
+            self.events.record(self.symbol, 'buy' if order.type == OrderType.ask else 'sell', order.id, order.price,
+                               order.quantity)
         self.server.send_data({'type': 'orderCreated',
                                'id': order.id}, user=None, writer=writer)
 
-        data = self.get_price_sum_dict(storage[order.price])
+        data = self.get_level_dict(node.level)
         self.server.add_to_broadcast(data)
 
-    def delete_order(self, order: Order) -> None:
+    def delete_order(self, order: Order) -> PriceLevel:
         """
         Deletes given order from orderbook and DB.
 
         :param order: Order to be deleted
+        :return: Price level the order was deleted from.
         """
-        if order.type == OrderType.bid:
-            storage = self.bids
-        else:
-            storage = self.asks
-        order_list = storage[order.price]
-        order_list.remove(order)
-        if len(order_list) == 0:
-            del storage[order.price]
-        transaction.commit()
-        self.log.info("Order \"{}\" was deleted.".format(order))
-
-        if order.price in storage.keys():
-            data = self.get_price_sum_dict(storage[order.price])
-        else:
-            side = self._get_opposite_side(order.type)
-            data = self._make_price_sum_dict(side, order.price, 0)
+        storage = self._get_storage(order.type)
+        if storage is not None:
+            del storage[order.id]
+        node = self.order_index.pop(order.id)
+        level = self._get_book(order.type).remove(node)
+        self.log.info("Order \"%s\" was deleted.", order)
+        if self.events is not None:
+            self.events.record(self.symbol, 'delete', order.id, order.price, order.quantity)
+
+        data = self.get_level_dict(level)
         self.server.add_to_broadcast(data)
+        return level
 
-    @staticmethod
-    def _make_price_sum_dict(order_side: str, price: Decimal, quantity: int) -> Dict[str, Any]:
+    def replace_order(self, order: Order, price: int, quantity: int, writer: asyncio.StreamWriter) -> None:
+        """
+        Changes price and/or quantity of resting order, keeping its id.
+        If only the quantity is reduced, the order is changed in place and keeps its time priority.
+        Otherwise it is moved to the end of the queue of its new price and matched against the other side,
+        without being removed from the orderbook and inserted again.
+        Public entry of each changed price level is broadcasted only once.
+
+        :param order: Resting order to be changed.
+        :param price: New price in ticks, None if the price is not changed.
+        :param quantity: New quantity, None if the quantity is not changed.
+        :param writer: Writer of the user who owns the order.
+        """
+        if price is None:
+            price = order.price
+        if quantity is None:
+            quantity = order.quantity
+        node = self.order_index[order.id]
+        self.log.info("Replacing order \"%s\" by %s @ %s", order, quantity, price)
+        if self.events is not None:
+            self.events.record(self.symbol, 'replace', order.id, price, quantity)
+        self.server.send_data({'type': 'orderReplaced',
+                               'id': order.id}, user=None, writer=writer)
+        if price == order.price and quantity <= order.quantity:
+            node.level.decrease(node, order.quantity - quantity)
+            self._store_order(order)
+            self.server.add_to_broadcast(self.get_level_dict(node.level))
+            return
+
+        book = self._get_book(order.type)
+        old_level = book.remove(node)
+        order.set_price(price)
+        order.set_quantity(quantity)
+        order.set_priority(self._next_priority())
+        self._store_order(order)
+        self.order_index[order.id] = book.add(order)
+        if old_level.price != price:
+            self.server.add_to_broadcast(self.get_level_dict(old_level))
+        self.process_order(order, writer)
+
+    def _make_price_sum_dict(self, order_side: str, price: int, quantity: int) -> Dict[str, Any]:
         """
         Returns message dictionary for one orderbook entry with given parameters.
 
         :param order_side: Entry side (bid/ask).
-        :param price: Price of orders.
+        :param price: Price of orders in ticks.
         :param quantity: Sum of quantity of all orders with the same given price.
         :return: Dictionary representing message to be sent to client.
         """
-        return {'type': 'orderbook',
+        data = {'type': 'orderbook',
                 'side': order_side,
                 'price': price,
                 'quantity': quantity}
+        if self.symbol is not None:
+            data['symbol'] = self.symbol
+        return data
 
     @staticmethod
     def _get_opposite_side(order_type: OrderType) -> str:
@@ -103,38 +262,33 @@ class MatchingEngine:
         else:
             return OrderType.ask.name
 
-    @staticmethod
-    def get_price_sum_dict(order_list: List[Order]) -> Dict[str, Any]:
+    def get_level_dict(self, level: PriceLevel) -> Dict[str, Any]:
         """
-        Sums all orders with the same price and returns message representing this public orderbook entry.
+        Returns message representing public orderbook entry for given price level.
+        Uses running total of the level, so it does not depend on the number of orders in it.
 
-        :param order_list: List of orders to sum
+        :param level: Level for which the entry is created.
         :return: Dictionary representing message to be sent to user.
         """
-        if not order_list:
-            return None
-        sum_quantity = 0
-        price = order_list[0].price
-        order_side = MatchingEngine._get_opposite_side(order_list[0].type)
-        for order in order_list:
-            sum_quantity += order.quantity
-        return MatchingEngine._make_price_sum_dict(order_side,
-                                                   price,
-                                                   sum_quantity)
+        return self._make_price_sum_dict(self._get_opposite_side(level.type),
+                                         level.price,
+                                         level.quantity)
 
-    @staticmethod
-    def _get_exec_report_dict(amount: int, price: Decimal) -> Dict[str, Any]:
+    def _get_exec_report_dict(self, amount: int, price: int) -> Dict[str, Any]:
         """
         Return dictionary representing message with trade information.
 
         :param amount: Amount that was traded.
-        :param price: At which the trade happened.
+        :param price: Price in ticks at which the trade happened.
         :return: Dictionary representing message to be sent to user.
         """
-        return {'type': 'trade',
+        data = {'type': 'trade',
                 'time': datetime.now().timestamp(),
                 'price': price,
                 'quantity': amount}
+        if self.symbol is not None:
+            data['symbol'] = self.symbol
+        return data
 
     def _match_orders(self, order1: Order, order2: Order, writer1: asyncio.StreamWriter) -> bool:
         """
@@ -151,32 +305,37 @@ class MatchingEngine:
         matched_amount = min(order1.quantity, order2.quantity)
         matched_price = order2.price
         matched_whole = False
+        if self.events is not None:
+            self.events.record(self.symbol, 'fill', order1.id, matched_price, matched_amount, order2.id)
 
         if matched_amount == order1.quantity:
             self.delete_order(order1)
             matched_whole = True
         else:
-            order1.decrease_quantity(matched_amount)
+            node1 = self.order_index[order1.id]
+            node1.level.decrease(node1, matched_amount)
+            self._store_order(order1)
+        level2 = None
         if matched_amount == order2.quantity:
             self.delete_order(order2)
         else:
-            order2.decrease_quantity(matched_amount)
-        transaction.commit()
-        self.log.info("Matched \"{}\" and \"{}\"".format(order1, order2))
+            node2 = self.order_index[order2.id]
+            level2 = node2.level
+            level2.decrease(node2, matched_amount)
+            self._store_order(order2)
+        self.trades += 1
+        self.traded_quantity += matched_amount
+        self.log.info("Matched \"%s\" and \"%s\"", order1, order2)
 
         report = self._get_exec_report_dict(matched_amount, matched_price)
         self.server.send_data(report, None, writer1)
         self.server.send_data(report, order2.user, None)
 
-        if order1.type == OrderType.ask:
-            order_list2 = self.bids.get(order2.price, None)
-        else:
-            order_list2 = self.asks.get(order2.price, None)
-
         data = self._get_exec_report_dict(matched_amount, matched_price)
         self.server.add_to_broadcast(data)
-        data = self.get_price_sum_dict(order_list2)
-        self.server.add_to_broadcast(data)
+        if level2 is not None:  # deleted order was already broadcasted by delete_order
+            data = self.get_level_dict(level2)
+            self.server.add_to_broadcast(data)
 
         return matched_whole
 
@@ -188,33 +347,19 @@ class MatchingEngine:
         :param order: New order to be matched.
         :param writer: Writer of the user who placed the new order.
         """
-        def matching_loop(storage, extreme_key_func, compare_check_func):
-            matched_whole = False
-            while not matched_whole:
-                try:
-                    extreme_key = extreme_key_func()
-                    if compare_check_func(extreme_key, order.price):
-                        break
-                    matched_order = storage[extreme_key][0]
-                except ValueError:
-                    break
-                matched_whole = self._match_orders(order, matched_order, writer)
-            return matched_whole
-
-        self.log.debug("Starting matching of \"{}\"".format(order))
+        self.log.debug("Starting matching of \"%s\"", order)
         if order.type == OrderType.bid:
-            matched_storage = self.asks
-            original_storage = self.bids
-            extreme_key_func = self.asks.maxKey
-            matched_whole = matching_loop(matched_storage, extreme_key_func, lambda x, y: x < y)
+            matched_book = self.ask_book
+            original_book = self.bid_book
         else:
-            matched_storage = self.bids
-            original_storage = self.asks
-            extreme_key_func = self.bids.minKey
-            matched_whole = matching_loop(matched_storage, extreme_key_func, lambda x, y: x > y)
+            matched_book = self.bid_book
+            original_book = self.ask_book
+        matched_whole = False
+        while not matched_whole and matched_book.crosses(order.price):
+            matched_whole = self._match_orders(order, matched_book.best.first(), writer)
 
         if not matched_whole:
-            data = self.get_price_sum_dict(original_storage[order.price])
+            data = self.get_level_dict(original_book.get(order.price))
             self.server.add_to_broadcast(data)
 
-        self.log.debug("Stopped matching of \"{}\"".format(order))
+        self.log.debug("Stopped matching of \"%s\"", order)
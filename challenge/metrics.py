@@ -0,0 +1,200 @@
+#!/usr/bin/env python3.5
+import logging
+from asyncio import StreamReader, StreamWriter
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Dict, Any, List, Tuple, Callable
+
+# Bucket bounds of latency histograms in seconds, from one microsecond to ten seconds.
+LATENCY_BUCKETS = (0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                   0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Bucket bounds of histograms of message counts.
+SIZE_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+Sample = Tuple[str, Dict[str, str], Any]
+
+
+class Counter:
+    """
+    Monotonically increasing count. If *function* is given, the count is not increased by :meth:`inc`,
+    but read from the function when the metrics are collected (eg. from plain attribute counted elsewhere).
+    """
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels: Dict[str, str] = None, function: Callable[[], int] = None) -> None:
+        self.name = name  # type: str
+        self.help = help  # type: str
+        self.labels = dict(labels or {})  # type: Dict[str, str]
+        self.function = function  # type: Callable[[], int]
+        self.value = 0  # type: int
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+    def samples(self) -> List[Sample]:
+        return [(self.name, self.labels, self.value if self.function is None else self.function())]
+
+
+class LabeledCounter:
+    """
+    Counts of events distinguished by values of *label_names*, for labels whose values are known only when
+    the events happen (eg. the function running when the event loop stalled). Each combination of values
+    is rendered as separate sample.
+    """
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, label_names: Tuple[str, ...], labels: Dict[str, str] = None) -> None:
+        self.name = name  # type: str
+        self.help = help  # type: str
+        self.labels = dict(labels or {})  # type: Dict[str, str]
+        self.label_names = tuple(label_names)  # type: Tuple[str, ...]
+        self.values = OrderedDict()  # type: Dict[Tuple[str, ...], int]
+
+    def inc(self, *label_values: str) -> None:
+        """
+        :param label_values: Values of the labels, in the order of *label_names*.
+        """
+        self.values[label_values] = self.values.get(label_values, 0) + 1
+
+    def samples(self) -> List[Sample]:
+        samples = []
+        for label_values, value in self.values.items():
+            labels = dict(self.labels)
+            labels.update(zip(self.label_names, label_values))
+            samples.append((self.name, labels, value))
+        return samples
+
+
+class Gauge:
+    """
+    Current value, read from *function* when the metrics are collected, so it costs nothing between collections.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, function: Callable[[], Any], labels: Dict[str, str] = None) -> None:
+        self.name = name  # type: str
+        self.help = help  # type: str
+        self.labels = dict(labels or {})  # type: Dict[str, str]
+        self.function = function  # type: Callable[[], Any]
+
+    def samples(self) -> List[Sample]:
+        return [(self.name, self.labels, self.function())]
+
+
+class Histogram:
+    """
+    Distribution of observed values in fixed buckets. Observing a value is one bisection and two additions,
+    cumulative counts of the buckets are computed only when the metrics are collected.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, buckets: Tuple = LATENCY_BUCKETS, labels: Dict[str, str] = None) -> None:
+        self.name = name  # type: str
+        self.help = help  # type: str
+        self.labels = dict(labels or {})  # type: Dict[str, str]
+        self.buckets = tuple(buckets)  # type: Tuple
+        self.counts = [0] * (len(self.buckets) + 1)  # type: List[int]
+        self.sum = 0  # type: float
+
+    def observe(self, value: float) -> None:
+        """
+        :param value: Observed value, eg. duration in seconds.
+        """
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def samples(self) -> List[Sample]:
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            labels = dict(self.labels)
+            labels['le'] = str(bound)
+            samples.append((self.name + '_bucket', labels, cumulative))
+        samples.append((self.name + '_sum', self.labels, self.sum))
+        samples.append((self.name + '_count', self.labels, cumulative))
+        return samples
+
+
+class Metrics:
+    """
+    Registry of counters, gauges and histograms, rendered in Prometheus text format.
+
+    Components keep their own metric objects and update them directly, the registry only collects them.
+    Metrics of the same name (differing by labels) are rendered together under one header.
+
+    :meth:`handle_request` serves the metrics on the stats port, either to HTTP GET request,
+    or to any line sent over plain TCP connection.
+    """
+    def __init__(self) -> None:
+        self.metrics = []  # type: List[Any]
+        self.log = logging.getLogger('Metrics')  # type: logging.Logger
+
+    def register(self, metric: Any, **labels: str) -> Any:
+        """
+        :param metric: Counter, gauge or histogram to be collected.
+        :param labels: Labels added to the metric, eg. to distinguish instances of the same component.
+        :return: The metric.
+        """
+        metric.labels.update(labels)
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, function: Callable[[], int] = None, **labels: str) -> Counter:
+        return self.register(Counter(name, help, labels, function))
+
+    def gauge(self, name: str, help: str, function: Callable[[], Any], **labels: str) -> Gauge:
+        return self.register(Gauge(name, help, function, labels))
+
+    def histogram(self, name: str, help: str, buckets: Tuple = LATENCY_BUCKETS, **labels: str) -> Histogram:
+        return self.register(Histogram(name, help, buckets, labels))
+
+    def render(self) -> str:
+        """
+        :return: Current values of all metrics in Prometheus text format.
+        """
+        groups = OrderedDict()
+        for metric in self.metrics:
+            groups.setdefault(metric.name, []).append(metric)
+        lines = []
+        for name, metrics in groups.items():
+            lines.append('# HELP {} {}'.format(name, metrics[0].help))
+            lines.append('# TYPE {} {}'.format(name, metrics[0].kind))
+            for metric in metrics:
+                for sample_name, labels, value in metric.samples():
+                    lines.append('{}{} {}'.format(sample_name, self._format_labels(labels), value))
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _format_labels(labels: Dict[str, str]) -> str:
+        if not labels:
+            return ''
+        return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                              for key, value in labels.items()) + '}'
+
+    async def handle_request(self, reader: StreamReader, writer: StreamWriter) -> None:
+        """
+        Coroutine which answers one request on the stats port and closes the connection.
+
+        :param reader: Reader of the client.
+        :param writer: Writer of the client.
+        """
+        try:
+            request = await reader.readline()
+            body = self.render().encode('utf-8')
+            if request.startswith(b'GET '):
+                while (await reader.readline()).strip():  # skip headers
+                    pass
+                writer.write(b'HTTP/1.0 200 OK\r\n'
+                             b'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                             b'Content-Length: ' + str(len(body)).encode('ascii') + b'\r\n\r\n')
+            writer.write(body)
+            await writer.drain()
+        except ConnectionError:
+            self.log.debug("Stats client disconnected")
+        finally:
+            writer.close()
@@ -1,23 +1,26 @@
 #!/usr/bin/env python3.5
 import asyncio
-from uuid import UUID
 from persistent import Persistent
+from ZODB.broken import find_global
 from bcrypt import hashpw, gensalt
 from enum import Enum
+from typing import Tuple, Mapping, Any
 from decimal import Decimal
-from persistent.dict import PersistentDict
 
 
 def get_passw_hash(password, salt=gensalt()):
     return hashpw(password.encode('utf-8'), salt)
 
 
+def check_passw_hash(password, passw_hash):
+    return get_passw_hash(password, passw_hash) == passw_hash
+
+
 class User(Persistent):
     def __init__(self) -> None:
         self.username = None  # type: str
         self.password = None  # type: bytes
         self.writer = None  # type: asyncio.StreamWriter
-        self.orders = PersistentDict()  # type: PersistentDict[int, Order]
 
     def set_username(self, username: str) -> None:
         self.username = username
@@ -25,8 +28,11 @@ class User(Persistent):
     def set_password(self, password: str) -> None:
         self.password = get_passw_hash(password)
 
+    def set_password_hash(self, passw_hash: bytes) -> None:
+        self.password = passw_hash
+
     def check_password(self, password: str) -> bool:
-        return get_passw_hash(password, self.password) == self.password
+        return check_passw_hash(password, self.password)
 
 
 class OrderType(Enum):
@@ -34,13 +40,24 @@ class OrderType(Enum):
     ask = 2
 
 
-class Order(Persistent):
+class Order:
+    """
+    Resting order kept in the in-memory orderbook.
+    Uses slots instead of instance dictionary, so that millions of orders fit into memory.
+    Price is integer number of ticks (see :class:`ticks.TickSize`).
+    Orders are not persistent themselves, they are stored into DB as records created by :meth:`to_record`.
+    Priority is increasing stamp given to the order when it gets to the end of the queue of its price level
+    (see :class:`matching.MatchingEngine`), so that the queue can be restored from DB.
+    """
+    __slots__ = ('type', 'user', 'price', 'quantity', 'id', 'priority')
+
     def __init__(self) -> None:
         self.type = None  # type: OrderType
         self.user = None  # type: User
-        self.price = None  # type: Decimal
+        self.price = None  # type: int
         self.quantity = None  # type: int
-        self.id = None  # type: UUID
+        self.id = None  # type: int
+        self.priority = None  # type: int
 
     def set_type(self, order_type: OrderType):
         self.type = order_type
@@ -48,7 +65,7 @@ class Order(Persistent):
     def set_user(self, user: User):
         self.user = user
 
-    def set_price(self, price: Decimal):
+    def set_price(self, price: int):
         self.price = price
 
     def set_quantity(self, quantity: int):
@@ -60,3 +77,61 @@ class Order(Persistent):
 
     def set_id(self, id: int):
         self.id = id
+
+    def set_priority(self, priority: int):
+        self.priority = priority
+
+    def to_record(self) -> Tuple[int, int, int, str, int]:
+        """
+        Record refers to the owner only by username, so that storing it does not involve persistent references.
+
+        :return: Record of the order stored in DB under its id.
+        """
+        return self.type.value, self.price, self.quantity, self.user.username, self.priority
+
+    @staticmethod
+    def from_record(order_id: int, record: Tuple[int, int, int, str, int], users: Mapping[str, User]) -> 'Order':
+        """
+        Creates order from record stored in DB.
+
+        :param order_id: Id under which the record is stored.
+        :param record: Record created by :meth:`to_record`.
+        :param users: Users by their username, used to find owner of the order.
+        :return: New order.
+        """
+        type_value, price, quantity, username, priority = record
+        order = Order()
+        order.set_id(order_id)
+        order.set_type(OrderType(type_value))
+        order.set_price(price)
+        order.set_quantity(quantity)
+        order.set_user(users[username])
+        order.set_priority(priority)
+        return order
+
+
+class LegacyOrder(Persistent):
+    """
+    Order as stored by older versions, which kept persistent orders in DB (under their price in lists, later under
+    their id), with prices as Decimal. It is used only to read such DB, so that it can be converted.
+    """
+    def __init__(self) -> None:
+        self.type = None  # type: OrderType
+        self.user = None  # type: User
+        self.price = None  # type: Decimal
+        self.quantity = None  # type: int
+        self.id = None  # type: Any
+
+
+def class_factory(connection, module_name: str, global_name: str) -> type:
+    """
+    Class factory of ZODB.DB, which reads persistent orders of older versions as :class:`LegacyOrder`.
+
+    :param connection: Connection the object is read by.
+    :param module_name: Module of the stored class.
+    :param global_name: Name of the stored class.
+    :return: Class of the object.
+    """
+    if module_name == 'models' and global_name == 'Order':
+        return LegacyOrder
+    return find_global(module_name, global_name)
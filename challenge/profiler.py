@@ -0,0 +1,257 @@
+#!/usr/bin/env python3.5
+import logging
+import os
+import sys
+import threading
+import time
+from asyncio import AbstractEventLoop, Handle
+from collections import Counter, deque
+from typing import Dict, List, Tuple, Callable, Deque, Set
+
+from metrics import Histogram, LabeledCounter
+
+# Directory of the server modules, stalls are attributed to the innermost function defined in them.
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))  # type: str
+
+# Functions whose frames attribute the sample to a part of the server, the innermost one wins.
+CATEGORIES = {
+    ('server.py', '_handle_client'): 'private',
+    ('connection.py', 'data_received'): 'private',
+    ('server.py', '_accept_client'): 'login',
+    ('matching.py', 'process_order'): 'matching',
+    ('server.py', '_broadcast_public'): 'broadcast',
+    ('fanout.py', '_run'): 'broadcast',
+    ('_manager.py', 'commit'): 'commit',
+    ('journal.py', 'flush'): 'commit',
+    ('selectors.py', 'select'): 'idle',
+}  # type: Dict[Tuple[str, str], str]
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler of one thread (the thread running the event loop), which can be started and stopped
+    while the server runs.
+
+    Separate thread takes stack of the profiled thread every *interval* seconds, the profiled thread
+    is not instrumented in any way. Stacks are kept in collapsed form (frames from the outermost one
+    separated by semicolons) with the number of their samples, which is the input of flame graph tools.
+    Each stack starts with category of the sample (see *CATEGORIES*), so the flame graph is split
+    into private clients, matching, broadcasting, commits, idle time waiting for events and the rest.
+    Frames are file names and functions, with spaces replaced, as the number of samples follows a space.
+    """
+    def __init__(self, thread_id: int, interval: float = 0.001) -> None:
+        self.thread_id = thread_id  # type: int
+        self.interval = interval  # type: float
+        self.stacks = Counter()  # type: Counter
+        self.stopped = threading.Event()  # type: threading.Event
+        self.thread = None  # type: threading.Thread
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None
+
+    def start(self) -> None:
+        self.stacks.clear()
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._run, name='SamplingProfiler', daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
+
+    def _run(self) -> None:
+        """
+        Takes samples until the profiler is stopped, runs in the profiler thread.
+        """
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[self._collapse(frame)] += 1
+
+    @staticmethod
+    def _collapse(frame) -> str:
+        """
+        :param frame: Innermost frame of the stack.
+        :return: Category and frames of the stack from the outermost one, separated by semicolons.
+        """
+        frames = []
+        category = None
+        while frame is not None:
+            code = frame.f_code
+            key = (os.path.basename(code.co_filename), code.co_name)
+            if category is None:
+                category = CATEGORIES.get(key, None)
+            frames.append('{}:{}'.format(*key).replace(' ', '_'))
+            frame = frame.f_back
+        frames.append(category or 'other')
+        return ';'.join(reversed(frames))
+
+    def collapsed(self) -> List[str]:
+        """
+        :return: Lines of collapsed stacks with their number of samples, the most frequent first.
+        """
+        return ['{} {}'.format(stack, count) for stack, count in self.stacks.most_common()]
+
+
+class StallMonitor:
+    """
+    Measures stalls of the event loop, ie. times when the loop did not run its callbacks, because
+    a callback (or coroutine step) was running for too long.
+
+    Heartbeat callback is scheduled every *interval* seconds, its delay after the scheduled time is the stall.
+    Stalls longer than *threshold* seconds are kept as pairs of wall clock time of their end and their duration.
+    """
+    def __init__(self, loop: AbstractEventLoop, threshold: float, interval: float = 0.01) -> None:
+        self.loop = loop  # type: AbstractEventLoop
+        self.threshold = threshold  # type: float
+        self.interval = interval  # type: float
+        self.stalls = []  # type: List[Tuple[float, float]]
+        self.expected = None  # type: float
+        self.handle = None  # type: Handle
+
+    def start(self) -> None:
+        self.stalls = []
+        self._schedule()
+
+    def stop(self) -> None:
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+
+    def _schedule(self) -> None:
+        self.expected = self.loop.time() + self.interval
+        self.handle = self.loop.call_at(self.expected, self._heartbeat)
+
+    def _heartbeat(self) -> None:
+        stall = self.loop.time() - self.expected
+        if stall > self.threshold:
+            self.stalls.append((time.time(), stall))
+        self._schedule()
+
+    def report(self) -> List[str]:
+        """
+        :return: Lines with time and duration in milliseconds of each stall, followed by summary line.
+        """
+        lines = ['{:.6f} {:.3f}'.format(end, stall * 1000) for end, stall in self.stalls]
+        lines.append('stalls {} max_ms {:.3f} total_ms {:.3f}'.format(
+            len(self.stalls), max((stall for _, stall in self.stalls), default=0) * 1000,
+            sum(stall for _, stall in self.stalls) * 1000))
+        return lines
+
+
+class StallWatchdog(StallMonitor):
+    """
+    Continuously running :class:`StallMonitor`, which also tells what blocked the event loop.
+
+    Every heartbeat delay is observed by the *lag* histogram. While the loop is blocked, no heartbeat can
+    report it, so separate thread watches time of the last heartbeat: once it is older than *threshold*
+    past its schedule, the thread takes stack of the event loop thread and notes the innermost server
+    function on it (the handler) and type of the client message being processed, as told by *message*.
+    When the loop gets unblocked, the heartbeat records the stall with that handler and message type,
+    counts it by them and logs it. The last *history* stalls are kept for :meth:`report`.
+
+    Watchdog has to be started in the event loop thread before the loop runs, frames of that moment run
+    the loop and are not considered handlers. When no server function is running, the handler is the
+    innermost function (eg. in asyncio itself). Stalls shorter than the polling interval of the thread
+    may end before the thread notices them, their handler and message type are "unknown".
+    """
+    def __init__(self, loop: AbstractEventLoop, thread_id: int, threshold: float, message: Callable[[], str],
+                 interval: float = 0.01, history: int = 100) -> None:
+        super().__init__(loop, threshold, interval)
+        self.thread_id = thread_id  # type: int
+        self.message = message  # type: Callable[[], str]
+        self.stalls = deque(maxlen=history)  # type: Deque[Tuple[float, float, str, str]]
+        self.beat = None  # type: float
+        self.suspect = None  # type: Tuple[float, str, str]
+        self.loop_frames = set()  # type: Set[int]
+        self.stopped = threading.Event()  # type: threading.Event
+        self.thread = None  # type: threading.Thread
+        self.lag = Histogram('exchange_loop_lag_seconds',
+                             'Delay of event loop heartbeat after its scheduled time.')  # type: Histogram
+        self.stall_time = Histogram('exchange_loop_stall_seconds',
+                                    'Duration of event loop stalls longer than threshold.')  # type: Histogram
+        self.stall_counts = LabeledCounter('exchange_loop_stalls_total',
+                                           'Event loop stalls by the handler and message type which caused them.',
+                                           ('handler', 'message'))  # type: LabeledCounter
+        self.log = logging.getLogger('StallWatchdog')  # type: logging.Logger
+
+    def metrics(self) -> List:
+        return [self.lag, self.stall_time, self.stall_counts]
+
+    def start(self) -> None:
+        frame = sys._getframe(1)
+        self.loop_frames = set()
+        while frame is not None:
+            self.loop_frames.add(id(frame))
+            frame = frame.f_back
+        self.stalls.clear()
+        self.beat = time.monotonic()
+        self._schedule()
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._watch, name='StallWatchdog', daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        super().stop()
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join()
+            self.thread = None
+
+    def _heartbeat(self) -> None:
+        previous = self.beat
+        self.beat = time.monotonic()
+        stall = self.loop.time() - self.expected
+        self.lag.observe(max(stall, 0))
+        if stall > self.threshold:
+            suspect = self.suspect
+            if suspect is not None and suspect[0] == previous:
+                handler, message = suspect[1], suspect[2]
+            else:
+                handler, message = 'unknown', 'unknown'
+            self.stalls.append((time.time(), stall, handler, message))
+            self.stall_time.observe(stall)
+            self.stall_counts.inc(handler, message)
+            self.log.warning("Event loop stalled for %.3f ms in %s processing %s", stall * 1000, handler, message)
+        self._schedule()
+
+    def _watch(self) -> None:
+        """
+        Notes what blocks the event loop once the heartbeat is late by more than threshold,
+        runs in the watchdog thread.
+        """
+        poll = min(self.interval, self.threshold / 4)
+        while not self.stopped.wait(poll):
+            beat = self.beat
+            suspect = self.suspect
+            if time.monotonic() - beat > self.interval + self.threshold and (suspect is None or suspect[0] != beat):
+                self.suspect = (beat, self._handler(sys._current_frames().get(self.thread_id)),
+                                self.message() or 'none')
+
+    def _handler(self, frame) -> str:
+        """
+        :param frame: Innermost frame of the stack, None if the thread is not running.
+        :return: File and name of the innermost function of the server on the stack above frames running the loop,
+                 or of the innermost function if there is none.
+        """
+        if frame is None:
+            return 'other'
+        innermost = frame.f_code
+        while frame is not None and id(frame) not in self.loop_frames:
+            if os.path.dirname(os.path.abspath(frame.f_code.co_filename)) == SERVER_DIR:
+                innermost = frame.f_code
+                break
+            frame = frame.f_back
+        return '{}:{}'.format(os.path.basename(innermost.co_filename), innermost.co_name)
+
+    def report(self) -> List[str]:
+        """
+        :return: Lines with time, duration in milliseconds, handler and message type of the last stalls,
+                 followed by summary line of all stalls since the start.
+        """
+        lines = ['{:.6f} {:.3f} {} {}'.format(end, stall * 1000, handler, message)
+                 for end, stall, handler, message in self.stalls]
+        lines.append('stalls {} total_ms {:.3f}'.format(self.stall_time.count, self.stall_time.sum * 1000))
+        return lines
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3.5
+import argparse
+import logging
+import sys
+import time
+from time import perf_counter
+from typing import Dict, Any, List, Tuple
+
+import transaction
+import ZODB
+
+from capture import Capture, Record, LOGIN, DISCONNECT, PUBLIC
+from models import User, Order, OrderType
+from server import ExchangeServer
+
+
+class NullWriter:
+    """
+    Writer of replayed connection. Messages for the client are encoded as for connected one, but dropped.
+    """
+    def write(self, data: bytes) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class Replay:
+    """
+    Replays captured order flow (see :class:`capture.Capture`) through fresh matching engines of server
+    with in-memory DB, and checks that its outcome is identical to the outcome of the captured run.
+
+    Books start with orders which were resting when the capture started, loaded in their captured queue order,
+    and order ids continue from the last id used before it. Captured client messages are processed by :meth:`server.ExchangeServer._process_message`,
+    as if they came by their connections, either at maximum speed or at the recorded pace (scaled by *speed*).
+    Rejected message (eg. with price off the tick grid) is answered by error message and its connection
+    is replayed further, connection whose message fails otherwise is not, as the server handles them the same way.
+
+    Trades (without their time) have to be the same and in the same order as the captured ones,
+    and all price levels changed during the capture have to end with the same quantity.
+    Orderbook messages published in between may differ by how they were batched.
+    """
+    def __init__(self, settings: Dict[str, Any], records: List[Record]) -> None:
+        self.records = records  # type: List[Record]
+        self.published = []  # type: List[Dict[str, Any]]
+        self.connections = {}  # type: Dict[int, Tuple[NullWriter, User]]
+        self.messages = 0  # type: int
+        self.rejected = 0  # type: int
+        self.failed = 0  # type: int
+        symbols = settings['symbols']
+        self.server = ExchangeServer(None, None, symbols=symbols,
+                                     tick_sizes=dict(zip(symbols, settings['tick_sizes'])))  # type: ExchangeServer
+        self.server.init_db(ZODB.DB(None))
+        self.server.broadcast_queue = self
+        self.server.id_counter = settings['last_id']
+        self.server._create_matching_engines()
+        for order_id, type_value, price, quantity, username, symbol in settings['orders']:
+            order = Order()
+            order.set_id(order_id)
+            order.set_type(OrderType(type_value))
+            order.set_price(price)
+            order.set_quantity(quantity)
+            order.set_user(self._get_user(username))
+            engine = self.server.matching_engines[symbol]
+            engine.load_orders([order])
+            engine._store_order(order)
+        transaction.commit()
+        self.log = logging.getLogger('Replay')  # type: logging.Logger
+
+    @staticmethod
+    def read(path: str) -> 'Replay':
+        """
+        :param path: Path of the capture file.
+        :return: Replay of the capture.
+        """
+        return Replay(*Capture.read(path))
+
+    def put_nowait(self, data: Dict[str, Any]) -> None:
+        """
+        Collects public message of the server, in place of its broadcast queue.
+
+        :param data: Public message.
+        """
+        self.published.append(data)
+
+    def _get_user(self, username: str) -> User:
+        """
+        :param username: Name of the user.
+        :return: User of the replayed server, created if it does not exist yet.
+        """
+        user = self.server.users.get(username)
+        if user is None:
+            user = User()
+            user.set_username(username)
+            user.set_password_hash(b'')
+            self.server.users[username] = user
+        return user
+
+    def run(self, speed: float = None) -> float:
+        """
+        Replays all captured client messages.
+
+        :param speed: Multiple of the recorded pace of the messages, None for maximum speed.
+        :return: Duration of the replay in seconds.
+        """
+        start = perf_counter()
+        first = None
+        for timestamp, connection, kind, payload in self.records:
+            if kind == PUBLIC:
+                continue
+            if speed is not None:
+                if first is None:
+                    first = timestamp
+                delay = (timestamp - first) / speed - (perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            if kind == LOGIN:
+                writer, user = NullWriter(), self._get_user(payload)
+                self.connections[connection] = (writer, user)
+                self.server.private_clients[user.username] = (None, writer)
+            elif kind == DISCONNECT:
+                writer, user = self.connections.pop(connection, (None, None))
+                if user is not None and self.server.private_clients.get(user.username, (None, None))[1] is writer:
+                    del self.server.private_clients[user.username]
+            elif connection in self.connections:
+                writer, user = self.connections[connection]
+                self.messages += 1
+                try:
+                    self.server._process_message(writer, payload, user)
+                except ValueError as e:
+                    self.server._send_error(writer, e)
+                    self.rejected += 1
+                except Exception:
+                    self.log.debug("Message %s of connection %s failed", payload, connection, exc_info=True)
+                    self.failed += 1
+                    del self.connections[connection]
+        return perf_counter() - start
+
+    @staticmethod
+    def _trades(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        :param messages: Public messages.
+        :return: Trades, without their time and sequence number.
+        """
+        return [{key: value for key, value in data.items() if key not in ('time', 'seq')}
+                for data in messages if data['type'] == 'trade']
+
+    @staticmethod
+    def _levels(messages: List[Dict[str, Any]]) -> Dict[Tuple[str, str, int], int]:
+        """
+        :param messages: Public messages.
+        :return: Last quantity of each price level changed by the orderbook messages, by symbol, side and price.
+        """
+        levels = {}
+        for data in messages:
+            if data['type'] == 'orderbook':
+                levels[(data.get('symbol', None), data['side'], data['price'])] = data['quantity']
+        return levels
+
+    def compare(self) -> List[str]:
+        """
+        :return: Differences of the replayed outcome from the captured one, empty if they are identical.
+        """
+        differences = []
+        captured = [payload for _, _, kind, payload in self.records if kind == PUBLIC]
+        captured_trades = self._trades(captured)
+        replayed_trades = self._trades(self.published)
+        for i, (expected, actual) in enumerate(zip(captured_trades, replayed_trades)):
+            if expected != actual:
+                differences.append("Trade {} differs: captured {}, replayed {}".format(i + 1, expected, actual))
+                break
+        if len(captured_trades) != len(replayed_trades):
+            differences.append("Captured {} trades, replayed {}".format(len(captured_trades), len(replayed_trades)))
+        captured_levels = self._levels(captured)
+        replayed_levels = self._levels(self.published)
+        for key in sorted(set(captured_levels) | set(replayed_levels), key=str):
+            expected = captured_levels.get(key, None)
+            actual = replayed_levels.get(key, None)
+            if expected != actual:
+                differences.append("Level {} {} {} differs: captured quantity {}, replayed {}".format(
+                    key[0] or '-', key[1], key[2], expected, actual))
+        return differences
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replays order flow captured by server started with --capture '
+                                                 'and checks that trades and orderbook are identical.')
+    parser.add_argument('capture', help='Path of the capture file.')
+    parser.add_argument('--speed', type=float,
+                        help='Replay at the recorded pace multiplied by SPEED, instead of maximum speed.')
+    parser.add_argument('-d', '--debug', action='store_true', help='Log failed messages.')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING)
+
+    replay = Replay.read(args.capture)
+    duration = replay.run(args.speed)
+    print("Replayed {} messages in {:.3f} s ({:.0f} messages/s), {} rejected, {} failed, {} trades".format(
+        replay.messages, duration, replay.messages / duration if duration else 0, replay.rejected, replay.failed,
+        sum(engine.trades for engine in replay.server.matching_engines.values())))
+    differences = replay.compare()
+    for difference in differences:
+        print(difference)
+    if differences:
+        sys.exit(1)
+    print("Trades and orderbook are identical to the capture")
@@ -1,52 +1,177 @@
 #!/usr/bin/env python3.5
-import uuid
 from logging import Logger
 from typing import List
 from matching import MatchingEngine
-from models import User, Order, OrderType
-from typing import Dict, Any
-from asyncio import StreamReader, StreamWriter, AbstractEventLoop, AbstractServer, new_event_loop, start_server, Queue
+from models import User, Order, OrderType, class_factory, get_passw_hash, check_passw_hash
+from journal import Journal
+from eventlog import EventLog
+from capture import Capture
+from admin import Admin
+from profiler import StallWatchdog
+from snapshot import Snapshot
+from fanout import Fanout, Subscriber
+from ticks import TickSize, DEFAULT_TICK_SIZE
+from binary import BinaryProtocol
+from connection import PrivateConnection
+from metrics import Metrics, Counter, Histogram, SIZE_BUCKETS
+from shard import Shard, Output
+from typing import Dict, Any, Tuple, Set, Callable, Awaitable
+from asyncio import StreamReader, StreamWriter, AbstractEventLoop, AbstractServer, new_event_loop, start_server, Queue, \
+    Semaphore, Future, gather, start_unix_server
+from collections import OrderedDict
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from time import perf_counter
 import logging
 import ZODB
 import ZODB.Connection
 import ZODB.FileStorage
+import ZODB.POSException
 import persistent
 import persistent.mapping
-import decimal
+import persistent.list
+import os
+import threading
 import BTrees.OOBTree
-import sys
+import argparse
 import json
 import transaction
 
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 
 class ExchangeServer:
     """
-    Simple asyncio TCP server for one stock.
+    Simple asyncio TCP server for one or more stocks.
+
+    Private clients send orders, which are matched by :class:`matching.MatchingEngine` of their instrument,
+    public clients receive trades and changes of the orderbook through :class:`fanout.Fanout`.
+    Optional features are enabled by keyword arguments, they are described by the classes implementing them
+    and in the documentation.
     """
 
-    def __init__(self, host, private_port, public_port=None, debug=False):
+    def __init__(self, host, private_port, public_port=None, debug=False, *,
+                 journal_path=None, journal_window_us=1000, journal_window_messages=100,
+                 snapshot_path=None, snapshot_interval=60, public_max_lag=10000,
+                 login_pool='thread', login_workers=4, max_concurrent_logins=16,
+                 symbols=None, shards=0, tick_size=DEFAULT_TICK_SIZE, tick_sizes=None,
+                 binary_private_port=None, binary_public_port=None, private_transport='streams',
+                 event_loop='asyncio', public_history=10000, stats_port=None, event_log_path=None,
+                 event_log_window_ms=100, admin_socket=None, stall_threshold_ms=None,
+                 capture_path=None):
+        if shards and journal_path is None:
+            raise ValueError("Shards keep orders only in memory, they need journal to persist them")
+        if shards and snapshot_path is not None:
+            raise ValueError("Snapshots are not supported together with shards")
+        if shards and event_log_path is not None:
+            raise ValueError("Event log is not supported together with shards")
+        if shards and capture_path is not None:
+            raise ValueError("Capture is not supported together with shards")
         self.host = host  # type: str
         self.private_port = private_port  # type: int
         self.public_port = public_port  # type: int
+        self.binary_private_port = binary_private_port  # type: int
+        self.binary_public_port = binary_public_port  # type: int
+        self.stats_port = stats_port  # type: int
+        self.admin_socket = admin_socket  # type: str
+        self.private_transport = private_transport  # type: str
+        self.event_loop = event_loop  # type: str
         self.debug = debug  # type: bool
+        self.journal_path = journal_path  # type: str
+        self.journal_window_us = journal_window_us  # type: int
+        self.journal_window_messages = journal_window_messages  # type: int
+        self.journal = None  # type: Journal
+        self.snapshot_path = snapshot_path  # type: str
+        self.snapshot_interval = snapshot_interval  # type: float
+        self.event_log_path = event_log_path  # type: str
+        self.event_log_window_ms = event_log_window_ms  # type: int
+        self.event_log = None  # type: EventLog
+        self.capture_path = capture_path  # type: str
+        self.capture = None  # type: Capture
+        self.outbox = None  # type: List[Tuple[StreamWriter, Dict[str, Any]]]
+        self.replaying = False  # type: bool
         self.db = None  # type: ZODB.DB
         self.connection = None  # type: ZODB.Connection.Connection
         self.db_root = None  # type: persistent.mapping.PersistentMapping
         self.users = None  # type:  BTrees.OOBTree.OOBTree
-        self.bid_orders = None  # type: BTrees.OOBTree.OOBTree
-        self.ask_orders = None  # type: BTrees.OOBTree.OOBTree
+        self.bid_orders = {}  # type: Dict[str, BTrees.OOBTree.OOBTree]
+        self.ask_orders = {}  # type: Dict[str, BTrees.OOBTree.OOBTree]
         self.private_server = None  # type: AbstractServer
         self.public_server = None  # type: AbstractServer
+        self.binary_private_server = None  # type: AbstractServer
+        self.binary_public_server = None  # type: AbstractServer
+        self.stats_server = None  # type: AbstractServer
+        self.admin_server = None  # type: AbstractServer
+        self.admin = None  # type: Admin
+        self.stall_threshold_ms = stall_threshold_ms  # type: float
+        self.watchdog = None  # type: StallWatchdog
+        self.current_message = None  # type: str
         self.loop = None  # type: AbstractEventLoop
         self.private_clients = {}  # type: Dict[str, (StreamReader, StreamWriter)]
-        self.public_clients = []  # type: List[StreamWriter]
+        self.public_max_lag = public_max_lag  # type: int
+        self.public_history = public_history  # type: int
+        self.public_sequence = 0  # type: int
+        self.fanout = None  # type: Fanout
+        self.binary_fanout = None  # type: Fanout
+        self.binary_writers = set()  # type: Set[StreamWriter]
+        self.login_pool = login_pool  # type: str
+        self.login_workers = login_workers  # type: int
+        self.max_concurrent_logins = max_concurrent_logins  # type: int
+        self.login_executor = None  # type: Executor
+        self.login_semaphore = None  # type: Semaphore
+        self.login_queue_depth = 0  # type: int
+        self.symbols = list(symbols) if symbols else [None]  # type: List[str]
+        self.default_symbol = self.symbols[0]  # type: str
+        self.tick_sizes = {symbol: TickSize((tick_sizes or {}).get(symbol, tick_size))
+                           for symbol in self.symbols}  # type: Dict[str, TickSize]
+        self.binary_protocol = None  # type: BinaryProtocol
+        if binary_private_port is not None or binary_public_port is not None:
+            self.binary_protocol = BinaryProtocol(self.tick_sizes, self.default_symbol)
+        self.matching_engines = {}  # type: Dict[str, MatchingEngine]
         self.matching_engine = None  # type: MatchingEngine
+        self.shard_count = shards  # type: int
+        self.shards = []  # type: List[Shard]
+        self.symbol_shards = {}  # type: Dict[str, Shard]
         self.broadcast_queue = None  # type: Queue
         self.id_counter = 0  # type: int
         self.log = logging.getLogger('ExchangeServer')  # type: Logger
         if debug:
             self.log.setLevel(logging.DEBUG)
 
+        self.metrics = Metrics()  # type: Metrics
+        self.json_decode_time = self.metrics.histogram('exchange_decode_seconds', 'Time of decoding one client message.',
+                                                       protocol='json')  # type: Histogram
+        self.binary_decode_time = self.metrics.histogram('exchange_decode_seconds',
+                                                         'Time of decoding one client message.',
+                                                         protocol='binary')  # type: Histogram
+        self.action_times = {
+            action: self.metrics.histogram('exchange_matching_seconds',
+                                           'Time of executing one order action by matching engine.', action=action)
+            for action in ('createOrder', 'replaceOrder', 'cancelOrder')}  # type: Dict[str, Histogram]
+        self.shard_time = self.metrics.histogram('exchange_shard_seconds',
+                                                 'Time until shards process all actions of client message.'
+                                                 )  # type: Histogram
+        self.commit_time = self.metrics.histogram('exchange_commit_seconds',
+                                                  'Time of persisting results of client messages.',
+                                                  store='db')  # type: Histogram
+        self.broadcast_batch = self.metrics.histogram('exchange_broadcast_batch_messages',
+                                                      'Public messages published together.',
+                                                      SIZE_BUCKETS)  # type: Histogram
+        self.metrics.gauge('exchange_broadcast_queue_depth', 'Public messages waiting in the broadcast queue.',
+                           lambda: 0 if self.broadcast_queue is None else self.broadcast_queue.qsize())
+        self.login_wait = self.metrics.histogram('exchange_login_wait_seconds',
+                                                 'Time login waited for its turn in the login pool.'
+                                                 )  # type: Histogram
+        self.login_time = self.metrics.histogram('exchange_login_seconds',
+                                                 'Time of password hashing in the login pool.')  # type: Histogram
+        self.metrics.gauge('exchange_login_queue_depth', 'Logins waiting for their turn.',
+                           lambda: self.login_queue_depth)
+        self.logins = {action: self.metrics.counter('exchange_logins_total', 'Logins by their result.', action=action)
+                       for action in ('logged_in', 'registered', 'denied')}  # type: Dict[str, Counter]
+        self.metrics.gauge('exchange_private_clients', 'Logged in private clients.', lambda: len(self.private_clients))
+
     async def _accept_private_connection(self, reader: StreamReader, writer: StreamWriter) -> None:
         """
         Coroutine that accepts incoming client connections, launches the login process
@@ -55,9 +180,36 @@ class ExchangeServer:
         :param reader: Connected clients Reader.
         :param writer: Connected clients Writer.
         """
-        msg = await reader.readline()
-        login_data = self._decode_msg(msg)
-        user, login_response = self._login(login_data)
+        await self._accept_client(reader, writer, self._read_msg)
+
+    async def _accept_binary_private_connection(self, reader: StreamReader, writer: StreamWriter) -> None:
+        """
+        Coroutine that accepts incoming client connections on the binary private port.
+        Messages for the client are encoded by binary protocol for as long as it is connected.
+
+        :param reader: Connected clients Reader.
+        :param writer: Connected clients Writer.
+        """
+        self.binary_writers.add(writer)
+        try:
+            await self._accept_client(reader, writer, self._read_binary_msg)
+        finally:
+            self.binary_writers.discard(writer)
+
+    async def _accept_client(self, reader: StreamReader, writer: StreamWriter,
+                             read_msg: Callable[[StreamReader], Awaitable[Dict[str, Any]]]) -> None:
+        """
+        Coroutine which logs in connected private client and handles its messages.
+
+        :param reader: Connected clients Reader.
+        :param writer: Connected clients Writer.
+        :param read_msg: Coroutine function reading one decoded message of the clients protocol.
+        """
+        login_data = await read_msg(reader)
+        if login_data is None:
+            writer.close()
+            return
+        user, login_response = await self._login(login_data)
         self._send_data(writer, login_response)
         if user is None:
             writer.close()
@@ -65,17 +217,53 @@ class ExchangeServer:
         else:
             self.private_clients[user.username] = (reader, writer)
             self.log.info("Client connected as \"{}\"".format(user.username))
-            await self._handle_client(reader, writer, user)
+            if self.capture is not None:
+                self.capture.login(writer, user.username)
+            await self._handle_client(reader, writer, user, read_msg)
 
-    async def _accept_public_connection(self, _, writer: StreamWriter) -> None:
+    async def _accept_public_connection(self, reader: StreamReader, writer: StreamWriter) -> None:
         """
-        Accepts incoming connection from public client and ads it to notification list.
+        Accepts incoming connection from public client, sends it current orderbook and ads it to notification list.
+        Orderbook is sent from depth maintained by the fanout, by one write.
 
-        :param _: Clients Reader. Not needed since public clients only consume data.
+        :param reader: Clients Reader, used only for retransmit requests.
         :param writer: Clients Writer.
         """
-        self.public_clients.append(writer)
-        await self._broadcast_orderbook(writer)
+        subscriber = self.fanout.subscribe(writer)
+        await self._handle_public_client(reader, subscriber, self._read_msg)
+
+    async def _accept_binary_public_connection(self, reader: StreamReader, writer: StreamWriter) -> None:
+        """
+        Accepts incoming connection from public client on the binary public port.
+
+        :param reader: Clients Reader, used only for retransmit requests.
+        :param writer: Clients Writer.
+        """
+        subscriber = self.binary_fanout.subscribe(writer)
+        await self._handle_public_client(reader, subscriber, self._read_binary_msg)
+
+    @staticmethod
+    async def _handle_public_client(reader: StreamReader, subscriber: Subscriber,
+                                    read_msg: Callable[[StreamReader], Awaitable[Dict[str, Any]]]) -> None:
+        """
+        Coroutine which handles retransmit requests of public client, until it disconnects.
+
+        :param reader: Clients reader.
+        :param subscriber: Subscriber of the client.
+        :param read_msg: Coroutine function reading one decoded message of the clients protocol.
+        """
+        try:
+            while True:
+                data = await read_msg(reader)
+                if data is None:
+                    break
+                if data.get('message') != 'retransmit':
+                    raise ValueError("Public client can only send retransmit message")
+                subscriber.retransmit(int(data['from']))
+        except ConnectionError:
+            pass
+        finally:
+            subscriber.close()
 
     def add_to_broadcast(self, data: Dict[str, Any]) -> None:
         """
@@ -83,68 +271,485 @@ class ExchangeServer:
 
         :param data: Data to be broadcasted.
         """
-        if data is not None:
-            self.broadcast_queue.put(data)
+        if data is None or self.replaying:
+            return
+        if self.outbox is not None:
+            self.outbox.append((None, data))
+        else:
+            self.broadcast_queue.put_nowait(data)
 
-    async def _broadcast_orderbook(self, writer: StreamWriter) -> None:
+    def _orderbook_messages(self) -> List[Dict[str, Any]]:
         """
-        Coroutine that sends orderbook data to writer, each price and its quantity as separate message.
+        Collects orderbook messages of all price levels of all instruments.
+        Blocks until shards send their orderbooks, meant to be used only during startup.
 
-        :param writer: Writer used for sending data.
+        :return: Orderbook messages.
         """
-        for storage in (self.bid_orders, self.ask_orders):
-            for order_list in storage.values():
-                data = self.matching_engine.get_price_sum_dict(order_list)
-                self._send_data(writer, data)
+        messages = []
+        for shard in self.shards:
+            messages.extend(data for _, _, data in shard.execute([('orderbook',)])[0])
+        for engine in self.matching_engines.values():
+            for book in (engine.bid_book, engine.ask_book):
+                for level in book:
+                    messages.append(engine.get_level_dict(level))
+        return messages
+
+    def _load_public_depth(self) -> None:
+        """
+        Loads the orderbook into depth of the fanouts, without publishing it.
+        Orderbook messages carry the current public sequence number, as the depth reflects all messages up to it.
+        """
+        orderbook = self._orderbook_messages()
+        for data in orderbook:
+            data['seq'] = self.public_sequence
+        for fanout in (self.fanout, self.binary_fanout):
+            if fanout is not None:
+                fanout.load_depth(orderbook)
 
     async def _broadcast_public(self) -> None:
         """
-        Coroutine which takes data to be broadcasted from queue, and sends it to all
-        connected public clients.
+        Coroutine which takes data to be broadcasted from queue, numbers them by sequence numbers and passes them
+        to queues of all connected public clients. All data waiting in the queue (usually produced by processing
+        of one message) are published together, orderbook messages superseded within them are dropped.
         """
         while True:
-            data = await self.broadcast_queue.get()
-            for writer in self.public_clients:
-                self._send_data(writer, data)
-                await writer.drain()
+            messages = [await self.broadcast_queue.get()]
+            while not self.broadcast_queue.empty():
+                messages.append(self.broadcast_queue.get_nowait())
+            messages = Fanout.conflate(messages)
+            self.broadcast_batch.observe(len(messages))
+            for data in messages:
+                self.public_sequence += 1
+                data['seq'] = self.public_sequence
+            if self.capture is not None:
+                self.capture.public(messages)
+            self.fanout.publish(messages)
+            if self.binary_fanout is not None:
+                self.binary_fanout.publish(messages)
 
-    async def _handle_client(self, reader: StreamReader, writer: StreamWriter, user: User) -> None:
+    async def _handle_client(self, reader: StreamReader, writer: StreamWriter, user: User,
+                             read_msg: Callable[[StreamReader], Awaitable[Dict[str, Any]]]) -> None:
         """
-        Coroutine which loops over the received lines and launches corresponding action.
+        Coroutine which loops over the received messages and launches corresponding action.
         Does the main work with handling private client messages.
+        Invalid message (eg. with price off the tick grid) is answered by error message and the client stays connected.
 
         :param reader: Clients reader.
         :param writer: Clients writer.
         :param user: User under which the client is logged in.
+        :param read_msg: Coroutine function reading one decoded message of the clients protocol.
         """
-        while True:
-            msg = await reader.readline()
-            if not msg:  # empty string means the client disconnected
-                break
-            data = self._decode_msg(msg)
-            msg_type = data['message']
-            if msg_type == 'createOrder':
-                self._create_order(writer, data, user)
-            elif msg_type == 'cancelOrder':
-                self._delete_order(data, user)
+        try:
+            while True:
+                try:
+                    data = await read_msg(reader)
+                    if data is None:  # client disconnected
+                        break
+                    self._process_message(writer, data, user)
+                except ValueError as e:
+                    self._send_error(writer, e)
+                await writer.drain()
+        finally:
+            del self.private_clients[user.username]
+            if self.capture is not None:
+                self.capture.disconnect(writer)
+
+    def _process_message(self, writer: StreamWriter, data: Dict[str, Any], user: User) -> None:
+        """
+        Launches action corresponding to the client message and persists its results.
+        Message is first turned into record, which contains everything needed to repeat the action
+        (and which is stored in the journal in journal mode).
+
+        :param writer: Clients writer.
+        :param data: Decoded client message.
+        :param user: User under which the client is logged in.
+        """
+        if self.capture is not None:
+            self.capture.message(writer, data)
+        msg_type = data['message']
+        self.current_message = msg_type
+        try:
+            if msg_type in ('createOrder', 'cancelOrder', 'replaceOrder'):
+                record = self._make_record(msg_type, data, user)
+            elif msg_type == 'createOrders':
+                record = {'message': msg_type,
+                          'user': user.username,
+                          'records': [self._make_record('createOrder', order_data, user)
+                                      for order_data in data['orders']]}
+            elif msg_type == 'cancelOrders':
+                record = {'message': msg_type,
+                          'user': user.username,
+                          'records': [self._make_record('cancelOrder',
+                                                        {'orderId': order_id, 'symbol': data.get('symbol')}, user)
+                                      for order_id in data['orderIds']]}
             else:
                 raise ValueError("Message has to have a valid \'message\' field.")
 
-            await writer.drain()
-        del self.private_clients[user.username]
+            if self.shards:
+                self._dispatch_to_shard(record)
+            else:
+                self._execute_record(writer, record, user)
+        finally:
+            self.current_message = None
+
+    def _make_record(self, msg_type: str, data: Dict[str, Any], user: User) -> Dict[str, Any]:
+        """
+        Validates data of one order action and turns it into record.
+
+        :param msg_type: Action, either createOrder, cancelOrder or replaceOrder.
+        :param data: Data of the action, as received from the client.
+        :param user: User under which the client is logged in.
+        :return: Record of the action.
+        """
+        if msg_type == 'createOrder':
+            self._get_order_type(data['side'])
+            symbol = self._get_symbol(data)
+            price = self._get_price(symbol, data)
+            if price is None:
+                raise ValueError("Create order needs to have price")
+            record = {'message': msg_type,
+                      'symbol': symbol,
+                      'user': user.username,
+                      'side': data['side'],
+                      'price': price,
+                      'quantity': int(data['quantity'])}
+            record['id'] = self.get_new_id()
+        elif msg_type == 'replaceOrder':
+            symbol = self._get_symbol(data)
+            quantity = data.get('quantity', None)
+            if quantity is not None and int(quantity) <= 0:
+                raise ValueError("Replaced order needs to have positive quantity, use cancelOrder to remove it")
+            record = {'message': msg_type,
+                      'symbol': symbol,
+                      'user': user.username,
+                      'orderId': data['orderId'],
+                      'price': self._get_price(symbol, data),
+                      'quantity': None if quantity is None else int(quantity)}
+        else:
+            record = {'message': msg_type,
+                      'symbol': self._get_symbol(data),
+                      'user': user.username,
+                      'orderId': data['orderId']}
+        return record
+
+    def _get_price(self, symbol: str, data: Dict[str, Any]) -> int:
+        """
+        :param symbol: Symbol of the instrument.
+        :param data: Data of the order action, as received from the client.
+        :return: Price of the order in ticks, None if the data has no price.
+            Binary messages carry price already converted to ticks.
+        """
+        if 'priceTicks' in data:
+            return int(data['priceTicks'])
+        price = data.get('price', None)
+        if price is None:
+            return None
+        return self.tick_sizes[symbol].to_ticks(price)
+
+    @staticmethod
+    def _get_actions(record: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        :param record: Record of the client message.
+        :return: Records of single order actions of the message, in the order they are executed.
+        """
+        return record.get('records', [record])
+
+    def _execute_record(self, writer: StreamWriter, record: Dict[str, Any], user: User) -> None:
+        """
+        Executes action described by the record in this process and persists its results.
+        In journal mode, messages for clients produced by the action are sent only once
+        the journal record of the message is durable.
+
+        :param writer: Clients writer.
+        :param record: Record of the client message.
+        :param user: User under which the client is logged in.
+        """
+        if self.journal is not None or 'records' in record:
+            self.outbox = []
+        try:
+            for action in self._get_actions(record):
+                self._execute_action(writer, action, user)
+        finally:
+            outbox = self.outbox
+            self.outbox = None
+        self._persist(record, outbox)
+
+    def _execute_action(self, writer: StreamWriter, action: Dict[str, Any], user: User) -> None:
+        """
+        Executes one order action in this process.
+
+        :param writer: Clients writer, None when the action is replayed.
+        :param action: Record of the action.
+        :param user: User under which the action was made.
+        """
+        start = perf_counter()
+        if action['message'] == 'createOrder':
+            self._create_order(writer, action, user, action['id'])
+        elif action['message'] == 'replaceOrder':
+            self._replace_order(writer, action, user)
+        else:
+            self._delete_order(action, user)
+        self.action_times[action['message']].observe(perf_counter() - start)
+
+    def _dispatch_to_shard(self, record: Dict[str, Any]) -> None:
+        """
+        Appends the record to journal and sends actions described by it to the shards which own their instruments.
+        Record is appended before it is dispatched, so that journal keeps the order in which each shard executes
+        the actions, even when batch spanning several shards completes after later messages.
+        Results are sent to clients once the record is durable and the shards process all the actions.
+
+        :param record: Record of the client message.
+        """
+        start = perf_counter()
+        persisted = self.loop.create_future()
+        self.journal.append(record, lambda: persisted.set_result(None))
+        if 'records' not in record:
+            future = self.symbol_shards[record['symbol']].request(self._get_shard_command(record))
+            future.add_done_callback(lambda f: self._shard_done(record, f.result(), persisted, start))
+            return
+        commands = OrderedDict()
+        for i, action in enumerate(record['records']):
+            commands.setdefault(self.symbol_shards[action['symbol']], []).append((i, self._get_shard_command(action)))
+        futures = [None] * len(record['records'])
+        for shard, shard_commands in commands.items():
+            shard_futures = shard.request_many([command for _, command in shard_commands])
+            for (i, _), future in zip(shard_commands, shard_futures):
+                futures[i] = future
+        if not futures:
+            self._shard_done(record, [], persisted)
+            return
+        future = gather(*futures)
+        future.add_done_callback(lambda f: self._shard_done(record, [output for outputs in f.result()
+                                                                     for output in outputs], persisted, start))
+
+    def _shard_done(self, record: Dict[str, Any], outputs: List[Output], persisted: Future,
+                    start: float = None) -> None:
+        """
+        Passes messages produced by shards for the client message to the clients, once its record is durable.
+
+        :param record: Record of the client message.
+        :param outputs: Messages produced by the shard.
+        :param persisted: Future resolved once the record is durably stored in journal.
+        :param start: Time when the message was dispatched to the shards.
+        """
+        if start is not None:
+            self.shard_time.observe(perf_counter() - start)
+        outbox = []
+        for kind, username, data in outputs:
+            if kind == 'public':
+                outbox.append((None, data))
+            elif username in self.private_clients:
+                outbox.append((self.private_clients[username][1], data))
+        if 'records' in record:
+            outbox = self._combine_acks(outbox)
+        if persisted.done():
+            self._release_outbox(outbox)
+        else:
+            persisted.add_done_callback(lambda f: self._release_outbox(outbox))
+
+    def _persist(self, record: Dict[str, Any], outbox: List[Tuple[StreamWriter, Dict[str, Any]]]) -> None:
+        """
+        Persists results of the client message by DB commit, or by appending the record to journal.
+
+        Acknowledgments of orders created by batch message are combined into one ordersCreated message.
+
+        :param record: Record of the client message.
+        :param outbox: Messages for clients which were held back until the results are persisted.
+        """
+        if 'records' in record:
+            outbox = self._combine_acks(outbox)
+        if self.journal is None:
+            start = perf_counter()
+            transaction.commit()
+            self.commit_time.observe(perf_counter() - start)
+            if outbox:
+                self._release_outbox(outbox)
+        else:
+            self.journal.append(record, lambda: self._release_outbox(outbox))
+
+    @staticmethod
+    def _combine_acks(outbox: List[Tuple[StreamWriter, Dict[str, Any]]]) -> List[Tuple[StreamWriter, Dict[str, Any]]]:
+        """
+        Replaces orderCreated messages with one ordersCreated message for each writer,
+        which is placed where the first of them was.
+
+        :param outbox: Messages for clients.
+        :return: Messages for clients with combined acknowledgments.
+        """
+        combined = []
+        acks = {}
+        for writer, data in outbox:
+            if writer is not None and data['type'] == 'orderCreated':
+                if writer not in acks:
+                    acks[writer] = {'type': 'ordersCreated', 'ids': []}
+                    combined.append((writer, acks[writer]))
+                acks[writer]['ids'].append(data['id'])
+            else:
+                combined.append((writer, data))
+        return combined
+
+    def _get_shard_command(self, record: Dict[str, Any]) -> Tuple:
+        """
+        :param record: Record of the client message.
+        :return: Shard command executing action described by the record.
+        """
+        if record['message'] == 'createOrder':
+            return ('createOrder', record['symbol'], record['id'], record['user'],
+                    self._get_order_type(record['side']).value, record['price'],
+                    record['quantity'])
+        elif record['message'] == 'replaceOrder':
+            return ('replaceOrder', record['symbol'], record['orderId'], record['user'], record['price'],
+                    record['quantity'])
+        else:
+            return 'cancelOrder', record['symbol'], record['orderId'], record['user']
+
+    def _get_symbol(self, data: Dict[str, Any]) -> str:
+        """
+        :param data: Client message or its record.
+        :return: Symbol of the instrument the message is for.
+        """
+        symbol = data.get('symbol', None)
+        if symbol is None:
+            return self.default_symbol
+        if symbol not in self.symbols:
+            raise ValueError("Unknown symbol \"{}\"".format(symbol))
+        return symbol
+
+    @staticmethod
+    def _get_order_type(side: str) -> OrderType:
+        """
+        :param side: Side of the order as used in client messages (BUY or SELL).
+        :return: Type of the order as used in orderbook.
+        """
+        if side == 'BUY':
+            return OrderType.ask
+        elif side == 'SELL':
+            return OrderType.bid
+        else:
+            raise ValueError("Create order needs to have type \'BUY\' or \'SELL\'")
+
+    def _release_outbox(self, outbox: List[Tuple[StreamWriter, Dict[str, Any]]]) -> None:
+        """
+        Sends messages which were held back until their results were persisted.
+        All messages for the same client are sent by one write.
+
+        :param outbox: List of writers and messages to be sent, writer None means public broadcast.
+        """
+        frames = OrderedDict()
+        for writer, data in outbox:
+            if writer is None:
+                self.broadcast_queue.put_nowait(data)
+            else:
+                frames.setdefault(writer, []).append(self._encode_for(writer, data))
+        for writer, msgs in frames.items():
+            writer.write(b''.join(msgs))
+
+    def _restore_book(self) -> None:
+        """
+        Restores the orderbook from the last snapshot in one bulk load,
+        then opens the journal and replays messages which are not included in the snapshot.
+        Nothing is sent to clients during the replay.
+        """
+        snapshot = None
+        if self.snapshot_path is not None and os.path.exists(self.snapshot_path):
+            snapshot = Snapshot.read(self.snapshot_path)
+            orders = {symbol: [] for symbol in self.symbols}
+            for order_id, order_type, price, quantity, username, symbol in snapshot.orders:
+                order = Order()
+                order.set_id(order_id)
+                order.set_type(order_type)
+                order.set_price(price)
+                order.set_quantity(quantity)
+                order.set_user(self.users[username])
+                orders[symbol].append(order)
+            for symbol, symbol_orders in orders.items():
+                self.matching_engines[symbol].load_orders(symbol_orders)
+            self.id_counter = snapshot.last_id
+            self.log.info("Restored {} orders from snapshot".format(len(snapshot.orders)))
+
+        self.journal = Journal(self.journal_path, self.loop, self.journal_window_us, self.journal_window_messages)
+        self.metrics.register(self.journal.flush_time)
+        self.metrics.register(self.journal.flush_records)
+        records = self.journal.open()
+        if snapshot is not None:
+            records = [record for record in records if record['seq'] > snapshot.sequence]
+            self.journal.sequence = max(self.journal.sequence, snapshot.sequence)
+        actions = [action for record in records for action in self._get_actions(record)]
+        for action in actions:
+            action['symbol'] = self._get_symbol(action)
+            if action['message'] == 'createOrder':
+                self.id_counter = max(self.id_counter, action['id'])
+
+        if self.shards:
+            commands = {}
+            for action in actions:
+                commands.setdefault(self.symbol_shards[action['symbol']], []).append(self._get_shard_command(action))
+            for shard, shard_commands in commands.items():
+                for i in range(0, len(shard_commands), 1000):
+                    shard.execute(shard_commands[i:i + 1000])
+        else:
+            self.replaying = True
+            try:
+                for action in actions:
+                    self._execute_action(None, action, self.users[action['user']])
+            finally:
+                self.replaying = False
+        self.log.info("Replayed {} journal records".format(len(records)))
+
+    def take_snapshot(self) -> None:
+        """
+        Writes snapshot of the current orderbook and removes journal records included in it.
+        """
+        self.journal.flush()
+        orders = ((symbol, order) for symbol, engine in self.matching_engines.items() for order in engine.orders())
+        snapshot = Snapshot.from_orders(orders, self.journal.sequence, self.id_counter)
+        snapshot.write(self.snapshot_path)
+        self.journal.truncate()
+        self.log.info("Snapshot of {} orders taken".format(len(snapshot.orders)))
+
+    def _periodic_snapshot(self) -> None:
+        """
+        Takes snapshot and schedules the next one.
+        """
+        self.take_snapshot()
+        self.loop.call_later(self.snapshot_interval, self._periodic_snapshot)
 
     def _delete_order(self, order_data: Dict[str, Any], user: User) -> None:
         """
         Deletes order with given order id.
+        Orders which are no longer in the orderbook (eg. were already filled)
+        or which belong to another user are ignored.
 
         :param order_data: Dictionary containing order id data.
         :param user: User whose order we want to delete.
         """
+        engine = self.matching_engines[self._get_symbol(order_data)]
+        order_id = order_data['orderId']
+        order = engine.get_order(order_id)
+        if order is None or order.user is not user:
+            self.log.debug("Order \"%s\" of \"%s\" cannot be cancelled", order_id, user.username)
+            return
+        engine.delete_order(order)
+
+    def _replace_order(self, writer: StreamWriter, order_data: Dict[str, Any], user: User) -> None:
+        """
+        Changes price and/or quantity of order with given order id.
+        Orders which are no longer in the orderbook or which belong to another user are ignored.
+
+        :param writer: Writer of the client who replaces the order.
+        :param order_data: Dictionary containing order id, and new price and quantity (None if unchanged).
+        :param user: User whose order we want to replace.
+        """
+        engine = self.matching_engines[self._get_symbol(order_data)]
         order_id = order_data['orderId']
-        order = user.orders[order_id]
-        self.matching_engine.delete_order(order)
+        order = engine.get_order(order_id)
+        if order is None or order.user is not user:
+            self.log.debug("Order \"%s\" of \"%s\" cannot be replaced", order_id, user.username)
+            return
+        engine.replace_order(order, order_data['price'], order_data['quantity'], writer)
 
-    def _create_order(self, writer: StreamWriter, order_data: Dict[str, Any], user: User) -> None:
+    def _create_order(self, writer: StreamWriter, order_data: Dict[str, Any], user: User,
+                      order_id: int = None) -> int:
         """
         Create new order from user using order data.
         Writer is passed along to allow reporting status to user without looking up his writer.
@@ -152,25 +757,28 @@ class ExchangeServer:
         :param writer: Writer of the client who created the order.
         :param order_data: Dictionary with orders data.
         :param user: User who created the order.
+        :param order_id: Id of the order, when recreating already existing order. New id is used if not supplied.
+        :return: Id of the created order.
         """
+        if order_id is None:
+            order_id = self.get_new_id()
+        else:
+            self.id_counter = max(self.id_counter, order_id)
         new_order = Order()
-        new_order.set_user(user)
-        new_order.set_price(decimal.Decimal(order_data['price']))
+        new_order.set_price(int(order_data['price']))
         new_order.set_quantity(int(order_data['quantity']))
-        new_order.set_id(uuid.uuid4())
-        if order_data['side'] == 'BUY':
-            new_order.set_type(OrderType.ask)
-        elif order_data['side'] == 'SELL':
-            new_order.set_type(OrderType.bid)
-        else:
-            raise ValueError("Create order needs to have type \'BUY\' or \'SELL\'")
+        new_order.set_id(order_id)
+        new_order.set_type(self._get_order_type(order_data['side']))
 
-        self.matching_engine.insert_order(new_order, user, writer)
-        self.matching_engine.process_order(new_order, writer)
+        engine = self.matching_engines[self._get_symbol(order_data)]
+        engine.insert_order(new_order, user, writer)
+        engine.process_order(new_order, writer)
+        return order_id
 
-    def _login(self, login_data: Dict[str, Any]) -> (User, Dict[str, Any]):
+    async def _login(self, login_data: Dict[str, Any]) -> (User, Dict[str, Any]):
         """
-        Tries to log in given supplied login data.
+        Coroutine which tries to log in given supplied login data.
+        Passwords are hashed in the login pool, waiting for it does not block processing of other clients.
 
         :param login_data: Data containing user login info.
         :return: Tipple containing corresponding user, and response to be sent to user if the loggin was successful.
@@ -179,43 +787,134 @@ class ExchangeServer:
         data = {'type': 'login'}
         if 'message' not in login_data or login_data['message'] != 'login':
             data['action'] = 'denied'
-            return False, data
+            self.logins['denied'].inc()
+            return None, data
         username = login_data['username']
         password = login_data['password']
-        password_matches = None
-        if username in self.users.keys():
-            user = self.users[username]
-            password_matches = user.check_password(password)
-        else:
-            user = User()
-            user.set_username(username)
-            user.set_password(password)
-            self.users[username] = user
-            transaction.commit()
+
+        self.login_queue_depth += 1
+        start = perf_counter()
+        try:
+            await self.login_semaphore.acquire()
+        finally:
+            self.login_queue_depth -= 1
+        acquired = perf_counter()
+        self.login_wait.observe(acquired - start)
+        try:
+            if username in self.users.keys():
+                user = self.users[username]
+                password_matches = await self.loop.run_in_executor(self.login_executor, check_passw_hash,
+                                                                   password, user.password)
+            else:
+                passw_hash = await self.loop.run_in_executor(self.login_executor, get_passw_hash, password)
+                if username in self.users.keys():  # registered by another client while hashing
+                    user = self.users[username]
+                    password_matches = await self.loop.run_in_executor(self.login_executor, check_passw_hash,
+                                                                       password, user.password)
+                else:
+                    user = User()
+                    user.set_username(username)
+                    user.set_password_hash(passw_hash)
+                    self.users[username] = user
+                    transaction.commit()
+                    password_matches = None
+        finally:
+            self.login_semaphore.release()
+            self.login_time.observe(perf_counter() - acquired)
+
         if password_matches:
             data['action'] = 'logged_in'
-            return user, data
         elif password_matches is None:
             data['action'] = 'registered'
-            return user, data
         else:
             data['action'] = 'denied'
-            return None, data
+            user = None
+        self.logins[data['action']].inc()
+        return user, data
 
-    @staticmethod
-    def _send_data(writer: StreamWriter, data: Dict[str, Any]) -> None:
+    def _send_data(self, writer: StreamWriter, data: Dict[str, Any]) -> None:
         """
         Sends data using supplied writer.
 
         :param writer: Writer used for sending data.
         :param data: Dictionary of data to be sent.
         """
-        def decimal_decode(obj):
-            if isinstance(obj, decimal.Decimal):
-                return str(obj)
+        writer.write(self._encode_for(writer, data))
 
-        msg = (json.dumps(data, default=decimal_decode) + '\n').encode('utf-8')
-        writer.write(msg)
+    def _send_error(self, writer: StreamWriter, error: ValueError) -> None:
+        """
+        Answers rejected client message.
+
+        :param writer: Writer of the client.
+        :param error: Reason of the rejection.
+        """
+        self.log.debug("Client message rejected: %s", error)
+        self._send_data(writer, {'type': 'error', 'reason': str(error)})
+
+    def _encode_for(self, writer: StreamWriter, data: Dict[str, Any]) -> bytes:
+        """
+        Encodes message using protocol of the client it is sent to.
+
+        :param writer: Writer of the client.
+        :param data: Dictionary of data to be encoded.
+        :return: Raw message.
+        """
+        if writer in self.binary_writers:
+            return self.binary_protocol.encode(data)
+        return self._encode_data(data)
+
+    def _encode_data(self, data: Dict[str, Any]) -> bytes:
+        """
+        Encodes message for client, converting its price from ticks using tick size of its instrument.
+
+        :param data: Dictionary of data to be encoded.
+        :return: Raw message.
+        """
+        price = data.get('price', None)
+        if price is not None:
+            data = dict(data)
+            data['price'] = self.tick_sizes[data.get('symbol', None)].format(price)
+        return self._encode_msg(data)
+
+    @staticmethod
+    def _encode_msg(data: Dict[str, Any]) -> bytes:
+        """
+        Encodes message from python dictionary to json line.
+
+        :param data: Dictionary of data to be encoded.
+        :return: Raw message.
+        """
+        return (json.dumps(data) + '\n').encode('utf-8')
+
+    async def _read_msg(self, reader: StreamReader) -> Dict[str, Any]:
+        """
+        Coroutine which reads and decodes one json line.
+
+        :param reader: Reader of the client.
+        :return: Decoded message, None if the client disconnected.
+        """
+        msg = await reader.readline()
+        if not msg:  # empty string means the client disconnected
+            return None
+        start = perf_counter()
+        data = self._decode_msg(msg)
+        self.json_decode_time.observe(perf_counter() - start)
+        return data
+
+    async def _read_binary_msg(self, reader: StreamReader) -> Dict[str, Any]:
+        """
+        Coroutine which reads and decodes one binary frame.
+
+        :param reader: Reader of the client.
+        :return: Decoded message, None if the client disconnected.
+        """
+        msg_type, body = await self.binary_protocol.read_frame(reader)
+        if body is None:
+            return None
+        start = perf_counter()
+        data = self.binary_protocol.decode(msg_type, body)
+        self.binary_decode_time.observe(perf_counter() - start)
+        return data
 
     @staticmethod
     def _decode_msg(msg: bytes) -> Dict[str, Any]:
@@ -238,19 +937,27 @@ class ExchangeServer:
         :param user: User which is recipient of the data.
         :param writer: Writer used to send the data.
         """
+        if self.replaying:
+            return
         assert user is not None or writer is not None, "You must supply user or writer"
         if writer is not None or user.username in self.private_clients.keys():
             if writer is None:
                 writer = self.private_clients[user.username][1]
-            self._send_data(writer, data)
+            if self.outbox is not None:
+                self.outbox.append((writer, data))
+            else:
+                self._send_data(writer, data)
 
     def get_new_id(self):
         """
-        Simple function used to generate new ids for orders
+        Simple function used to generate new ids for orders.
+        Last used id is stored in DB (or journal), so that ids are not reused after restart.
 
         :return: New Id.
         """
         self.id_counter += 1
+        if self.journal is None:
+            self.db_root['maxcounter'] = self.id_counter
         return self.id_counter
 
     def init_db(self, db: ZODB.DB) -> None:
@@ -266,18 +973,127 @@ class ExchangeServer:
             self.db_root['userdb'] = BTrees.OOBTree.OOBTree()
         self.users = self.db_root['userdb']
 
-        if 'biddb' not in self.db_root.keys():
-            self.db_root['biddb'] = BTrees.OOBTree.OOBTree()
-        self.bid_orders = self.db_root['biddb']
-
-        if 'askdb' not in self.db_root.keys():
-            self.db_root['askdb'] = BTrees.OOBTree.OOBTree()
-        self.ask_orders = self.db_root['askdb']
-
         if 'maxcounter' not in self.db_root.keys():
             self.db_root['maxcounter'] = 0
         self.id_counter = self.db_root['maxcounter']
 
+        converted = False
+        for symbol in self.symbols:
+            suffix = '' if symbol is None else '.' + symbol
+            if 'biddb' + suffix not in self.db_root.keys():
+                self.db_root['biddb' + suffix] = BTrees.OOBTree.OOBTree()
+            self.bid_orders[symbol] = self.db_root['biddb' + suffix]
+
+            if 'askdb' + suffix not in self.db_root.keys():
+                self.db_root['askdb' + suffix] = BTrees.OOBTree.OOBTree()
+            self.ask_orders[symbol] = self.db_root['askdb' + suffix]
+
+            for storage in (self.bid_orders[symbol], self.ask_orders[symbol]):
+                converted = self._convert_legacy_orders(storage, symbol) or converted
+        if converted:
+            self._convert_legacy_users()
+            self.db_root['maxcounter'] = self.id_counter
+            transaction.commit()
+
+    def _convert_legacy_orders(self, storage: BTrees.OOBTree.OOBTree, symbol: str) -> bool:
+        """
+        Converts orders stored by older versions into records (see :meth:`models.Order.to_record`).
+        Older versions stored persistent orders with Decimal prices, either in lists under their price
+        (with UUIDs as ids) or directly under their id. Orders are read in their time priority order,
+        which their new ids (if they do not have integer ones) and priority stamps keep.
+        DB has to be opened with :func:`models.class_factory`, so that old orders can be read.
+
+        :param storage: Tree of orders of one side of the orderbook.
+        :param symbol: Symbol of the instrument, whose tick size prices are converted to.
+        :return: Whether the orders were converted.
+        """
+        try:
+            if not storage or isinstance(storage[storage.minKey()], tuple):
+                return False
+            if isinstance(storage[storage.minKey()], persistent.list.PersistentList):
+                orders = [order for level in storage.values() for order in level]
+            else:
+                orders = list(storage.values())
+        except ZODB.POSException.StateLoadError:
+            raise ValueError("Orders stored in DB cannot be read, if they were stored by older version, "
+                             "DB has to be opened with models.class_factory to convert them")
+        storage.clear()
+        for priority, old_order in enumerate(orders, start=1):
+            order = Order()
+            order.set_id(old_order.id if isinstance(old_order.id, int) else self.get_new_id())
+            order.set_type(old_order.type)
+            try:
+                order.set_price(self.tick_sizes[symbol].to_ticks(old_order.price))
+            except ValueError as e:
+                raise ValueError("Order {} stored in DB cannot be converted: {}".format(old_order.id, e))
+            order.set_quantity(old_order.quantity)
+            order.set_user(old_order.user)
+            order.set_priority(priority)
+            storage[order.id] = order.to_record()
+        self.log.warning("Converted {} orders stored in DB by older version".format(len(orders)))
+        return True
+
+    def _convert_legacy_users(self) -> None:
+        """
+        Drops orders kept by users in DB of older versions, so that old persistent orders are not referenced anymore.
+        """
+        for user in self.users.values():
+            if getattr(user, 'orders', None) is not None:
+                del user.orders
+
+    def _new_event_loop(self) -> AbstractEventLoop:
+        """
+        Creates event loop of the implementation selected by *event_loop*.
+        Falls back to the default asyncio loop if uvloop is selected, but it is not installed.
+
+        :return: New event loop.
+        """
+        if self.event_loop == 'uvloop':
+            if uvloop is not None:
+                return uvloop.new_event_loop()
+            self.log.warning("uvloop is not installed, falling back to asyncio event loop")
+            self.event_loop = 'asyncio'
+        return new_event_loop()
+
+    def _start_shards(self) -> None:
+        """
+        Starts shard worker processes, instruments are distributed among them evenly.
+        """
+        self.shards = [Shard(self.symbols[i::self.shard_count], self.loop)
+                       for i in range(min(self.shard_count, len(self.symbols)))]
+        for shard in self.shards:
+            shard.start()
+            for symbol in shard.symbols:
+                self.symbol_shards[symbol] = shard
+
+    def _create_matching_engines(self) -> None:
+        """
+        Creates matching engine of each instrument, loading orders already stored in DB (outside of journal mode).
+        """
+        for symbol in self.symbols:
+            if self.journal_path is None:
+                engine = MatchingEngine(self.bid_orders[symbol], self.ask_orders[symbol], self, symbol, self.users)
+            else:
+                engine = MatchingEngine(None, None, self, symbol)
+            self.matching_engines[symbol] = engine
+            self.metrics.counter('exchange_trades_total', 'Trades made by matching engine.',
+                                 lambda engine=engine: engine.trades, symbol=symbol or '')
+            self.metrics.counter('exchange_traded_quantity_total', 'Quantity traded by matching engine.',
+                                 lambda engine=engine: engine.traded_quantity, symbol=symbol or '')
+        self.matching_engine = self.matching_engines[self.default_symbol]
+
+    def _capture_settings(self) -> Dict[str, Any]:
+        """
+        :return: Settings of the server and orders resting in the books when the capture starts,
+                 which are needed to replay the captured messages.
+        """
+        orders = [(order.id, order.type.value, order.price, order.quantity, order.user.username, symbol)
+                  for symbol, engine in self.matching_engines.items() for order in engine.orders()]
+        return {'symbols': self.symbols,
+                'tick_sizes': [str(self.tick_sizes[symbol].size) for symbol in self.symbols],
+                'last_id': self.id_counter,
+                'orders': orders}
+
     def start(self, db: ZODB.DB = None, loop: AbstractEventLoop = None) -> None:
         """
         Starts the exchange server.
@@ -287,20 +1103,54 @@ class ExchangeServer:
         :param loop: asyncio loop used in the server.
         """
         if loop is None:
-            self.loop = new_event_loop()
+            self.loop = self._new_event_loop()
+            print("Running on {} event loop".format(self.event_loop))
         else:
             self.loop = loop
         self.broadcast_queue = Queue(loop=self.loop)
+        self.fanout = Fanout(self.loop, self._encode_data, self.public_max_lag, self.public_history)
+        for metric in self.fanout.metrics():
+            self.metrics.register(metric, protocol='json')
+        if self.binary_protocol is not None:
+            self.binary_fanout = Fanout(self.loop, self.binary_protocol.encode, self.public_max_lag,
+                                        self.public_history)
+            for metric in self.binary_fanout.metrics():
+                self.metrics.register(metric, protocol='binary')
+        if self.login_pool == 'process':
+            self.login_executor = ProcessPoolExecutor(self.login_workers)
+        else:
+            self.login_executor = ThreadPoolExecutor(self.login_workers)
+        self.login_semaphore = Semaphore(self.max_concurrent_logins, loop=self.loop)
 
         if db is None:
             storage = ZODB.FileStorage.FileStorage('database.fs')
-            db = ZODB.DB(storage)
+            db = ZODB.DB(storage, class_factory=class_factory)
         self.init_db(db)
-        self.matching_engine = MatchingEngine(self.bid_orders, self.ask_orders, self)
+        if self.shard_count:
+            self._start_shards()
+        else:
+            self._create_matching_engines()
+        if self.journal_path is not None:
+            self._restore_book()
+            if self.snapshot_path is not None:
+                self.loop.call_later(self.snapshot_interval, self._periodic_snapshot)
+        if self.event_log_path is not None:
+            self.event_log = EventLog(self.event_log_path, self.loop, self.event_log_window_ms)
+            self.event_log.open()
+            for engine in self.matching_engines.values():
+                engine.events = self.event_log
+        if self.capture_path is not None:
+            self.capture = Capture(self.capture_path, self.loop, self._capture_settings())
+            self.capture.open()
+        self._load_public_depth()
 
         if self.private_port is not None:
-            private_handle_coro = start_server(self._accept_private_connection, self.host, self.private_port,
-                                               loop=self.loop, reuse_address=True)
+            if self.private_transport == 'protocol':
+                private_handle_coro = self.loop.create_server(lambda: PrivateConnection(self), self.host,
+                                                              self.private_port, reuse_address=True)
+            else:
+                private_handle_coro = start_server(self._accept_private_connection, self.host, self.private_port,
+                                                   loop=self.loop, reuse_address=True)
             self.private_server = self.loop.run_until_complete(private_handle_coro)
             print("Serving private on {}".format(self.private_server.sockets[0].getsockname()))
         if self.public_port is not None:
@@ -308,18 +1158,51 @@ class ExchangeServer:
                                               loop=self.loop, reuse_address=True)
             self.public_server = self.loop.run_until_complete(public_handle_coro)
             print("Serving public on {}".format(self.public_server.sockets[0].getsockname()))
+        if self.binary_private_port is not None:
+            if self.private_transport == 'protocol':
+                binary_private_coro = self.loop.create_server(lambda: PrivateConnection(self, self.binary_protocol),
+                                                              self.host, self.binary_private_port, reuse_address=True)
+            else:
+                binary_private_coro = start_server(self._accept_binary_private_connection, self.host,
+                                                   self.binary_private_port, loop=self.loop, reuse_address=True)
+            self.binary_private_server = self.loop.run_until_complete(binary_private_coro)
+            print("Serving binary private on {}".format(self.binary_private_server.sockets[0].getsockname()))
+        if self.binary_public_port is not None:
+            binary_public_coro = start_server(self._accept_binary_public_connection, self.host,
+                                              self.binary_public_port, loop=self.loop, reuse_address=True)
+            self.binary_public_server = self.loop.run_until_complete(binary_public_coro)
+            print("Serving binary public on {}".format(self.binary_public_server.sockets[0].getsockname()))
+        if self.stats_port is not None:
+            stats_coro = start_server(self.metrics.handle_request, self.host, self.stats_port, loop=self.loop,
+                                      reuse_address=True)
+            self.stats_server = self.loop.run_until_complete(stats_coro)
+            print("Serving stats on {}".format(self.stats_server.sockets[0].getsockname()))
+        if self.stall_threshold_ms is not None:
+            self.watchdog = StallWatchdog(self.loop, threading.get_ident(), self.stall_threshold_ms / 1000,
+                                          lambda: self.current_message)
+            for metric in self.watchdog.metrics():
+                self.metrics.register(metric)
+            self.watchdog.start()
+        if self.admin_socket is not None:
+            self.admin = Admin(self.loop, threading.get_ident(), self.watchdog)
+            admin_coro = start_unix_server(self.admin.handle_client, self.admin_socket, loop=self.loop)
+            self.admin_server = self.loop.run_until_complete(admin_coro)
+            print("Serving admin on {}".format(self.admin_socket))
 
         try:
             self.loop.run_until_complete(self._broadcast_public())
         except KeyboardInterrupt:
             pass
+        if self.capture is not None:
+            self.capture.flush()
 
     def stop(self) -> None:
         """
         Stops the running server (both public and private).
         *NOTE*: Currently does not function correctly, constantly throws RuntimeError.
         """
-        for server in (self.private_server, self.public_server):
+        for server in (self.private_server, self.public_server, self.binary_private_server,
+                       self.binary_public_server, self.stats_server, self.admin_server):
             if server is not None:
                 try:
                     server.close()
@@ -327,20 +1210,99 @@ class ExchangeServer:
                 # TODO fix server not shutting down without exception in tests
                 except RuntimeError:
                     pass
+        for fanout in (self.fanout, self.binary_fanout):
+            if fanout is not None:
+                fanout.close()
+        if self.login_executor is not None:
+            self.login_executor.shutdown(wait=False)
+        for shard in self.shards:
+            shard.stop()
+        if self.journal is not None:
+            if self.snapshot_path is not None:
+                self.take_snapshot()
+            self.journal.close()
+        if self.event_log is not None:
+            self.event_log.close()
+        if self.watchdog is not None:
+            self.watchdog.stop()
+        if self.capture is not None:
+            self.capture.close()
         self.loop.close()
 
 
 if __name__ == '__main__':
-    assert len(sys.argv) >= 4, 'Usage: server.py host private-port public-port'
-    host = sys.argv[1]
-    private_port = int(sys.argv[2])
-    public_port = int(sys.argv[3])
+    parser = argparse.ArgumentParser(description='Exchange server.')
+    parser.add_argument('host')
+    parser.add_argument('private_port', type=int)
+    parser.add_argument('public_port', type=int)
+    parser.add_argument('--memory-db', action='store_true', help='Use in-memory DB instead of database.fs.')
+    parser.add_argument('--debug', action='store_true')
+    parser.add_argument('--journal', metavar='PATH', help='Persist orders by journal stored in PATH.')
+    parser.add_argument('--journal-window-us', type=int, default=1000,
+                        help='Longest time a journal record waits to be written.')
+    parser.add_argument('--journal-window-messages', type=int, default=100,
+                        help='Number of journal records which are written immediately.')
+    parser.add_argument('--snapshot', metavar='PATH', help='Take snapshots of orderbook into PATH (journal mode only).')
+    parser.add_argument('--snapshot-interval', type=float, default=60, help='Seconds between snapshots.')
+    parser.add_argument('--public-max-lag', type=int, default=10000,
+                        help='Number of pending messages after which public client is disconnected.')
+    parser.add_argument('--public-history', type=int, default=10000,
+                        help='Number of public messages kept for retransmission.')
+    parser.add_argument('--login-pool', choices=('thread', 'process'), default='thread',
+                        help='Kind of pool used for password hashing.')
+    parser.add_argument('--login-workers', type=int, default=4, help='Number of password hashing workers.')
+    parser.add_argument('--max-concurrent-logins', type=int, default=16,
+                        help='Number of logins processed at once, others wait in queue.')
+    parser.add_argument('--symbols', help='Comma separated symbols of traded instruments.')
+    parser.add_argument('--tick-size', default=DEFAULT_TICK_SIZE, help='Tick size of instruments.')
+    parser.add_argument('--tick-sizes', help='Comma separated SYMBOL=TICK_SIZE pairs overriding --tick-size.')
+    parser.add_argument('--binary-private-port', type=int, help='Port serving private channel by binary protocol.')
+    parser.add_argument('--binary-public-port', type=int, help='Port serving public channel by binary protocol.')
+    parser.add_argument('--private-transport', choices=('streams', 'protocol'), default='streams',
+                        help='Implementation of private connections.')
+    parser.add_argument('--event-loop', choices=('asyncio', 'uvloop'), default='asyncio',
+                        help='Event loop implementation, uvloop falls back to asyncio if it is not installed.')
+    parser.add_argument('--stats-port', type=int, help='Port serving metrics in Prometheus text format.')
+    parser.add_argument('--event-log', metavar='PATH', help='Record changes of orders into event log stored in PATH.')
+    parser.add_argument('--event-log-window-ms', type=int, default=100,
+                        help='Longest time an event waits to be written to the event log.')
+    parser.add_argument('--admin-socket', metavar='PATH', help='Serve local control socket on PATH.')
+    parser.add_argument('--capture', metavar='PATH',
+                        help='Capture inbound private messages into PATH, to be replayed by replay.py.')
+    parser.add_argument('--stall-threshold-ms', type=float,
+                        help='Watch event loop and report stalls longer than the threshold.')
+    parser.add_argument('--shards', type=int, default=0,
+                        help='Number of worker processes running the matching engines (0 runs them in server), '
+                             'needs --journal.')
+    args = parser.parse_args()
     db = None
-    debug = False
-    if len(sys.argv) >= 5 and sys.argv[4] == '--memory-db':
+    if args.memory_db:
         db = ZODB.DB(None)
-    if len(sys.argv) >= 6 and sys.argv[5] == '--debug':
-        debug = True
 
-    server = ExchangeServer(host, private_port, public_port, debug)
+    server = ExchangeServer(args.host, args.private_port, args.public_port, args.debug,
+                            journal_path=args.journal,
+                            journal_window_us=args.journal_window_us,
+                            journal_window_messages=args.journal_window_messages,
+                            snapshot_path=args.snapshot,
+                            snapshot_interval=args.snapshot_interval,
+                            public_max_lag=args.public_max_lag,
+                            login_pool=args.login_pool,
+                            login_workers=args.login_workers,
+                            max_concurrent_logins=args.max_concurrent_logins,
+                            symbols=args.symbols.split(',') if args.symbols else None,
+                            shards=args.shards,
+                            tick_size=args.tick_size,
+                            tick_sizes=dict(pair.split('=') for pair in args.tick_sizes.split(','))
+                            if args.tick_sizes else None,
+                            binary_private_port=args.binary_private_port,
+                            binary_public_port=args.binary_public_port,
+                            private_transport=args.private_transport,
+                            event_loop=args.event_loop,
+                            public_history=args.public_history,
+                            stats_port=args.stats_port,
+                            event_log_path=args.event_log,
+                            event_log_window_ms=args.event_log_window_ms,
+                            admin_socket=args.admin_socket,
+                            stall_threshold_ms=args.stall_threshold_ms,
+                            capture_path=args.capture)
     server.start(db)
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3.5
+import logging
+import multiprocessing
+import multiprocessing.connection
+from asyncio import AbstractEventLoop, Future
+from collections import deque
+from typing import Dict, Any, List, Tuple
+
+from matching import MatchingEngine
+from models import Order, OrderType, User
+
+Command = Tuple
+Output = Tuple[str, str, Dict[str, Any]]
+
+
+class ShardServer:
+    """
+    Stands in for ExchangeServer inside of shard worker process.
+    Collects messages produced by matching engines, so that they can be sent back to the gateway,
+    which delivers them to clients.
+
+    Private messages are collected as ('private', username, data), public ones as ('public', None, data).
+    """
+    def __init__(self) -> None:
+        self.outputs = []  # type: List[Output]
+
+    def send_data(self, data: Dict[str, Any], user: User = None, writer: str = None) -> None:
+        """
+        Collects private message.
+
+        :param data: Data to be sent.
+        :param user: User which is recipient of the data.
+        :param writer: Username of the recipient, used by engine for the user who placed the processed order.
+        """
+        if user is not None:
+            self.outputs.append(('private', user.username, data))
+        else:
+            self.outputs.append(('private', writer, data))
+
+    def add_to_broadcast(self, data: Dict[str, Any]) -> None:
+        """
+        Collects public message.
+
+        :param data: Data to be broadcasted.
+        """
+        if data is not None:
+            self.outputs.append(('public', None, data))
+
+
+def execute_command(command: Command, engines: Dict[str, MatchingEngine], users: Dict[str, User]) -> None:
+    """
+    Executes one command received from the gateway.
+
+    Commands are tuples:
+     - ('createOrder', symbol, order id, username, order type value, price, quantity),
+     - ('cancelOrder', symbol, order id, username),
+     - ('replaceOrder', symbol, order id, username, new price or None, new quantity or None),
+     - ('orderbook',) which produces public orderbook entries of all levels of all engines.
+
+    :param command: Command to be executed.
+    :param engines: Matching engines of the shard, by their symbol.
+    :param users: Users known to the shard, by their username.
+    """
+    msg_type = command[0]
+    if msg_type == 'createOrder':
+        _, symbol, order_id, username, type_value, price, quantity = command
+        user = users.get(username, None)
+        if user is None:
+            user = User()
+            user.set_username(username)
+            users[username] = user
+        order = Order()
+        order.set_id(order_id)
+        order.set_type(OrderType(type_value))
+        order.set_price(price)
+        order.set_quantity(quantity)
+        engine = engines[symbol]
+        engine.insert_order(order, user, username)
+        engine.process_order(order, username)
+    elif msg_type == 'cancelOrder':
+        _, symbol, order_id, username = command
+        engine = engines[symbol]
+        order = engine.get_order(order_id)
+        if order is not None and order.user.username == username:
+            engine.delete_order(order)
+    elif msg_type == 'replaceOrder':
+        _, symbol, order_id, username, price, quantity = command
+        engine = engines[symbol]
+        order = engine.get_order(order_id)
+        if order is not None and order.user.username == username:
+            engine.replace_order(order, price, quantity, username)
+    elif msg_type == 'orderbook':
+        for engine in engines.values():
+            for book in (engine.bid_book, engine.ask_book):
+                for level in book:
+                    engine.server.add_to_broadcast(engine.get_level_dict(level))
+    else:
+        raise ValueError("Unknown shard command \"{}\"".format(msg_type))
+
+
+def run_shard(conn: multiprocessing.connection.Connection, symbols: List[str]) -> None:
+    """
+    Main loop of shard worker process.
+    Receives lists of commands from the gateway, and replies with list containing outputs of each of them.
+    None received instead of the list stops the worker.
+
+    :param conn: Connection to the gateway.
+    :param symbols: Symbols of instruments managed by this shard.
+    """
+    server = ShardServer()
+    engines = {symbol: MatchingEngine(None, None, server, symbol) for symbol in symbols}
+    users = {}  # type: Dict[str, User]
+    while True:
+        commands = conn.recv()
+        if commands is None:
+            break
+        replies = []
+        for command in commands:
+            server.outputs = []
+            execute_command(command, engines, users)
+            replies.append(server.outputs)
+        conn.send(replies)
+    conn.close()
+
+
+class Shard:
+    """
+    Gateway side of shard worker process, which owns matching engines of some of the instruments.
+
+    Commands are sent to the worker through pipe and their results are received asynchronously,
+    by reader registered in the event loop. At most *max_in_flight* commands are waiting for their results,
+    sending more commands first waits for the oldest results.
+    """
+    def __init__(self, symbols: List[str], loop: AbstractEventLoop, max_in_flight: int = 64) -> None:
+        self.symbols = symbols  # type: List[str]
+        self.loop = loop  # type: AbstractEventLoop
+        self.max_in_flight = max_in_flight  # type: int
+        self.conn = None  # type: multiprocessing.connection.Connection
+        self.process = None  # type: multiprocessing.Process
+        self.pending = deque()  # type: deque[Future]
+        self.log = logging.getLogger('Shard')  # type: logging.Logger
+
+    def start(self) -> None:
+        """
+        Starts the worker process.
+        """
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=run_shard, args=(child_conn, self.symbols), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.loop.add_reader(self.conn.fileno(), self._receive)
+        self.log.info("Shard started for symbols {}".format(', '.join(map(str, self.symbols))))
+
+    def request(self, command: Command) -> Future:
+        """
+        Sends command to the worker.
+
+        :param command: Command to be executed (see :func:`execute_command`).
+        :return: Future which is resolved with list of outputs of the command.
+        """
+        return self.request_many([command])[0]
+
+    def request_many(self, commands: List[Command]) -> List[Future]:
+        """
+        Sends commands to the worker together, as one message.
+
+        :param commands: Commands to be executed, in this order.
+        :return: Futures resolved with list of outputs of each of the commands.
+        """
+        while self.pending and len(self.pending) + len(commands) > self.max_in_flight:
+            self._receive()
+        futures = [self.loop.create_future() for _ in commands]
+        self.pending.extend(futures)
+        self.conn.send(commands)
+        return futures
+
+    def execute(self, commands: List[Command]) -> List[List[Output]]:
+        """
+        Sends commands to the worker and waits for their results, blocking the event loop.
+        Meant to be used only when no other command is in flight, eg. during startup.
+
+        :param commands: Commands to be executed.
+        :return: List of outputs of each command.
+        """
+        assert not self.pending, "Cannot execute commands while other commands are in flight"
+        self.conn.send(commands)
+        return self.conn.recv()
+
+    def _receive(self) -> None:
+        """
+        Receives results from the worker and resolves futures of their commands.
+        """
+        for outputs in self.conn.recv():
+            future = self.pending.popleft()
+            if not future.cancelled():
+                future.set_result(outputs)
+
+    def stop(self) -> None:
+        """
+        Stops the worker process.
+        """
+        if self.process is None:
+            return
+        self.loop.remove_reader(self.conn.fileno())
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(1)
+        self.conn.close()
+        self.process = None
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3.5
+import os
+import struct
+from typing import List, Tuple, Iterable
+
+from models import OrderType, Order
+
+SnapshotOrder = Tuple[int, OrderType, int, int, str, str]
+
+
+class Snapshot:
+    """
+    Compact binary image of all resting orders, used together with journal to restore the orderbook.
+
+    File starts with header containing magic, format version, sequence number of the last journal record
+    included in the snapshot, last used order id and number of orders. Header is followed by one record per order
+    (id, type, price in ticks, quantity, owners username and symbol of the instrument),
+    in the time priority order.
+    """
+    MAGIC = b'WCSN'
+    VERSION = 3
+    HEADER = struct.Struct('<4sHQQI')
+    ORDER = struct.Struct('<QBqQHH')
+
+    def __init__(self, sequence: int = 0, last_id: int = 0, orders: List[SnapshotOrder] = None) -> None:
+        self.sequence = sequence  # type: int
+        self.last_id = last_id  # type: int
+        self.orders = orders if orders is not None else []  # type: List[SnapshotOrder]
+
+    @staticmethod
+    def from_orders(orders: Iterable[Tuple[str, Order]], sequence: int, last_id: int) -> 'Snapshot':
+        """
+        Creates snapshot of given orders.
+
+        :param orders: Symbols of instruments and their resting orders, in the time priority order.
+        :param sequence: Sequence number of the last journal record whose changes are included in the orders.
+        :param last_id: Last used order id.
+        :return: New snapshot.
+        """
+        return Snapshot(sequence, last_id,
+                        [(order.id, order.type, order.price, order.quantity, order.user.username, symbol)
+                         for symbol, order in orders])
+
+    def write(self, path: str) -> None:
+        """
+        Writes the snapshot to given path.
+        Snapshot is written into temporary file first, which then replaces the old snapshot,
+        so there is always one complete snapshot stored.
+
+        :param path: Path of the snapshot file.
+        """
+        chunks = [self.HEADER.pack(self.MAGIC, self.VERSION, self.sequence, self.last_id, len(self.orders))]
+        for order_id, order_type, price, quantity, username, symbol in self.orders:
+            owner = username.encode('utf-8')
+            symbol = (symbol or '').encode('utf-8')
+            chunks.append(self.ORDER.pack(order_id, order_type.value, price, quantity, len(owner), len(symbol)))
+            chunks.append(owner)
+            chunks.append(symbol)
+
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as file:
+            file.write(b''.join(chunks))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def read(path: str) -> 'Snapshot':
+        """
+        Reads snapshot from given path.
+
+        :param path: Path of the snapshot file.
+        :return: Loaded snapshot.
+        """
+        with open(path, 'rb') as file:
+            data = file.read()
+        magic, version, sequence, last_id, count = Snapshot.HEADER.unpack_from(data, 0)
+        if magic != Snapshot.MAGIC or version != Snapshot.VERSION:
+            raise ValueError("File \"{}\" is not a supported snapshot".format(path))
+        offset = Snapshot.HEADER.size
+        orders = []
+        for _ in range(count):
+            order_id, type_value, price, quantity, owner_len, symbol_len = Snapshot.ORDER.unpack_from(data, offset)
+            offset += Snapshot.ORDER.size
+            username = data[offset:offset + owner_len].decode('utf-8')
+            offset += owner_len
+            symbol = data[offset:offset + symbol_len].decode('utf-8') or None
+            offset += symbol_len
+            orders.append((order_id, OrderType(type_value), price, quantity, username, symbol))
+        return Snapshot(sequence, last_id, orders)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3.5
+from decimal import Decimal, InvalidOperation
+from typing import Any
+
+DEFAULT_TICK_SIZE = '0.01'
+
+
+class TickSize:
+    """
+    Converts prices of one instrument between decimal numbers used in client messages
+    and integer number of ticks, which is used for prices everywhere inside of the server.
+    Conversion happens only at the protocol boundary, so that matching compares and hashes plain ints.
+    """
+    def __init__(self, size: Any = DEFAULT_TICK_SIZE) -> None:
+        self.size = Decimal(str(size))  # type: Decimal
+        if not self.size.is_finite() or self.size <= 0:
+            raise ValueError("Tick size has to be positive number, not \"{}\"".format(size))
+        self.places = max(0, -self.size.as_tuple().exponent)  # type: int
+        self.units = int(self.size.scaleb(self.places))  # type: int
+        self.scale = 10 ** self.places  # type: int
+
+    def to_ticks(self, price: Any) -> int:
+        """
+        :param price: Price as received from client (string, int, float or Decimal).
+        :return: Price in ticks. Raises ValueError if the price is not a multiple of the tick size.
+        """
+        try:
+            price = Decimal(str(price))
+        except InvalidOperation:
+            raise ValueError("Price \"{}\" is not a number".format(price))
+        if not price.is_finite() or price % self.size != 0:
+            raise ValueError("Price \"{}\" is not a multiple of tick size {}".format(price, self.size))
+        return int(price / self.size)
+
+    def to_price(self, ticks: int) -> Decimal:
+        """
+        :param ticks: Price in ticks.
+        :return: Price as decimal number.
+        """
+        return Decimal(ticks * self.units).scaleb(-self.places)
+
+    def format(self, ticks: int) -> str:
+        """
+        Formats price for client messages, without going through Decimal.
+
+        :param ticks: Price in ticks.
+        :return: Price as string with as many decimal places as the tick size has.
+        """
+        units = ticks * self.units
+        if not self.places:
+            return str(units)
+        sign = '-' if units < 0 else ''
+        whole, fraction = divmod(abs(units), self.scale)
+        return '{}{}.{:0{}d}'.format(sign, whole, fraction, self.places)
@@ -0,0 +1,40 @@
+Feature: Binary protocol frames are decoded and encoded
+
+  Scenario Outline: Create order frame is decoded with price in ticks
+    Given binary protocol with tick size "<tick_size>" for symbol "<symbol>"
+    When create order frame "<side>" "<quantity>" @ "<price>" for symbol "<symbol>" is decoded
+    Then decoded message is "createOrder" of "<side>" "<quantity>" @ "<ticks>" ticks
+
+    Examples:
+      | tick_size | symbol | side | quantity | price | ticks |
+      | 0.01 | AAPL | BUY | 100 | 100.25 | 10025 |
+      | 0.05 | MSFT | SELL | 7 | 99.95 | 1999 |
+      | 5 | AAPL | BUY | 1 | 100 | 20 |
+
+  Scenario: Price off the tick grid is rejected
+    Given binary protocol with tick size "0.05" for symbol "AAPL"
+    Then create order frame "BUY" "10" @ "99.99" for symbol "AAPL" is rejected
+
+  Scenario: Unknown symbol is rejected
+    Given binary protocol with tick size "0.01" for symbol "AAPL"
+    Then create order frame "BUY" "10" @ "99.99" for symbol "MSFT" is rejected
+
+  Scenario: Login with different protocol version is not accepted
+    Given binary protocol with tick size "0.01" for symbol "AAPL"
+    When login frame of version "1" is decoded
+    Then decoded message is not login
+
+  Scenario: Orderbook message is encoded with fixed point price
+    Given binary protocol with tick size "0.05" for symbol "AAPL"
+    When orderbook message "7" "bid" "300" @ "1999" ticks for symbol "AAPL" is encoded
+    Then encoded orderbook frame is "7" "bid" "300" @ "99.95" for symbol "AAPL"
+
+  Scenario: Sequence numbers of conflated messages are split into frames
+    Given binary protocol with tick size "0.01" for symbol "AAPL"
+    When conflated message with "10000" sequence numbers is encoded
+    Then encoded conflated frames "2" carry all the sequence numbers
+
+  Scenario: Binary fanout loads depth of orderbook restored on start
+    Given server with binary public port and resting order "SELL" "5" @ "1999" ticks for symbol "AAPL"
+    When depth of the public fanouts is loaded
+    Then binary fanout depth has "1" price levels
@@ -0,0 +1,56 @@
+Feature: Captured order flow can be replayed offline
+
+  Scenario: Capture keeps messages of connections and ignores incomplete record at the end
+    Given capture file
+    When user "a" logs in to connection "1" of the capture
+    And user "a" sends "3" orders to the capture
+    And connection "1" of the capture disconnects
+    And capture is closed
+    Then capture contains "5" records
+    When last "2" bytes of capture file are cut off
+    Then capture contains "4" records
+    And record "2" of capture is message "createOrder" of connection "1"
+
+  Scenario: Replay of captured order flow gives the same trades and orderbook
+    Given captured order flow
+      | user | side | price  | quantity |
+      | a    | SELL | 100.00 | 10       |
+      | b    | BUY  | 101.00 | 4        |
+      | b    | BUY  | 99.00  | 3        |
+      | c    | BUY  | 100.00 | 2        |
+    When capture is replayed
+    Then replay makes "2" trades
+    And replay is identical to the capture
+
+  Scenario: Replay keeps connection whose message was rejected
+    Given captured order flow
+      | user | side | price   | quantity |
+      | a    | SELL | 100.00  | 10       |
+      | b    | BUY  | 100.005 | 4        |
+      | b    | BUY  | 101.00  | 4        |
+    When capture is replayed
+    Then replay makes "1" trades
+    And replay rejects "1" messages
+    And replay is identical to the capture
+
+  Scenario: Replay starts from the captured queues
+    Given captured resting orders
+      | id | user | side | price  | quantity |
+      | 2  | mary | BUY  | 100.00 | 5        |
+      | 1  | john | BUY  | 100.00 | 5        |
+    And captured order flow
+      | user | side | price  | quantity |
+      | c    | SELL | 100.00 | 5        |
+    When capture is replayed
+    Then replay makes "1" trades
+    And order "1" of replay has quantity "5"
+    And order "2" of replay is not resting
+
+  Scenario: Replay reports outcome differing from the capture
+    Given captured order flow
+      | user | side | price  | quantity |
+      | a    | SELL | 100.00 | 10       |
+      | b    | BUY  | 101.00 | 4        |
+    And quantity of captured trade "1" is "5"
+    When capture is replayed
+    Then replay reports difference starting with "Trade 1 differs"
@@ -0,0 +1,25 @@
+Feature: Private connection decodes messages directly from received data
+
+  Scenario Outline: Messages split across received chunks are processed once complete
+    Given private connection using "<protocol>" protocol
+    When login and "3" cancel messages are received in chunks of "<chunk>" bytes
+    Then "0" messages are processed
+    When the login is finished
+    Then "3" messages are processed in the order they were sent
+    And decoding of "4" messages is measured
+
+    Examples:
+      | protocol | chunk |
+      | json | 1 |
+      | json | 7 |
+      | json | 1000 |
+      | binary | 1 |
+      | binary | 5 |
+      | binary | 1000 |
+
+  Scenario: Invalid message closes the connection
+    Given private connection using "json" protocol
+    When login and "1" cancel messages are received in chunks of "1000" bytes
+    And the login is finished
+    And data "not json" are received
+    Then the connection is closed
@@ -30,6 +30,28 @@ class FakeServer:
         pass
 
 
+class FakeWriter:
+    def __init__(self):
+        self.data = b''
+        self.writes = 0
+        self.closed = False
+        self.blocked = None  # type: asyncio.Future
+
+    def write(self, data):
+        self.writes += 1
+        self.data += data
+
+    def messages(self):
+        return [json.loads(line) for line in self.data.decode('utf-8').splitlines()]
+
+    async def drain(self):
+        if self.blocked is not None:
+            await self.blocked
+
+    def close(self):
+        self.closed = True
+
+
 class FakeClient:
     def __init__(self, loop):
         self.loop = loop
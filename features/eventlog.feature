@@ -0,0 +1,17 @@
+Feature: Events are written to the event log off the event loop
+
+  Scenario: Events are written once the window elapses
+    Given event log with window "50" ms
+    When event "buy" of order "1" for "100" @ "10025" is recorded
+    And event "fill" of order "2" for "40" @ "10025" against order "1" is recorded
+    Then event log contains "0" lines
+    When "60" ms elapse
+    Then event log contains "2" lines
+    And line "2" of event log is "- fill 2 10025 40 1"
+
+  Scenario: Buffered events are written when the log is closed
+    Given event log with window "10000" ms
+    When event "sell" of order "3" for "5" @ "99" is recorded
+    And event log is closed
+    Then event log contains "1" lines
+    And line "1" of event log is "- sell 3 99 5 0"
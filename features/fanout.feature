@@ -0,0 +1,107 @@
+Feature: Slow public clients do not delay the others
+
+  Scenario: Orderbook messages are conflated for slow client
+    Given public clients "fast" and "slow" with maximal lag "10"
+    When "slow" client stops reading
+    And public messages are published
+      | type | side | price | quantity |
+      | orderbook | bid | 100 | 10 |
+      | orderbook | bid | 100 | 20 |
+      | trade | | 100 | 5 |
+      | orderbook | bid | 100 | 15 |
+    Then "fast" client received "4" messages
+    When "slow" client resumes reading
+    Then "slow" client received messages with sequence numbers "1,3,4"
+    And "slow" client was told that messages "2" were conflated
+    And last message of "slow" client has quantity "15"
+
+  Scenario: Client lagging too much is disconnected
+    Given public clients "fast" and "slow" with maximal lag "2"
+    When "slow" client stops reading
+    And public messages are published
+      | type | side | price | quantity |
+      | trade | | 100 | 5 |
+      | trade | | 100 | 5 |
+      | trade | | 100 | 5 |
+      | trade | | 100 | 5 |
+    Then "fast" client received "4" messages
+    And "slow" client is disconnected
+    And "fast" client is subscribed
+
+  Scenario: Messages published together are sent by one write
+    Given public clients "first" and "second" with maximal lag "10"
+    When public messages are published together
+      | type | side | price | quantity |
+      | trade | | 100 | 5 |
+      | orderbook | ask | 100 | 15 |
+      | orderbook | bid | 101 | 20 |
+    Then "first" client received "3" messages
+    And "first" client received them by "1" writes
+    And "second" client received "3" messages
+    And "second" client received them by "1" writes
+
+  Scenario: Superseded orderbook messages published together are not numbered
+    Given public clients "first" and "second" with maximal lag "10"
+    When public messages published together are conflated
+      | type | side | price | quantity |
+      | orderbook | bid | 100 | 10 |
+      | trade | | 100 | 5 |
+      | orderbook | ask | 100 | 15 |
+      | orderbook | bid | 100 | 20 |
+    Then quantities of conflated messages are "5,15,20"
+
+  Scenario: Joining client receives current depth of the orderbook by one write
+    Given public clients "first" and "second" with maximal lag "10"
+    When public messages are published
+      | type | side | price | quantity |
+      | orderbook | bid | 100 | 10 |
+      | orderbook | ask | 101 | 20 |
+      | trade | | 100 | 5 |
+      | orderbook | bid | 100 | 5 |
+      | orderbook | bid | 99 | 7 |
+      | orderbook | ask | 101 | 0 |
+    And public client "late" joins
+    Then "late" client received "3" messages
+    And "late" client received snapshot with sequence number "6"
+    And "late" client received them by "1" writes
+    And depth snapshot is reused until the depth changes
+
+  Scenario: Client which missed messages receives them again
+    Given public clients "first" and "second" with maximal lag "10" and history "3"
+    When public messages are published
+      | type | side | price | quantity |
+      | trade | | 100 | 5 |
+      | orderbook | bid | 100 | 10 |
+      | orderbook | bid | 100 | 5 |
+      | trade | | 100 | 5 |
+    And "first" client asks for retransmission from "3"
+    Then "first" client received messages with sequence numbers "1,2,3,4,3,4"
+    And "second" client received "4" messages
+
+  Scenario: Retransmission to lagging client is conflated with its pending messages
+    Given public clients "fast" and "slow" with maximal lag "3" and history "10"
+    When "slow" client stops reading
+    And public messages are published
+      | type | side | price | quantity |
+      | orderbook | bid | 100 | 10 |
+      | orderbook | bid | 100 | 20 |
+      | orderbook | bid | 100 | 30 |
+      | orderbook | bid | 100 | 40 |
+      | trade | | 100 | 5 |
+    And "slow" client asks for retransmission from "1"
+    Then "slow" client is subscribed
+    When "slow" client resumes reading
+    Then "slow" client received messages with sequence numbers "1,4,5,5"
+    And "slow" client was told that messages "1,2,3" were conflated
+
+  Scenario: Client which missed messages no longer kept receives snapshot
+    Given public clients "first" and "second" with maximal lag "10" and history "3"
+    When public messages are published
+      | type | side | price | quantity |
+      | orderbook | bid | 100 | 10 |
+      | orderbook | ask | 101 | 20 |
+      | trade | | 100 | 5 |
+      | orderbook | bid | 100 | 5 |
+    And "first" client asks for retransmission from "1"
+    Then "first" client received snapshot with sequence number "4"
+    And "first" client received "7" messages
@@ -0,0 +1,23 @@
+Feature: Processed messages are persisted by journal written in groups
+
+  Scenario: Records are acknowledged once their group is written
+    Given empty journal with window of "3" messages
+    When "2" records are appended to the journal
+    Then "0" records are acknowledged
+    When "1" records are appended to the journal
+    Then "3" records are acknowledged
+    And reopened journal contains "3" records
+
+  Scenario: Records are written when the journal is flushed
+    Given empty journal with window of "100" messages
+    When "5" records are appended to the journal
+    And journal is flushed
+    Then "5" records are acknowledged
+    And reopened journal contains "5" records
+
+  Scenario: Incomplete record at the end of journal is cut off
+    Given empty journal with window of "1" messages
+    When "2" records are appended to the journal
+    And incomplete record is written at the end of the journal
+    Then reopened journal contains "2" records
+    And next record appended to reopened journal has sequence number "3"
@@ -74,4 +74,141 @@ Feature: Each order is matched upon receipt
       | user | type | price | quantity |
       | john | bid | 100.25 | 100 |
       | mary | ask | 100.43 | 100 |
-    Then limit order book has "0" orders
\ No newline at end of file
+    Then limit order book has "0" orders
+
+  @fake_server
+  Scenario: Price level keeps running totals
+    Given orders data
+      | user | type | price | quantity |
+      | john | bid | 100 | 100 |
+      | mary | bid | 100 | 50 |
+      | tom | ask | 101 | 30 |
+    Then "bid" price level "100" has quantity "120" in "2" orders
+    And "john"'s order quantity is "70"
+
+  @fake_server
+  Scenario: Cancel order from the middle of price level
+    Given orders data
+      | user | type | price | quantity |
+      | john | bid | 100 | 100 |
+      | mary | bid | 100 | 50 |
+      | tom | bid | 100 | 20 |
+    When "mary"'s order is cancelled
+    Then "mary"'s order is not in the orderbook
+    And "bid" price level "100" has quantity "120" in "2" orders
+    And limit order book has "2" orders
+
+  @fake_server
+  Scenario: Orderbook is restored from DB records
+    Given orders data
+      | user | type | price | quantity |
+      | john | bid | 100 | 100 |
+      | mary | bid | 100 | 50 |
+      | tom | ask | 101 | 30 |
+    When the matching engine is restarted
+    Then "bid" price level "100" has quantity "120" in "2" orders
+    And "john"'s order quantity is "70"
+    And limit order book has "2" orders
+
+  @fake_server
+  Scenario Outline: Replaced order keeps its place in the queue after restart
+    Given orders data
+      | user | type | price | quantity |
+      | john | bid | <price> | 10 |
+      | mary | bid | 101 | 20 |
+    When "john"'s order is replaced by price "101" and quantity "<quantity>"
+    Then "bid" price level "101" has orders of "mary,john"
+    When the matching engine is restarted
+    Then "bid" price level "101" has orders of "mary,john"
+    And "bid" price level "101" has quantity "<total>" in "2" orders
+
+    Examples:
+      | price | quantity | total |
+      | 101 | 15 | 35 |
+      | 102 | 10 | 30 |
+
+  @fake_server
+  Scenario: Top of the book follows created and emptied levels
+    Given orders data
+      | user | type | price | quantity |
+      | john | ask | 100 | 10 |
+      | mary | ask | 101 | 10 |
+      | tom | bid | 103 | 5 |
+      | anna | bid | 102 | 5 |
+    Then best bid is "101" and best ask is "102"
+    When "mary"'s order is cancelled
+    Then best bid is "100" and best ask is "102"
+    When "anna"'s order is cancelled
+    And "tom"'s order is cancelled
+    Then best bid is "100" and best ask is "none"
+
+  @fake_server
+  Scenario: Reduced order keeps its priority
+    Given orders data
+      | user | type | price | quantity |
+      | john | bid | 100 | 100 |
+      | mary | bid | 100 | 50 |
+    When "john"'s order is replaced by price "100" and quantity "40"
+    Then "bid" price level "100" has quantity "90" in "2" orders
+    And "bid" price level "100" has orders of "john,mary"
+
+  @fake_server
+  Scenario: Increased order loses its priority
+    Given orders data
+      | user | type | price | quantity |
+      | john | bid | 100 | 100 |
+      | mary | bid | 100 | 50 |
+    When "john"'s order is replaced by price "100" and quantity "150"
+    Then "bid" price level "100" has quantity "200" in "2" orders
+    And "bid" price level "100" has orders of "mary,john"
+
+  @fake_server
+  Scenario: Order moved to another price is matched
+    Given orders data
+      | user | type | price | quantity |
+      | john | bid | 101 | 100 |
+      | mary | bid | 101 | 50 |
+      | tom | ask | 99 | 30 |
+    When "john"'s order is replaced by price "99" and quantity "100"
+    Then "bid" price level "101" has quantity "50" in "1" orders
+    And "bid" price level "99" has quantity "70" in "1" orders
+    And "john"'s order quantity is "70"
+    And "tom"'s order is not in the orderbook
+
+  @fake_server
+  Scenario: Changes of orders are recorded as events
+    Given matching engine records events
+    And orders data
+      | user | type | price | quantity |
+      | john | ask | 110 | 100 |
+      | mary | bid | 100 | 60 |
+    Then recorded events are
+      | event | order | price | quantity | other |
+      | buy | 1 | 110 | 100 | 0 |
+      | sell | 2 | 100 | 60 | 0 |
+      | fill | 2 | 110 | 60 | 1 |
+      | delete | 2 | 100 | 60 | 0 |
+
+  Scenario Outline: Orders stored in DB by older version are converted
+    Given DB of older version with orders stored <layout>
+      | user | type | price | quantity |
+      | john | bid | 100 | 100 |
+      | mary | bid | 100 | 50 |
+      | tom | bid | 99 | 30 |
+      | anna | ask | 101 | 20 |
+    When server opens the DB
+    Then "bid" price level "100" has orders of "john,mary"
+    And "bid" price level "100" has quantity "150" in "2" orders
+    And "ask" price level "101" has quantity "20" in "1" orders
+    And limit order book has "4" orders
+
+    Examples:
+      | layout |
+      | by price |
+      | by id |
+
+  Scenario: Orders of older version off the tick size are not converted
+    Given DB of older version with orders stored by id
+      | user | type | price | quantity |
+      | john | bid | 100.005 | 100 |
+    Then server cannot open the DB
@@ -0,0 +1,30 @@
+Feature: Metrics are collected and served in Prometheus text format
+
+  Scenario: Histogram counts observations in cumulative buckets
+    Given metrics registry
+    When latency histogram "exchange_test_seconds" with label "action" "createOrder" is registered
+    And values "0.0000005,0.00003,0.00004,20" are observed
+    Then metrics contain line "exchange_test_seconds_bucket{action="createOrder",le="1e-06"} 1"
+    And metrics contain line "exchange_test_seconds_bucket{action="createOrder",le="5e-05"} 3"
+    And metrics contain line "exchange_test_seconds_bucket{action="createOrder",le="+Inf"} 4"
+    And metrics contain line "exchange_test_seconds_count{action="createOrder"} 4"
+
+  Scenario: Metrics differing by labels share one header
+    Given metrics registry
+    When counter "exchange_test_total" with label "action" "denied" is increased by "2"
+    And counter "exchange_test_total" with label "action" "registered" is increased by "3"
+    Then metrics contain line "# TYPE exchange_test_total counter" once
+    And metrics contain line "exchange_test_total{action="denied"} 2"
+    And metrics contain line "exchange_test_total{action="registered"} 3"
+
+  Scenario Outline: Metrics are served on request
+    Given metrics registry
+    When counter "exchange_test_total" with label "action" "denied" is increased by "2"
+    And stats request "<request>" is received
+    Then response <http> HTTP header
+    And response contains line "exchange_test_total{action="denied"} 2"
+
+    Examples:
+      | request | http |
+      | GET /metrics HTTP/1.1 | has |
+      | metrics | has no |
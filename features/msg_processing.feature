@@ -18,6 +18,15 @@ Feature: Process incoming client messages and respond accordingly if needed to
     And message with order data is received
     Then client receives the "3" created orders ids
 
+
+  @real_server
+  @fake_client
+  @logged_in
+  Scenario: Batch of new orders is acknowledged by one message
+    When batch message with "3" orders is received
+    Then client receives ids of the "3" created orders in one message
+    And "3" orders are created
+
   # Currently sporadically fails due to bug in server shutdown method.
   # @real_server
   # @fake_client
@@ -0,0 +1,34 @@
+Feature: Running server can be profiled without restart
+
+  Scenario Outline: Samples are attributed to the innermost known part of the server
+    When stack "<stack>" is collapsed
+    Then collapsed stack starts with "<category>"
+
+    Examples:
+      | stack | category |
+      | base_events.py:run_forever,server.py:_handle_client,matching.py:process_order,book.py:add | matching |
+      | base_events.py:run_forever,server.py:_handle_client,server.py:_persist,_manager.py:commit | commit |
+      | base_events.py:run_forever,base_events.py:_run_once,selectors.py:select | idle |
+      | base_events.py:run_forever,shard.py:request | other |
+
+  Scenario: Profiler samples stacks of the profiled thread
+    Given sampling profiler of this thread
+    When this thread is busy for "0.2" seconds
+    Then collapsed stacks include function "busy_loop"
+
+  Scenario: Event loop stalls longer than threshold are reported
+    Given stall monitor with threshold "20" ms
+    When event loop is blocked for "60" ms
+    Then "1" stall is reported
+    And stall report summary starts with "stalls 1"
+
+  Scenario: Unknown admin command is answered by error
+    When admin command "bogus" is received
+    Then admin answer starts with "error: Unknown command"
+
+  Scenario: Watchdog counts stalls by the function and message type which blocked the loop
+    Given stall watchdog with threshold "20" ms
+    When event loop is blocked for "100" ms processing "createOrder"
+    Then "1" stall is reported
+    And metrics include 'exchange_loop_stalls_total{handler="profiler.py:block_loop",message="createOrder"} 1'
+    And metrics include 'exchange_loop_stall_seconds_count 1'
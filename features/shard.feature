@@ -0,0 +1,59 @@
+Feature: Instruments are matched separately by shard workers
+
+  Scenario: Orders of different instruments are not matched
+    Given shard with instruments "A,B"
+    When shard executes commands
+      | message | symbol | id | user | side | price | quantity |
+      | createOrder | A | 1 | john | BUY | 100 | 10 |
+      | createOrder | B | 2 | mary | SELL | 100 | 10 |
+    Then shard instrument "A" has "1" orders
+    And shard instrument "B" has "1" orders
+    And all public messages of shard have symbol
+
+  Scenario: Trade is reported to both users
+    Given shard with instruments "A,B"
+    When shard executes commands
+      | message | symbol | id | user | side | price | quantity |
+      | createOrder | A | 1 | john | BUY | 100 | 10 |
+      | createOrder | A | 2 | mary | SELL | 100 | 4 |
+    Then shard instrument "A" has "1" orders
+    And "john" received trade of "4" for "A"
+    And "mary" received trade of "4" for "A"
+
+  Scenario: Order can be cancelled only by its owner
+    Given shard with instruments "A"
+    When shard executes commands
+      | message | symbol | id | user | side | price | quantity |
+      | createOrder | A | 1 | john | BUY | 100 | 10 |
+      | cancelOrder | A | 1 | mary | | | |
+    Then shard instrument "A" has "1" orders
+    When shard executes commands
+      | message | symbol | id | user | side | price | quantity |
+      | cancelOrder | A | 1 | john | | | |
+    Then shard instrument "A" has "0" orders
+
+  Scenario: Shards are not started without journal, as they would lose orders on restart
+    Then server with "2" shards and without journal is rejected
+
+  Scenario: Sharded server restores orders from journal on restart
+    Given journal of sharded server with records
+      | message | symbol | id | user | side | price | quantity |
+      | createOrder | A | 1 | john | BUY | 100 | 10 |
+      | createOrder | B | 2 | mary | SELL | 101 | 5 |
+      | createOrder | A | 3 | mary | SELL | 100 | 4 |
+    When server with "2" shards for instruments "A,B" restarts from the journal
+    Then restarted server publishes orderbook
+      | symbol | side | price | quantity |
+      | A | bid | 100 | 6 |
+      | B | ask | 101 | 5 |
+    And restarted server continues with order id "4"
+
+  Scenario: Journal keeps the order in which shards execute batch and later single message
+    Given sharded server for instruments "A,B" whose shards complete commands on demand
+    When "john" sends batch of orders for instruments "A,B"
+    And "john" sends order for instrument "A"
+    And shard of instrument "A" completes its commands
+    Then journal holds orders "1,2" and "3" in this order
+    And "john" received acknowledgments "orderCreated"
+    When shard of instrument "B" completes its commands
+    Then "john" received acknowledgments "orderCreated,ordersCreated"
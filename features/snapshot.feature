@@ -0,0 +1,14 @@
+Feature: Orderbook is restored from snapshot
+
+  @fake_server
+  Scenario: Snapshot keeps all resting orders in their time priority
+    Given orders data
+      | user | type | price | quantity |
+      | john | bid | 100.25 | 100 |
+      | mary | bid | 100.25 | 50 |
+      | tom | ask | 99 | 30 |
+      | anna | ask | 98.5 | 10 |
+    When snapshot of the orderbook is written and read back
+    And new orderbook is loaded from the snapshot
+    Then loaded orderbook has the same orders in the same order
+    And loaded "bid" price level "100.25" has quantity "150" in "2" orders
@@ -0,0 +1,131 @@
+import asyncio
+import struct
+from decimal import Decimal
+
+import ZODB
+from behave import *
+from hamcrest import *
+import binary
+from binary import BinaryProtocol
+from fanout import Fanout
+from models import Order, User
+from server import ExchangeServer
+from ticks import TickSize
+
+
+def fixed(price):
+    return int(Decimal(price).scaleb(binary.PRICE_PLACES))
+
+
+def create_order_body(side, quantity, price, symbol):
+    return binary.CREATE_ORDER_BODY.pack(symbol.encode('ascii'), 1 if side == 'BUY' else 2, fixed(price),
+                                         int(quantity))
+
+
+@given('binary protocol with tick size "{tick_size}" for symbol "{symbol}"')
+def step_impl(context, tick_size, symbol):
+    context.protocol = BinaryProtocol({symbol: TickSize(tick_size)}, symbol)
+
+
+@when('create order frame "{side}" "{quantity}" @ "{price}" for symbol "{symbol}" is decoded')
+def step_impl(context, side, quantity, price, symbol):
+    context.decoded = context.protocol.decode(binary.CREATE_ORDER, create_order_body(side, quantity, price, symbol))
+
+
+@then('decoded message is "{message}" of "{side}" "{quantity}" @ "{ticks}" ticks')
+def step_impl(context, message, side, quantity, ticks):
+    assert_that(context.decoded, has_entries({'message': message,
+                                              'side': side,
+                                              'quantity': int(quantity),
+                                              'priceTicks': int(ticks)}))
+
+
+@then('create order frame "{side}" "{quantity}" @ "{price}" for symbol "{symbol}" is rejected')
+def step_impl(context, side, quantity, price, symbol):
+    assert_that(calling(context.protocol.decode).with_args(binary.CREATE_ORDER,
+                                                           create_order_body(side, quantity, price, symbol)),
+                raises(ValueError))
+
+
+@when('login frame of version "{version}" is decoded')
+def step_impl(context, version):
+    body = binary.LOGIN_REQUEST.pack(int(version), 4, 4) + b'userpass'
+    context.decoded = context.protocol.decode(binary.LOGIN, body)
+
+
+@then('decoded message is not login')
+def step_impl(context):
+    assert_that(context.decoded['message'], is_not(equal_to('login')))
+
+
+@when('orderbook message "{seq}" "{side}" "{quantity}" @ "{ticks}" ticks for symbol "{symbol}" is encoded')
+def step_impl(context, seq, side, quantity, ticks, symbol):
+    context.encoded = context.protocol.encode({'type': 'orderbook',
+                                               'seq': int(seq),
+                                               'side': side,
+                                               'price': int(ticks),
+                                               'quantity': int(quantity),
+                                               'symbol': symbol})
+
+
+@when('conflated message with "{num}" sequence numbers is encoded')
+def step_impl(context, num):
+    context.seqs = list(range(1, int(num) + 1))
+    context.encoded = context.protocol.encode({'type': 'conflated', 'seqs': context.seqs})
+
+
+@then('encoded conflated frames "{num}" carry all the sequence numbers')
+def step_impl(context, num):
+    frames = 0
+    seqs = []
+    offset = 0
+    while offset < len(context.encoded):
+        length, msg_type = binary.HEADER.unpack_from(context.encoded, offset)
+        assert_that(msg_type, equal_to(binary.CONFLATED))
+        offset += binary.HEADER.size
+        seqs.extend(struct.unpack_from('<{}Q'.format(length // 8), context.encoded, offset))
+        offset += length
+        frames += 1
+    assert_that(frames, equal_to(int(num)))
+    assert_that(seqs, equal_to(context.seqs))
+
+
+@then('encoded orderbook frame is "{seq}" "{side}" "{quantity}" @ "{price}" for symbol "{symbol}"')
+def step_impl(context, seq, side, quantity, price, symbol):
+    length, msg_type = binary.HEADER.unpack_from(context.encoded)
+    assert_that(msg_type, equal_to(binary.ORDERBOOK))
+    assert_that(length, equal_to(len(context.encoded) - binary.HEADER.size))
+    assert_that(binary.ORDERBOOK_BODY.unpack_from(context.encoded, binary.HEADER.size),
+                equal_to((int(seq), symbol.encode('ascii').ljust(8, b'\0'), binary.BOOK_SIDES[side], fixed(price),
+                          int(quantity))))
+
+
+@given('server with binary public port and resting order "{side}" "{quantity}" @ "{ticks}" ticks for symbol "{symbol}"')
+def step_impl(context, side, quantity, ticks, symbol):
+    loop = asyncio.new_event_loop()
+    context.add_cleanup(loop.close)
+    server = ExchangeServer(None, None, symbols=[symbol], tick_sizes={symbol: '0.05'}, binary_public_port=0)
+    server.init_db(ZODB.DB(None))
+    server._create_matching_engines()
+    server.fanout = Fanout(loop, server._encode_data)
+    server.binary_fanout = Fanout(loop, server.binary_protocol.encode)
+    user = User()
+    user.set_username('user')
+    order = Order()
+    order.set_id(1)
+    order.set_type(server._get_order_type(side))
+    order.set_price(int(ticks))
+    order.set_quantity(int(quantity))
+    order.set_user(user)
+    server.matching_engines[symbol].load_orders([order])
+    context.server = server
+
+
+@when('depth of the public fanouts is loaded')
+def step_impl(context):
+    context.server._load_public_depth()
+
+
+@then('binary fanout depth has "{num}" price levels')
+def step_impl(context, num):
+    assert_that(context.server.binary_fanout.depth, has_length(int(num)))
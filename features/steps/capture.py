@@ -0,0 +1,145 @@
+import asyncio
+import os
+import tempfile
+
+from behave import *
+from hamcrest import *
+from capture import Capture, LOGIN, MESSAGE, PUBLIC
+from models import OrderType
+from replay import Replay
+from ticks import TickSize
+
+
+@given('capture file')
+def step_impl(context):
+    directory = tempfile.TemporaryDirectory()
+    context.capture_loop = asyncio.new_event_loop()
+    context.capture_path = os.path.join(directory.name, 'capture.bin')
+    context.capture = Capture(context.capture_path, context.capture_loop,
+                              {'symbols': [None], 'tick_sizes': ['0.01'], 'last_id': 0, 'orders': []})
+    context.capture.open()
+    context.writers = {}
+
+    def cleanup():
+        context.capture.close()
+        context.capture_loop.close()
+        directory.cleanup()
+    context.add_cleanup(cleanup)
+
+
+@when('user "{username}" logs in to connection "{connection}" of the capture')
+def step_impl(context, username, connection):
+    context.writers[username] = object()
+    context.capture.login(context.writers[username], username)
+
+
+@when('user "{username}" sends "{num}" orders to the capture')
+def step_impl(context, username, num):
+    for i in range(int(num)):
+        context.capture.message(context.writers[username], {'message': 'createOrder', 'side': 'BUY',
+                                                            'price': '10.00', 'quantity': i + 1})
+
+
+@when('connection "{connection}" of the capture disconnects')
+def step_impl(context, connection):
+    context.capture.disconnect(list(context.writers.values())[int(connection) - 1])
+
+
+@when('capture is closed')
+def step_impl(context):
+    context.capture.close()
+
+
+@when('last "{num}" bytes of capture file are cut off')
+def step_impl(context, num):
+    with open(context.capture_path, 'r+b') as file:
+        file.truncate(os.path.getsize(context.capture_path) - int(num))
+
+
+@then('capture contains "{num}" records')
+def step_impl(context, num):
+    assert_that(Capture.read(context.capture_path)[1], has_length(int(num)))
+
+
+@then('record "{index}" of capture is message "{msg_type}" of connection "{connection}"')
+def step_impl(context, index, msg_type, connection):
+    _, record_connection, kind, payload = Capture.read(context.capture_path)[1][int(index) - 1]
+    assert_that(kind, equal_to(MESSAGE))
+    assert_that(record_connection, equal_to(int(connection)))
+    assert_that(payload['message'], equal_to(msg_type))
+
+
+@given('captured resting orders')
+def step_impl(context):
+    tick_size = TickSize('0.01')
+    # internally BUY orders have type ask and SELL orders type bid
+    context.captured_orders = [(int(row['id']), (OrderType.ask if row['side'] == 'BUY' else OrderType.bid).value,
+                                tick_size.to_ticks(row['price']), int(row['quantity']), row['user'], None)
+                               for row in context.table]
+
+
+@given('captured order flow')
+def step_impl(context):
+    orders = getattr(context, 'captured_orders', [])
+    settings = {'symbols': [None], 'tick_sizes': ['0.01'], 'last_id': max([order[0] for order in orders] or [0]),
+                'orders': orders}
+    connections = {}
+    records = []
+    for row in context.table:
+        if row['user'] not in connections:
+            connections[row['user']] = len(connections) + 1
+            records.append((0, connections[row['user']], LOGIN, row['user']))
+        records.append((0, connections[row['user']], MESSAGE,
+                        {'message': 'createOrder', 'side': row['side'], 'price': row['price'],
+                         'quantity': int(row['quantity'])}))
+    # outcome of the captured run is what the server published when processing the messages
+    live = Replay(settings, records)
+    live.run()
+    context.settings = settings
+    context.records = records + [(0, 0, PUBLIC, data) for data in live.published]
+
+
+@given('quantity of captured trade "{index}" is "{quantity}"')
+def step_impl(context, index, quantity):
+    trades = [payload for _, _, kind, payload in context.records if kind == PUBLIC and payload['type'] == 'trade']
+    trades[int(index) - 1]['quantity'] = int(quantity)
+
+
+@when('capture is replayed')
+def step_impl(context):
+    context.replay = Replay(context.settings, context.records)
+    context.replay.run()
+
+
+@then('replay makes "{num}" trades')
+def step_impl(context, num):
+    assert_that(sum(engine.trades for engine in context.replay.server.matching_engines.values()), equal_to(int(num)))
+
+
+@then('replay rejects "{num}" messages')
+def step_impl(context, num):
+    assert_that(context.replay.rejected, equal_to(int(num)))
+    assert_that(context.replay.failed, equal_to(0))
+
+
+@then('order "{order_id}" of replay has quantity "{quantity}"')
+def step_impl(context, order_id, quantity):
+    order = context.replay.server.matching_engine.get_order(int(order_id))
+    assert_that(order, not_none())
+    assert_that(order.quantity, equal_to(int(quantity)))
+
+
+@then('order "{order_id}" of replay is not resting')
+def step_impl(context, order_id):
+    assert_that(context.replay.server.matching_engine.get_order(int(order_id)), none())
+    assert_that(context.replay.server.ask_orders[None], not_(has_key(int(order_id))))
+
+
+@then('replay is identical to the capture')
+def step_impl(context):
+    assert_that(context.replay.compare(), empty())
+
+
+@then('replay reports difference starting with "{text}"')
+def step_impl(context, text):
+    assert_that(context.replay.compare(), has_item(starts_with(text)))
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+
+from behave import *
+from hamcrest import *
+import binary
+from binary import BinaryProtocol
+from connection import PrivateConnection
+from metrics import Histogram
+from models import User
+from server import ExchangeServer
+from ticks import TickSize
+
+
+class FakeTransport:
+    def __init__(self):
+        self.written = []
+        self.closed = False
+
+    def write(self, data):
+        self.written.append(data)
+
+    def close(self):
+        self.closed = True
+
+
+class LoginServer:
+    """
+    Server which logs in everybody and records processed messages.
+    """
+    def __init__(self, loop):
+        self.loop = loop
+        self.binary_writers = set()
+        self.private_clients = {}
+        self.processed = []
+        self.capture = None
+        self.json_decode_time = Histogram('exchange_decode_seconds', 'Decoding.')
+        self.binary_decode_time = Histogram('exchange_decode_seconds', 'Decoding.')
+        self.log = logging.getLogger('LoginServer')
+
+    async def _login(self, login_data):
+        user = User()
+        user.set_username(login_data['username'])
+        return user, {'type': 'login', 'action': 'registered'}
+
+    def _process_message(self, writer, data, user):
+        self.processed.append(data)
+
+    def _send_data(self, writer, data):
+        writer.write(data)
+
+    _decode_msg = staticmethod(ExchangeServer._decode_msg)
+
+
+@given('private connection using "{protocol}" protocol')
+def step_impl(context, protocol):
+    context.loop = asyncio.new_event_loop()
+    context.server = LoginServer(context.loop)
+    context.protocol = protocol
+    binary_protocol = BinaryProtocol({None: TickSize()}) if protocol == 'binary' else None
+    context.connection = PrivateConnection(context.server, binary_protocol)
+    context.transport = FakeTransport()
+    context.connection.connection_made(context.transport)
+
+
+def encode_login(protocol):
+    if protocol == 'json':
+        return b'{"message": "login", "username": "user", "password": "pass"}\n\n'
+    body = binary.LOGIN_REQUEST.pack(binary.VERSION, 4, 4) + b'userpass'
+    return binary.HEADER.pack(len(body), binary.LOGIN) + body
+
+
+def encode_cancel(protocol, order_id):
+    if protocol == 'json':
+        return '{{"message": "cancelOrder", "orderId": {}}}\n'.format(order_id).encode('utf-8')
+    body = binary.CANCEL_ORDER_BODY.pack(b'', order_id)
+    return binary.HEADER.pack(len(body), binary.CANCEL_ORDER) + body
+
+
+@when('login and "{num}" cancel messages are received in chunks of "{chunk}" bytes')
+def step_impl(context, num, chunk):
+    context.sent_ids = list(range(1, int(num) + 1))
+    data = encode_login(context.protocol) + b''.join(encode_cancel(context.protocol, order_id)
+                                                    for order_id in context.sent_ids)
+    chunk = int(chunk)
+    for i in range(0, len(data), chunk):
+        context.connection.data_received(data[i:i + chunk])
+
+
+@when('the login is finished')
+def step_impl(context):
+    context.loop.run_until_complete(asyncio.sleep(0))
+    context.loop.run_until_complete(asyncio.sleep(0))
+    assert_that(context.server.private_clients, has_key('user'))
+
+
+@then('"{num}" messages are processed')
+def step_impl(context, num):
+    assert_that(context.server.processed, has_length(int(num)))
+
+
+@then('"{num}" messages are processed in the order they were sent')
+def step_impl(context, num):
+    assert_that([data['orderId'] for data in context.server.processed], equal_to(context.sent_ids))
+
+
+@then('decoding of "{num}" messages is measured')
+def step_impl(context, num):
+    histogram = context.server.binary_decode_time if context.protocol == 'binary' else context.server.json_decode_time
+    assert_that(histogram.count, equal_to(int(num)))
+
+
+@when('data "{data}" are received')
+def step_impl(context, data):
+    context.connection.data_received(data.encode('utf-8') + b'\n')
+
+
+@then('the connection is closed')
+def step_impl(context):
+    assert_that(context.transport.closed, equal_to(True))
@@ -0,0 +1,57 @@
+import asyncio
+import os
+import tempfile
+import time
+
+from behave import *
+from hamcrest import *
+from eventlog import EventLog
+
+
+@given('event log with window "{window_ms}" ms')
+def step_impl(context, window_ms):
+    directory = tempfile.TemporaryDirectory()
+    context.event_loop = asyncio.new_event_loop()
+    context.event_log = EventLog(os.path.join(directory.name, 'events.log'), context.event_loop, int(window_ms))
+    context.event_log.open()
+
+    def cleanup():
+        context.event_log.close()
+        context.event_loop.close()
+        directory.cleanup()
+    context.add_cleanup(cleanup)
+
+
+@when('event "{event}" of order "{order_id}" for "{quantity}" @ "{price}" is recorded')
+@when('event "{event}" of order "{order_id}" for "{quantity}" @ "{price}" against order "{other_id}" is recorded')
+def step_impl(context, event, order_id, quantity, price, other_id='0'):
+    context.event_log.record(None, event, int(order_id), int(price), int(quantity), int(other_id))
+
+
+@when('"{ms}" ms elapse')
+def step_impl(context, ms):
+    context.event_loop.run_until_complete(asyncio.sleep(int(ms) / 1000))
+    if context.event_log.written is not None:
+        context.event_log.written.result()
+
+
+@when('event log is closed')
+def step_impl(context):
+    context.event_log.close()
+
+
+def read_lines(context):
+    with open(context.event_log.path) as file:
+        return file.read().splitlines()
+
+
+@then('event log contains "{num}" lines')
+def step_impl(context, num):
+    assert_that(read_lines(context), has_length(int(num)))
+
+
+@then('line "{num}" of event log is "{line}"')
+def step_impl(context, num, line):
+    timestamp, rest = read_lines(context)[int(num) - 1].split(' ', 1)
+    assert_that(float(timestamp), close_to(time.time(), 60))
+    assert_that(rest, equal_to(line))
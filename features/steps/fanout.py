@@ -0,0 +1,154 @@
+import asyncio
+from behave import *
+from hamcrest import *
+from environment import FakeWriter
+from fanout import Fanout
+from server import ExchangeServer
+
+
+def run_loop(context):
+    for _ in range(3):
+        context.fanout_loop.run_until_complete(asyncio.sleep(0))
+
+
+@given('public clients "{first}" and "{second}" with maximal lag "{max_lag}"')
+@given('public clients "{first}" and "{second}" with maximal lag "{max_lag}" and history "{history}"')
+def step_impl(context, first, second, max_lag, history='10000'):
+    context.fanout_loop = asyncio.new_event_loop()
+    context.fanout = Fanout(context.fanout_loop, ExchangeServer._encode_msg, int(max_lag), int(history))
+
+    def cleanup():
+        context.fanout.close()
+        run_loop(context)
+        context.fanout_loop.close()
+    context.add_cleanup(cleanup)
+    context.public_writers = {}
+    context.subscribers = {}
+    context.public_sequence = 0
+    for name in (first, second):
+        context.public_writers[name] = FakeWriter()
+        context.subscribers[name] = context.fanout.subscribe(context.public_writers[name])
+        # snapshot of empty orderbook is not counted
+        context.public_writers[name].data = b''
+        context.public_writers[name].writes = 0
+    run_loop(context)
+
+
+@when('"{name}" client stops reading')
+def step_impl(context, name):
+    context.public_writers[name].blocked = context.fanout_loop.create_future()
+
+
+@when('"{name}" client resumes reading')
+def step_impl(context, name):
+    context.public_writers[name].blocked.set_result(None)
+    context.public_writers[name].blocked = None
+    run_loop(context)
+
+
+def next_sequence(context):
+    context.public_sequence += 1
+    return context.public_sequence
+
+
+def table_messages(context):
+    messages = []
+    for row in context.table:
+        data = {'type': row['type'], 'seq': next_sequence(context), 'price': row['price'],
+                'quantity': int(row['quantity'])}
+        if row['side']:
+            data['side'] = row['side']
+        messages.append(data)
+    return messages
+
+
+@step("public messages are published")
+def step_impl(context):
+    for data in table_messages(context):
+        context.fanout.publish([data])
+        run_loop(context)
+
+
+@step("public messages are published together")
+def step_impl(context):
+    context.fanout.publish(table_messages(context))
+    run_loop(context)
+
+
+@when("public messages published together are conflated")
+def step_impl(context):
+    context.conflated = Fanout.conflate(table_messages(context))
+
+
+@then('quantities of conflated messages are "{quantities}"')
+def step_impl(context, quantities):
+    assert_that([data['quantity'] for data in context.conflated],
+                equal_to([int(quantity) for quantity in quantities.split(',')]))
+
+
+@step('"{name}" client received them by "{num}" writes')
+def step_impl(context, name, num):
+    assert_that(context.public_writers[name].writes, equal_to(int(num)))
+
+
+@then('"{name}" client received "{num}" messages')
+def step_impl(context, name, num):
+    assert_that(len(context.public_writers[name].messages()), equal_to(int(num)))
+
+
+@step('last message of "{name}" client has quantity "{quantity}"')
+def step_impl(context, name, quantity):
+    assert_that(context.public_writers[name].messages()[-1]['quantity'], equal_to(int(quantity)))
+
+
+@step('"{name}" client is disconnected')
+def step_impl(context, name):
+    assert_that(context.public_writers[name].closed, equal_to(True))
+    assert_that(context.fanout.subscribers, not_(has_item(context.subscribers[name])))
+
+
+@step('"{name}" client is subscribed')
+def step_impl(context, name):
+    assert_that(context.public_writers[name].closed, equal_to(False))
+    assert_that(context.fanout.subscribers, has_item(context.subscribers[name]))
+
+
+@when('public client "{name}" joins')
+def step_impl(context, name):
+    context.public_writers[name] = FakeWriter()
+    context.subscribers[name] = context.fanout.subscribe(context.public_writers[name])
+    run_loop(context)
+
+
+@when('"{name}" client asks for retransmission from "{seq}"')
+def step_impl(context, name, seq):
+    context.subscribers[name].retransmit(int(seq))
+    run_loop(context)
+
+
+@step('"{name}" client received messages with sequence numbers "{numbers}"')
+def step_impl(context, name, numbers):
+    assert_that([msg['seq'] for msg in context.public_writers[name].messages() if msg['type'] != 'conflated'],
+                equal_to([int(number) for number in numbers.split(',')]))
+
+
+@step('"{name}" client was told that messages "{numbers}" were conflated')
+def step_impl(context, name, numbers):
+    seqs = [seq for msg in context.public_writers[name].messages() if msg['type'] == 'conflated'
+            for seq in msg['seqs']]
+    assert_that(seqs, equal_to([int(number) for number in numbers.split(',')]))
+
+
+@step('"{name}" client received snapshot with sequence number "{seq}"')
+def step_impl(context, name, seq):
+    snapshots = [msg for msg in context.public_writers[name].messages() if msg['type'] == 'snapshot']
+    assert_that(snapshots[-1]['seq'], equal_to(int(seq)))
+
+
+@then('depth snapshot is reused until the depth changes')
+def step_impl(context):
+    snapshot = context.fanout.depth_snapshot()
+    assert_that(context.fanout.depth_snapshot(), same_instance(snapshot))
+    context.fanout.publish([{'type': 'orderbook', 'seq': next_sequence(context), 'side': 'bid', 'price': '98',
+                             'quantity': 1}])
+    assert_that(context.fanout.depth_snapshot(), is_not(same_instance(snapshot)))
@@ -0,0 +1,60 @@
+import asyncio
+import os
+import tempfile
+from behave import *
+from hamcrest import *
+from journal import Journal
+
+
+@given('empty journal with window of "{num}" messages')
+def step_impl(context, num):
+    context.journal_dir = tempfile.TemporaryDirectory()
+    context.journal_path = os.path.join(context.journal_dir.name, 'journal.log')
+    context.journal_loop = asyncio.new_event_loop()
+    context.journal = Journal(context.journal_path, context.journal_loop, window_messages=int(num))
+    context.journal.open()
+    context.acknowledged = []
+
+    def cleanup():
+        context.journal.close()
+        context.journal_loop.close()
+        context.journal_dir.cleanup()
+    context.add_cleanup(cleanup)
+
+
+@when('"{num}" records are appended to the journal')
+def step_impl(context, num):
+    for i in range(int(num)):
+        record = {'message': 'createOrder', 'id': i}
+        context.journal.append(record, lambda: context.acknowledged.append(record))
+
+
+@step("journal is flushed")
+def step_impl(context):
+    context.journal.flush()
+
+
+@then('"{num}" records are acknowledged')
+def step_impl(context, num):
+    assert_that(len(context.acknowledged), equal_to(int(num)))
+
+
+@step("incomplete record is written at the end of the journal")
+def step_impl(context):
+    context.journal.close()
+    with open(context.journal_path, 'ab') as file:
+        file.write(b'{"message":"createOr')
+
+
+@step('reopened journal contains "{num}" records')
+def step_impl(context, num):
+    context.journal.close()
+    context.journal = Journal(context.journal_path, context.journal_loop)
+    records = context.journal.open()
+    assert_that(len(records), equal_to(int(num)))
+    assert_that([record['seq'] for record in records], equal_to(list(range(1, int(num) + 1))))
+
+
+@step('next record appended to reopened journal has sequence number "{seq}"')
+def step_impl(context, seq):
+    assert_that(context.journal.append({'message': 'cancelOrder'}), equal_to(int(seq)))
@@ -1,9 +1,38 @@
 import uuid
-from behave import *
 from decimal import Decimal
+from behave import *
 from hamcrest import *
+from persistent.list import PersistentList
+import BTrees.OOBTree
+import transaction
+import ZODB
+from persistent import Persistent
 from matching import MatchingEngine
-from models import Order, OrderType, User
+import models
+from models import Order, OrderType, User, class_factory
+from server import ExchangeServer
+from ticks import TickSize
+
+tick_size = TickSize()
+
+
+class OldOrder(Persistent):
+    """
+    Persistent order of older versions, stored under their class path models.Order.
+    """
+    pass
+
+
+OldOrder.__name__ = OldOrder.__qualname__ = 'Order'
+OldOrder.__module__ = 'models'
+
+
+class FakeEventLog:
+    def __init__(self):
+        self.events = []
+
+    def record(self, symbol, event, order_id, price, quantity, other_id=0):
+        self.events.append((event, order_id, price, quantity, other_id))
 
 
 @given("orders data")
@@ -11,13 +40,14 @@ def step_impl(context):
     dummy_user = User()
     dummy_user.set_password("pass")
     dummy_user.set_username("user")
-    for row in context.table:
-        context.matching_engine = MatchingEngine(context.bids, context.asks, context.server)
+    context.users = {dummy_user.username: dummy_user}
+    for order_id, row in enumerate(context.table, start=1):
+        context.matching_engine = MatchingEngine(context.bids, context.asks, context.server, users=context.users)
+        context.matching_engine.events = getattr(context, 'event_log', None)
         username = row['user']
         order_type = row['type'].upper()
-        price = Decimal(row['price'])
+        price = tick_size.to_ticks(row['price'])
         quantity = int(row['quantity'])
-        order_id = uuid.uuid4()
         order = Order()
         order.set_id(order_id)
         if order_type == 'BID':
@@ -41,11 +71,128 @@ def step_impl(context, num):
 @step('"{username}"\'s order quantity is "{quantity}"')
 def step_impl(context, username, quantity):
     order = context.usernames[username]
-    storage = None
-    if order.type == OrderType.bid:
-        storage = context.matching_engine.bids
-    elif order.type == OrderType.ask:
-        storage = context.matching_engine.asks
-    for stored_order in storage[order.price]:
-        if stored_order.id == order.id:
-            assert_that(stored_order.quantity, equal_to(int(quantity)))
+    stored_order = context.matching_engine.get_order(order.id)
+    assert_that(stored_order, not_none())
+    assert_that(stored_order.quantity, equal_to(int(quantity)))
+
+
+@then('"{order_type}" price level "{price}" has quantity "{quantity}" in "{count}" orders')
+def step_impl(context, order_type, price, quantity, count):
+    if order_type == 'bid':
+        book = context.matching_engine.bid_book
+    else:
+        book = context.matching_engine.ask_book
+    level = book.get(tick_size.to_ticks(price))
+    assert_that(level.quantity, equal_to(int(quantity)), "Price level quantity")
+    assert_that(level.count, equal_to(int(count)), "Price level order count")
+    assert_that(level.quantity, equal_to(sum(order.quantity for order in level)))
+
+
+@when('"{username}"\'s order is cancelled')
+def step_impl(context, username):
+    order = context.usernames[username]
+    context.matching_engine.delete_order(context.matching_engine.get_order(order.id))
+
+
+@then('"{username}"\'s order is not in the orderbook')
+def step_impl(context, username):
+    order = context.usernames[username]
+    assert_that(context.matching_engine.get_order(order.id), none())
+
+
+@when('the matching engine is restarted')
+def step_impl(context):
+    context.matching_engine = MatchingEngine(context.bids, context.asks, context.server, users=context.users)
+
+
+@then('best bid is "{bid}" and best ask is "{ask}"')
+def step_impl(context, bid, ask):
+    def expected(price):
+        return None if price == 'none' else tick_size.to_ticks(price)
+    assert_that(context.matching_engine.best_bid(), equal_to(expected(bid)), "Best bid")
+    assert_that(context.matching_engine.best_ask(), equal_to(expected(ask)), "Best ask")
+
+
+@when('"{username}"\'s order is replaced by price "{price}" and quantity "{quantity}"')
+def step_impl(context, username, price, quantity):
+    order = context.matching_engine.get_order(context.usernames[username].id)
+    context.matching_engine.replace_order(order, tick_size.to_ticks(price), int(quantity), None)
+
+
+@then('"{order_type}" price level "{price}" has orders of "{usernames}"')
+def step_impl(context, order_type, price, usernames):
+    if order_type == 'bid':
+        book = context.matching_engine.bid_book
+    else:
+        book = context.matching_engine.ask_book
+    expected = [context.usernames[username].id for username in usernames.split(',')]
+    assert_that([order.id for order in book.get(tick_size.to_ticks(price))], equal_to(expected))
+
+
+@given("matching engine records events")
+def step_impl(context):
+    context.event_log = FakeEventLog()
+
+
+@then("recorded events are")
+def step_impl(context):
+    expected = [(row['event'], int(row['order']), tick_size.to_ticks(row['price']), int(row['quantity']),
+                 int(row['other'])) for row in context.table]
+    assert_that(context.event_log.events, equal_to(expected))
+
+
+@given('DB of older version with orders stored {layout}')
+def step_impl(context, layout):
+    context.db = ZODB.DB(None, class_factory=class_factory)
+    # Connection stays open, so that the server reads the orders by its own connection through the class factory.
+    root = context.db.open().root()
+    root['userdb'] = BTrees.OOBTree.OOBTree()
+    root['biddb'] = BTrees.OOBTree.OOBTree()
+    root['askdb'] = BTrees.OOBTree.OOBTree()
+    root['maxcounter'] = 0
+    for order_id, row in enumerate(context.table, start=1):
+        user = User()
+        user.set_username(row['user'])
+        user.set_password_hash(b'')
+        user.orders = {}
+        root['userdb'][user.username] = user
+        order = OldOrder()
+        order.type = OrderType.bid if row['type'] == 'bid' else OrderType.ask
+        order.user = user
+        order.price = Decimal(row['price'])
+        order.quantity = int(row['quantity'])
+        storage = root['biddb'] if order.type == OrderType.bid else root['askdb']
+        if layout == 'by price':
+            order.id = uuid.uuid4()
+            if order.price not in storage:
+                storage[order.price] = PersistentList()
+            storage[order.price].append(order)
+        else:
+            order.id = order_id
+            root['maxcounter'] = order_id
+            storage[order.id] = order
+        user.orders[order.id] = order
+    current_order = models.Order
+    models.Order = OldOrder
+    try:
+        transaction.commit()
+    finally:
+        models.Order = current_order
+
+
+@when('server opens the DB')
+def step_impl(context):
+    server = ExchangeServer(None, None)
+    server.init_db(context.db)
+    server._create_matching_engines()
+    context.matching_engine = server.matching_engines[None]
+    context.usernames = {order.user.username: order for order in context.matching_engine.orders()}
+    assert_that(server.id_counter, equal_to(len(context.usernames)))
+    assert_that(all(not hasattr(user, 'orders') for user in server.users.values()))
+
+
+@then('server cannot open the DB')
+def step_impl(context):
+    server = ExchangeServer(None, None)
+    assert_that(calling(server.init_db).with_args(context.db),
+                raises(ValueError, "Order 1 stored in DB cannot be converted"))
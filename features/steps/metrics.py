@@ -0,0 +1,61 @@
+import asyncio
+
+from behave import *
+from hamcrest import *
+from environment import FakeWriter
+from metrics import Metrics
+
+
+@given('metrics registry')
+def step_impl(context):
+    context.metrics = Metrics()
+
+
+@when('latency histogram "{name}" with label "{label}" "{value}" is registered')
+def step_impl(context, name, label, value):
+    context.histogram = context.metrics.histogram(name, 'Test histogram.', **{label: value})
+
+
+@when('values "{values}" are observed')
+def step_impl(context, values):
+    for value in values.split(','):
+        context.histogram.observe(float(value))
+
+
+@when('counter "{name}" with label "{label}" "{value}" is increased by "{amount}"')
+def step_impl(context, name, label, value, amount):
+    context.metrics.counter(name, 'Test counter.', **{label: value}).inc(int(amount))
+
+
+@then('metrics contain line "{line}" once')
+def step_impl(context, line):
+    assert_that(context.metrics.render().splitlines().count(line), equal_to(1))
+
+
+@then('metrics contain line "{line}"')
+def step_impl(context, line):
+    assert_that(context.metrics.render().splitlines(), has_item(line))
+
+
+@when('stats request "{request}" is received')
+def step_impl(context, request):
+    loop = asyncio.new_event_loop()
+    try:
+        reader = asyncio.StreamReader(loop=loop)
+        reader.feed_data(request.encode('ascii') + b'\r\nHost: localhost\r\n\r\n')
+        context.writer = FakeWriter()
+        loop.run_until_complete(context.metrics.handle_request(reader, context.writer))
+    finally:
+        loop.close()
+    assert_that(context.writer.closed, equal_to(True))
+
+
+@then('response {has} HTTP header')
+def step_impl(context, has):
+    starts_with = context.writer.data.startswith(b'HTTP/1.0 200 OK\r\n')
+    assert_that(starts_with, equal_to(has == 'has'))
+
+
+@then('response contains line "{line}"')
+def step_impl(context, line):
+    assert_that(context.writer.data.decode('utf-8').splitlines(), has_item(line))
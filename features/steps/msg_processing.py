@@ -1,5 +1,3 @@
-import decimal
-
 from behave import *
 from hamcrest import *
 
@@ -10,13 +8,13 @@ def step_impl(context):
                          'side': 'BUY',
                          'price': 100,
                          'quantity': 100})
-    context.price = decimal.Decimal(100)
+    context.price = context.server.tick_sizes[None].to_ticks(100)
     context.quantity = 100
 
 
 @then("order is created")
 def step_impl(context):
-    order = context.server.matching_engine.asks[context.price][0]
+    order = context.server.matching_engine.ask_book.get(context.price).first()
     assert_that(order, not_none())
 
 
@@ -52,4 +50,24 @@ def step_impl(context):
 
 @then("order is deleted")
 def step_impl(context):
-    assert_that(len(context.server.matching_engine.asks.keys()), equal_to(0), "Limit order book size")
\ No newline at end of file
+    assert_that(len(context.server.matching_engine.ask_book), equal_to(0), "Limit order book size")
+
+
+@when('batch message with "{num}" orders is received')
+def step_impl(context, num):
+    context.client.send({'message': 'createOrders',
+                         'orders': [{'side': 'BUY',
+                                     'price': 100 - i,
+                                     'quantity': 100} for i in range(int(num))]})
+
+
+@then('client receives ids of the "{num}" created orders in one message')
+def step_impl(context, num):
+    reply = context.client.blocking_recv()
+    assert_that(reply['type'], equal_to('ordersCreated'))
+    assert_that(reply['ids'], equal_to(list(range(reply['ids'][0], reply['ids'][0] + int(num)))))
+
+
+@step('"{num}" orders are created')
+def step_impl(context, num):
+    assert_that(len(context.server.matching_engine.order_index), equal_to(int(num)))
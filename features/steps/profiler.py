@@ -0,0 +1,127 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+from behave import *
+from hamcrest import *
+from environment import FakeWriter
+from admin import Admin
+from metrics import Metrics
+from profiler import SamplingProfiler, StallMonitor, StallWatchdog
+
+
+def busy_loop(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+
+@when('stack "{stack}" is collapsed')
+def step_impl(context, stack):
+    frame = None
+    for entry in stack.split(','):
+        filename, name = entry.split(':')
+        frame = SimpleNamespace(f_code=SimpleNamespace(co_filename='/lib/' + filename, co_name=name), f_back=frame)
+    context.collapsed = SamplingProfiler._collapse(frame)
+
+
+@then('collapsed stack starts with "{category}"')
+def step_impl(context, category):
+    assert_that(context.collapsed.split(';')[0], equal_to(category))
+
+
+@given('sampling profiler of this thread')
+def step_impl(context):
+    context.profiler = SamplingProfiler(threading.get_ident())
+
+
+@when('this thread is busy for "{seconds}" seconds')
+def step_impl(context, seconds):
+    context.profiler.start()
+    try:
+        busy_loop(float(seconds))
+    finally:
+        context.profiler.stop()
+
+
+@then('collapsed stacks include function "{name}"')
+def step_impl(context, name):
+    assert_that(context.profiler.collapsed(), has_item(contains_string('profiler.py:' + name + ' ')))
+
+
+def block_loop(seconds):
+    time.sleep(seconds)
+
+
+@given('stall monitor with threshold "{threshold}" ms')
+def step_impl(context, threshold):
+    context.stall_loop = asyncio.new_event_loop()
+    context.add_cleanup(context.stall_loop.close)
+    context.monitor = StallMonitor(context.stall_loop, int(threshold) / 1000, 0.005)
+
+
+@when('event loop is blocked for "{ms}" ms')
+def step_impl(context, ms):
+    context.monitor.start()
+    context.stall_loop.call_later(0.02, time.sleep, int(ms) / 1000)
+    context.stall_loop.run_until_complete(asyncio.sleep(0.1))
+    context.monitor.stop()
+
+
+@given('stall watchdog with threshold "{threshold}" ms')
+def step_impl(context, threshold):
+    context.stall_loop = asyncio.new_event_loop()
+    context.add_cleanup(context.stall_loop.close)
+    context.current_message = None
+    context.monitor = StallWatchdog(context.stall_loop, threading.get_ident(), int(threshold) / 1000,
+                                    lambda: context.current_message, 0.005)
+    context.metrics = Metrics()
+    for metric in context.monitor.metrics():
+        context.metrics.register(metric)
+
+
+@when('event loop is blocked for "{ms}" ms processing "{message}"')
+def step_impl(context, ms, message):
+    def process():
+        context.current_message = message
+        block_loop(int(ms) / 1000)
+        context.current_message = None
+
+    context.monitor.start()
+    context.stall_loop.call_later(0.02, process)
+    context.stall_loop.run_until_complete(asyncio.sleep(0.1 + int(ms) / 1000))
+    context.monitor.stop()
+
+
+@then('"{num}" stall is reported')
+def step_impl(context, num):
+    assert_that(context.monitor.stalls, has_length(int(num)))
+
+
+@then('stall report summary starts with "{text}"')
+def step_impl(context, text):
+    assert_that(context.monitor.report()[-1], starts_with(text + ' '))
+
+
+@when('admin command "{command}" is received')
+def step_impl(context, command):
+    loop = asyncio.new_event_loop()
+    try:
+        reader = asyncio.StreamReader(loop=loop)
+        reader.feed_data(command.encode('utf-8') + b'\n')
+        reader.feed_eof()
+        context.writer = FakeWriter()
+        loop.run_until_complete(Admin(loop, threading.get_ident()).handle_client(reader, context.writer))
+    finally:
+        loop.close()
+
+
+@then("metrics include '{line}'")
+def step_impl(context, line):
+    assert_that(context.metrics.render().splitlines(), has_item(line))
+
+
+@then('admin answer starts with "{text}"')
+def step_impl(context, text):
+    assert_that(context.writer.data.decode('utf-8'), starts_with(text))
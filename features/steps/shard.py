@@ -0,0 +1,196 @@
+import asyncio
+import json
+import os
+import tempfile
+
+import ZODB
+from behave import *
+from hamcrest import *
+from environment import FakeWriter
+from journal import Journal
+from matching import MatchingEngine
+from models import OrderType
+from server import ExchangeServer
+from shard import ShardServer, execute_command
+from ticks import TickSize
+
+tick_size = TickSize()
+
+
+class FakeShard:
+    def __init__(self, loop):
+        self.loop = loop
+        self.requests = []
+
+    def request(self, command):
+        return self.request_many([command])[0]
+
+    def request_many(self, commands):
+        futures = [self.loop.create_future() for _ in commands]
+        self.requests.extend(zip(commands, futures))
+        return futures
+
+    def complete(self):
+        for command, future in self.requests:
+            future.set_result([('private', command[3], {'type': 'orderCreated', 'id': command[2]})])
+        self.requests = []
+
+
+@given('shard with instruments "{symbols}"')
+def step_impl(context, symbols):
+    context.shard_server = ShardServer()
+    context.shard_engines = {symbol: MatchingEngine(None, None, context.shard_server, symbol)
+                             for symbol in symbols.split(',')}
+    context.shard_users = {}
+
+
+@when("shard executes commands")
+def step_impl(context):
+    for row in context.table:
+        if row['message'] == 'createOrder':
+            order_type = OrderType.ask if row['side'] == 'BUY' else OrderType.bid
+            command = ('createOrder', row['symbol'], int(row['id']), row['user'], order_type.value,
+                       tick_size.to_ticks(row['price']), int(row['quantity']))
+        else:
+            command = ('cancelOrder', row['symbol'], int(row['id']), row['user'])
+        execute_command(command, context.shard_engines, context.shard_users)
+
+
+@then('shard instrument "{symbol}" has "{num}" orders')
+def step_impl(context, symbol, num):
+    assert_that(len(list(context.shard_engines[symbol].orders())), equal_to(int(num)))
+
+
+@step("all public messages of shard have symbol")
+def step_impl(context):
+    public = [data for kind, _, data in context.shard_server.outputs if kind == 'public']
+    assert_that(public, is_not(empty()))
+    for data in public:
+        assert_that(data, has_key('symbol'))
+
+
+@step('"{username}" received trade of "{quantity}" for "{symbol}"')
+def step_impl(context, username, quantity, symbol):
+    trades = [data for kind, recipient, data in context.shard_server.outputs
+              if kind == 'private' and recipient == username and data['type'] == 'trade']
+    assert_that(trades, has_length(1))
+    assert_that(trades[0]['quantity'], equal_to(int(quantity)))
+    assert_that(trades[0]['symbol'], equal_to(symbol))
+
+
+@then('server with "{num}" shards and without journal is rejected')
+def step_impl(context, num):
+    assert_that(calling(ExchangeServer).with_args(None, None, symbols=['A', 'B'], shards=int(num)),
+                raises(ValueError))
+
+
+@given('journal of sharded server with records')
+def step_impl(context):
+    directory = tempfile.TemporaryDirectory()
+    context.add_cleanup(directory.cleanup)
+    context.journal_path = os.path.join(directory.name, 'journal')
+    loop = asyncio.new_event_loop()
+    journal = Journal(context.journal_path, loop)
+    journal.open()
+    for row in context.table:
+        journal.append({'message': row['message'], 'symbol': row['symbol'], 'user': row['user'],
+                        'side': row['side'], 'price': tick_size.to_ticks(row['price']),
+                        'quantity': int(row['quantity']), 'id': int(row['id'])})
+    journal.close()
+    loop.close()
+
+
+@when('server with "{num}" shards for instruments "{symbols}" restarts from the journal')
+def step_impl(context, num, symbols):
+    server = ExchangeServer(None, None, journal_path=context.journal_path, symbols=symbols.split(','),
+                            shards=int(num))
+    server.loop = asyncio.new_event_loop()
+    server.init_db(ZODB.DB(None))
+    server._start_shards()
+
+    def cleanup():
+        server.journal.close()
+        for shard in server.shards:
+            shard.stop()
+        server.loop.close()
+    context.add_cleanup(cleanup)
+    server._restore_book()
+    context.restarted_server = server
+
+
+@then('restarted server publishes orderbook')
+def step_impl(context):
+    levels = [(data['symbol'], data['side'], data['price'], data['quantity'])
+              for data in context.restarted_server._orderbook_messages()]
+    assert_that(levels, contains_inanyorder(*[(row['symbol'], row['side'], tick_size.to_ticks(row['price']),
+                                               int(row['quantity'])) for row in context.table]))
+
+
+@step('restarted server continues with order id "{order_id}"')
+def step_impl(context, order_id):
+    assert_that(context.restarted_server.get_new_id(), equal_to(int(order_id)))
+
+
+@given('sharded server for instruments "{symbols}" whose shards complete commands on demand')
+def step_impl(context, symbols):
+    directory = tempfile.TemporaryDirectory()
+    context.journal_path = os.path.join(directory.name, 'journal')
+    server = ExchangeServer(None, None, journal_path=context.journal_path, symbols=symbols.split(','), shards=2)
+    server.loop = asyncio.new_event_loop()
+    server.broadcast_queue = asyncio.Queue()
+    server.init_db(ZODB.DB(None))
+    server.journal = Journal(context.journal_path, server.loop)
+    server.journal.open()
+    server.symbol_shards = {symbol: FakeShard(server.loop) for symbol in server.symbols}
+    server.shards = list(server.symbol_shards.values())
+    context.writer = FakeWriter()
+    server.private_clients['john'] = (None, context.writer)
+
+    def cleanup():
+        server.journal.close()
+        server.loop.close()
+        directory.cleanup()
+    context.add_cleanup(cleanup)
+    context.sharded_server = server
+
+
+def order_record(server, username, symbol):
+    return {'message': 'createOrder', 'symbol': symbol, 'user': username, 'side': 'BUY',
+            'price': tick_size.to_ticks('100'), 'quantity': 10, 'id': server.get_new_id()}
+
+
+@when('"{username}" sends batch of orders for instruments "{symbols}"')
+def step_impl(context, username, symbols):
+    server = context.sharded_server
+    server._dispatch_to_shard({'message': 'createOrders', 'user': username,
+                               'records': [order_record(server, username, symbol) for symbol in symbols.split(',')]})
+
+
+@when('"{username}" sends order for instrument "{symbol}"')
+def step_impl(context, username, symbol):
+    server = context.sharded_server
+    server._dispatch_to_shard(order_record(server, username, symbol))
+
+
+@when('shard of instrument "{symbol}" completes its commands')
+def step_impl(context, symbol):
+    server = context.sharded_server
+    server.symbol_shards[symbol].complete()
+    for _ in range(3):
+        server.loop.run_until_complete(asyncio.sleep(0))
+    server.journal.flush()
+    for _ in range(3):
+        server.loop.run_until_complete(asyncio.sleep(0))
+
+
+@then('journal holds orders "{first}" and "{second}" in this order')
+def step_impl(context, first, second):
+    with open(context.journal_path, 'rb') as file:
+        records = [json.loads(line.decode('utf-8')) for line in file]
+    ids = [','.join(str(action['id']) for action in record.get('records', [record])) for record in records]
+    assert_that(ids, equal_to([first, second]))
+
+
+@then('"{username}" received acknowledgments "{types}"')
+def step_impl(context, username, types):
+    assert_that([data['type'] for data in context.writer.messages()], equal_to(types.split(',')))
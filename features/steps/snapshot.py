@@ -0,0 +1,55 @@
+import os
+import tempfile
+from behave import *
+from hamcrest import *
+from matching import MatchingEngine
+from models import Order
+from snapshot import Snapshot
+from ticks import TickSize
+
+tick_size = TickSize()
+
+
+@when("snapshot of the orderbook is written and read back")
+def step_impl(context):
+    snapshot_dir = tempfile.TemporaryDirectory()
+    context.add_cleanup(snapshot_dir.cleanup)
+    path = os.path.join(snapshot_dir.name, 'book.snapshot')
+    orders = (('WOOD', order) for order in context.matching_engine.orders())
+    Snapshot.from_orders(orders, 10, 4).write(path)
+    context.snapshot = Snapshot.read(path)
+    assert_that(context.snapshot.sequence, equal_to(10))
+    assert_that(context.snapshot.last_id, equal_to(4))
+
+
+@step("new orderbook is loaded from the snapshot")
+def step_impl(context):
+    orders = []
+    for order_id, order_type, price, quantity, username, symbol in context.snapshot.orders:
+        assert_that(symbol, equal_to('WOOD'))
+        order = Order()
+        order.set_id(order_id)
+        order.set_type(order_type)
+        order.set_price(price)
+        order.set_quantity(quantity)
+        orders.append(order)
+    context.loaded_engine = MatchingEngine(None, None, context.server)
+    context.loaded_engine.load_orders(orders)
+
+
+@then("loaded orderbook has the same orders in the same order")
+def step_impl(context):
+    def describe(engine):
+        return [(order.id, order.type, order.price, order.quantity) for order in engine.orders()]
+    assert_that(describe(context.loaded_engine), equal_to(describe(context.matching_engine)))
+
+
+@step('loaded "{order_type}" price level "{price}" has quantity "{quantity}" in "{count}" orders')
+def step_impl(context, order_type, price, quantity, count):
+    if order_type == 'bid':
+        book = context.loaded_engine.bid_book
+    else:
+        book = context.loaded_engine.ask_book
+    level = book.get(tick_size.to_ticks(price))
+    assert_that(level.quantity, equal_to(int(quantity)))
+    assert_that(level.count, equal_to(int(count)))
@@ -0,0 +1,89 @@
+import asyncio
+import json
+from decimal import Decimal
+
+import ZODB
+from behave import *
+from hamcrest import *
+from environment import FakeWriter
+import binary
+from models import User
+from server import ExchangeServer
+from ticks import TickSize
+
+BINARY_TYPES = {binary.ERROR: 'error', binary.ORDER_CREATED: 'orderCreated'}
+
+
+@given('tick size "{size}"')
+def step_impl(context, size):
+    context.tick_size = TickSize(size)
+
+
+@then('price "{price}" is "{ticks}" ticks')
+def step_impl(context, price, ticks):
+    assert_that(context.tick_size.to_ticks(price), equal_to(int(ticks)))
+
+
+@step('"{ticks}" ticks are formatted as "{formatted}"')
+def step_impl(context, ticks, formatted):
+    assert_that(context.tick_size.format(int(ticks)), equal_to(formatted))
+
+
+@then('price "{price}" is rejected')
+def step_impl(context, price):
+    assert_that(calling(context.tick_size.to_ticks).with_args(price), raises(ValueError))
+
+
+@given('client connected by "{protocol}" protocol to server with tick size "{size}"')
+def step_impl(context, protocol, size):
+    context.protocol = protocol
+    context.server = ExchangeServer(None, None, tick_size=size, binary_private_port=0)
+    context.server.init_db(ZODB.DB(None))
+    context.server._create_matching_engines()
+    context.writer = FakeWriter()
+    if protocol == 'binary':
+        context.server.binary_writers.add(context.writer)
+    context.user = User()
+    context.user.set_username('user')
+    context.server.private_clients['user'] = (None, context.writer)
+
+
+@when('client sends orders "{side1}" "{quantity1}" @ "{price1}" and "{side2}" "{quantity2}" @ "{price2}" '
+      'and disconnects')
+def step_impl(context, side1, quantity1, price1, side2, quantity2, price2):
+    loop = asyncio.new_event_loop()
+    try:
+        reader = asyncio.StreamReader(loop=loop)
+        context.server.broadcast_queue = asyncio.Queue()
+        for side, quantity, price in ((side1, quantity1, price1), (side2, quantity2, price2)):
+            if context.protocol == 'binary':
+                body = binary.CREATE_ORDER_BODY.pack(b'', 1 if side == 'BUY' else 2,
+                                                     int(Decimal(price).scaleb(binary.PRICE_PLACES)), int(quantity))
+                reader.feed_data(binary.HEADER.pack(len(body), binary.CREATE_ORDER) + body)
+            else:
+                reader.feed_data(json.dumps({'message': 'createOrder', 'side': side, 'price': price,
+                                             'quantity': int(quantity)}).encode('utf-8') + b'\n')
+        reader.feed_eof()
+        read_msg = context.server._read_binary_msg if context.protocol == 'binary' else context.server._read_msg
+        loop.run_until_complete(context.server._handle_client(reader, context.writer, context.user, read_msg))
+    finally:
+        loop.close()
+
+
+@then('client receives "{types}"')
+def step_impl(context, types):
+    received = []
+    if context.protocol == 'binary':
+        offset = 0
+        while offset < len(context.writer.data):
+            length, msg_type = binary.HEADER.unpack_from(context.writer.data, offset)
+            received.append(BINARY_TYPES[msg_type])
+            offset += binary.HEADER.size + length
+    else:
+        received = [json.loads(line)['type'] for line in context.writer.data.decode('utf-8').splitlines()]
+    assert_that(received, equal_to(types.split(',')))
+
+
+@step('client is no longer registered')
+def step_impl(context):
+    assert_that(context.server.private_clients, is_not(has_key('user')))
@@ -0,0 +1,35 @@
+Feature: Prices are converted to integer ticks
+
+  Scenario Outline: Prices on the tick grid are converted
+    Given tick size "<tick_size>"
+    Then price "<price>" is "<ticks>" ticks
+    And "<ticks>" ticks are formatted as "<formatted>"
+
+    Examples:
+      | tick_size | price | ticks | formatted |
+      | 0.01 | 100.25 | 10025 | 100.25 |
+      | 0.01 | 100 | 10000 | 100.00 |
+      | 0.05 | 99.95 | 1999 | 99.95 |
+      | 5 | 100 | 20 | 100 |
+
+  Scenario Outline: Prices off the tick grid are rejected
+    Given tick size "<tick_size>"
+    Then price "<price>" is rejected
+
+    Examples:
+      | tick_size | price |
+      | 0.01 | 100.001 |
+      | 0.05 | 99.99 |
+      | 5 | 101 |
+      | 0.01 | abc |
+
+  Scenario Outline: Order with price off the tick grid is answered by error and the client stays connected
+    Given client connected by "<protocol>" protocol to server with tick size "0.05"
+    When client sends orders "BUY" "10" @ "99.99" and "BUY" "10" @ "99.95" and disconnects
+    Then client receives "error,orderCreated"
+    And client is no longer registered
+
+    Examples:
+      | protocol |
+      | json |
+      | binary |
@@ -0,0 +1,141 @@
+#
+# Client side of the binary protocol, alternative to newline-delimited JSON.
+#
+# Every frame is a header (little endian uint16 body length, uint8 message type) followed by a fixed layout body.
+# Symbols are ASCII padded by zero bytes to 8 bytes, empty symbol means the default instrument.
+# Prices are fixed point int64 with PRICE_PLACES decimal places.
+# Public messages start with their sequence number (0 for trades reported on the private channel).
+#
+# Messages are encoded from and decoded into the same dictionaries as the JSON ones,
+# so clients can switch between the protocols by choosing the reader and encoder.
+from decimal import Decimal
+from typing import Any, Dict
+import asyncio
+import struct
+
+VERSION = 2
+PRICE_PLACES = 8
+
+HEADER = struct.Struct('<HB')
+
+LOGIN = 1
+CREATE_ORDER = 2
+CANCEL_ORDER = 3
+REPLACE_ORDER = 4
+ORDER_CREATED = 5
+ORDER_REPLACED = 6
+TRADE = 7
+ORDERBOOK = 8
+RETRANSMIT = 9
+SNAPSHOT = 10
+ERROR = 11
+CONFLATED = 12
+
+LOGIN_REQUEST = struct.Struct('<BBB')
+LOGIN_RESPONSE = struct.Struct('<BB')
+CREATE_ORDER_BODY = struct.Struct('<8sBqQ')
+CANCEL_ORDER_BODY = struct.Struct('<8sQ')
+REPLACE_ORDER_BODY = struct.Struct('<8sQBqQ')
+ORDER_ID_BODY = struct.Struct('<Q')
+SEQUENCE_BODY = struct.Struct('<Q')
+TRADE_BODY = struct.Struct('<Q8sdqQ')
+ORDERBOOK_BODY = struct.Struct('<Q8sBqQ')
+
+LOGIN_ACTIONS = {0: 'denied', 1: 'logged_in', 2: 'registered'}
+ORDER_SIDES = {'BUY': 1, 'SELL': 2}
+BOOK_SIDES = {1: 'bid', 2: 'ask'}
+REPLACE_PRICE = 1
+REPLACE_QUANTITY = 2
+
+
+def to_fixed(price: Any) -> int:
+    ''' Convert price (number or string) to fixed point integer. '''
+    return int(Decimal(str(price)).scaleb(PRICE_PLACES))
+
+
+def from_fixed(price: int) -> Decimal:
+    ''' Convert fixed point integer to price. '''
+    return Decimal(price).scaleb(-PRICE_PLACES).normalize()
+
+
+def frame(msg_type: int, body: bytes) -> bytes:
+    return HEADER.pack(len(body), msg_type) + body
+
+
+def encode(msg: Dict[str, Any]) -> bytes:
+    ''' Encode a message for the server (login, createOrder, cancelOrder, replaceOrder or retransmit). '''
+    symbol = msg.get('symbol', '').encode('ascii')
+    if msg['message'] == 'login':
+        username = msg['username'].encode('utf-8')
+        password = msg['password'].encode('utf-8')
+        return frame(LOGIN, LOGIN_REQUEST.pack(VERSION, len(username), len(password)) + username + password)
+    elif msg['message'] == 'createOrder':
+        return frame(CREATE_ORDER, CREATE_ORDER_BODY.pack(symbol, ORDER_SIDES[msg['side']], to_fixed(msg['price']),
+                                                          msg['quantity']))
+    elif msg['message'] == 'cancelOrder':
+        return frame(CANCEL_ORDER, CANCEL_ORDER_BODY.pack(symbol, msg['orderId']))
+    elif msg['message'] == 'replaceOrder':
+        flags = (REPLACE_PRICE if 'price' in msg else 0) | (REPLACE_QUANTITY if 'quantity' in msg else 0)
+        return frame(REPLACE_ORDER, REPLACE_ORDER_BODY.pack(symbol, msg['orderId'], flags,
+                                                            to_fixed(msg.get('price', 0)), msg.get('quantity', 0)))
+    elif msg['message'] == 'retransmit':
+        return frame(RETRANSMIT, SEQUENCE_BODY.pack(msg['from']))
+    raise ValueError('Message {!r} cannot be sent by binary protocol'.format(msg['message']))
+
+
+def decode(msg_type: int, body: bytes) -> Dict[str, Any]:
+    ''' Decode a message received from the server. '''
+    if msg_type == LOGIN:
+        action, version = LOGIN_RESPONSE.unpack(body)
+        return {'type': 'login', 'action': LOGIN_ACTIONS[action], 'version': version}
+    elif msg_type == ORDER_CREATED:
+        return {'type': 'orderCreated', 'id': ORDER_ID_BODY.unpack(body)[0]}
+    elif msg_type == ORDER_REPLACED:
+        return {'type': 'orderReplaced', 'id': ORDER_ID_BODY.unpack(body)[0]}
+    elif msg_type == SNAPSHOT:
+        return {'type': 'snapshot', 'seq': SEQUENCE_BODY.unpack(body)[0]}
+    elif msg_type == ERROR:
+        return {'type': 'error', 'reason': body.decode('utf-8')}
+    elif msg_type == CONFLATED:
+        return {'type': 'conflated', 'seqs': list(struct.unpack('<{}Q'.format(len(body) // 8), body))}
+    elif msg_type == TRADE:
+        seq, symbol, time, price, quantity = TRADE_BODY.unpack(body)
+        msg = {'type': 'trade', 'seq': seq, 'time': time, 'price': from_fixed(price), 'quantity': quantity}
+    elif msg_type == ORDERBOOK:
+        seq, symbol, side, price, quantity = ORDERBOOK_BODY.unpack(body)
+        msg = {'type': 'orderbook', 'seq': seq, 'side': BOOK_SIDES[side], 'price': from_fixed(price),
+               'quantity': quantity}
+    else:
+        raise ValueError('Unknown message type {}'.format(msg_type))
+    symbol = symbol.rstrip(b'\0')
+    if symbol:
+        msg['symbol'] = symbol.decode('ascii')
+    return msg
+
+
+async def read(reader: asyncio.StreamReader) -> Dict[str, Any]:
+    ''' Read and decode one message, None at the end of the stream. '''
+    try:
+        length, msg_type = HEADER.unpack(await reader.readexactly(HEADER.size))
+        body = await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        return None
+    return decode(msg_type, body)
+
+
+class FrameReader:
+    '''
+    Use `async for msg in FrameReader(streamReader)` to iterate decoded messages from a stream.
+    '''
+
+    def __init__(self, reader: asyncio.StreamReader) -> None:
+        self._reader = reader
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Dict[str, Any]:
+        msg = await read(self._reader)
+        if msg is None:
+            raise StopAsyncIteration()
+        return msg
@@ -2,57 +2,156 @@
 #
 # Simulate a data stream consumer.
 #
-# Usage: client-datastream.py DataChannelHostname DataChannelPort
+# Usage: client-datastream.py [--binary] DataChannelHostname DataChannelPort
+#
+# With --binary, the client reads the binary public port of the server using binary_protocol.py.
 #
 # http://codingchallenge.wood.cz/
+import bisect
 import decimal
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional, Set, Tuple
 import asyncio
 import datetime
 import json
 import sys
+import binary_protocol
 import utils
 
 
 async def main():
     # Connect to the server
-    assert len(sys.argv) == 3, 'Usage: client-datastream.py DataChannelHostname DataChannelPort'
-    host = sys.argv[1]
-    port = int(sys.argv[2])
+    binary = '--binary' in sys.argv[1:]
+    args = [arg for arg in sys.argv[1:] if arg != '--binary']
+    assert len(args) == 2, 'Usage: client-datastream.py [--binary] DataChannelHostname DataChannelPort'
+    host = args[0]
+    port = int(args[1])
     reader, writer = await asyncio.open_connection(host, port)
 
-    # Receive and parse incoming data
+    # Receive and parse incoming data, asking for retransmission of missed messages
     model = MarketModel()
     try:
-        async for line in utils.LineReader(reader):
-            print('\n<{!s} received {!r}>\n'.format(datetime.datetime.now(), line))
-            model.apply(json.loads(line))
+        if binary:
+            messages = binary_protocol.FrameReader(reader)
+        else:
+            messages = JsonReader(reader)
+        async for msg in messages:
+            print('\n<{!s} received {!r}>\n'.format(datetime.datetime.now(), msg))
+            missing = model.apply(msg)
             print(model)
+            if missing is not None:
+                print('\n<{!s} gap detected, requesting retransmission from {}>\n'.format(
+                    datetime.datetime.now(), missing))
+                request = {'message': 'retransmit', 'from': missing}
+                if binary:
+                    writer.write(binary_protocol.encode(request))
+                else:
+                    writer.write(json.dumps(request).encode('utf-8') + b'\n')
     finally:
         writer.close()
 
 
+class JsonReader:
+    ''' Iterate JSON messages decoded from lines of a stream. '''
+
+    def __init__(self, reader: asyncio.StreamReader) -> None:
+        self._lines = utils.LineReader(reader)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Dict[str, Any]:
+        line = await self._lines.__anext__()
+        if line is None:
+            raise StopAsyncIteration()
+        return json.loads(line)
+
+
 class MarketModel:
-    ''' Represent the current state of the market (order book, trades). '''
+    '''
+    Represent the current state of the market (order book, trades).
+
+    Public messages carry sequence number `seq`. Snapshot message resets the order book, the order book
+    levels which follow it carry older sequence numbers. Order book messages superseded while the client
+    was behind are skipped by the server, which lists their sequence numbers in `conflated` message.
+    Any other gap in the sequence numbers means lost messages, `apply` then returns the first missing
+    sequence number, for which retransmission should be requested.
+    Retransmitted messages may repeat already received ones: trades are applied only once,
+    order book level is changed only by message newer than the one which set it.
+    '''
 
     def __init__(self) -> None:
         self._trades = []  # type: List[Dict[str, Any]]
-        self._bid = {}  # type: Dict[int, int]
-        self._ask = {}  # type: Dict[int, int]
+        self._tradeSeqs = []  # type: List[int]
+        self._bid = {}  # type: Dict[decimal.Decimal, int]
+        self._ask = {}  # type: Dict[decimal.Decimal, int]
+        self._levelSeqs = {}  # type: Dict[Tuple[str, decimal.Decimal], int]
+        self._next = None  # type: int
+        self._ahead = set()  # type: Set[int]
+        self._requested = None  # type: int
+
+    def apply(self, message: Dict[str, Any]) -> Optional[int]:
+        if message['type'] == 'snapshot':
+            self._bid.clear()
+            self._ask.clear()
+            self._levelSeqs.clear()
+            self._ahead.clear()
+            self._next = message['seq'] + 1
+            return None
+        if message['type'] == 'conflated':
+            for seq in message['seqs']:
+                self._mark(seq)
+            return self._missing()
 
-    def apply(self, message: Dict[str, Any]) -> None:
+        seq = message.get('seq', 0)
         if message['type'] == 'trade':
-            self._trades.append({
-                'time': datetime.datetime.fromtimestamp(message['time']),
-                'price': message['price'],
-                'quantity': message['quantity'],
-            })
+            if not self._received(seq):
+                index = bisect.bisect(self._tradeSeqs, seq)
+                self._tradeSeqs.insert(index, seq)
+                self._trades.insert(index, {
+                    'time': datetime.datetime.fromtimestamp(message['time']),
+                    'price': message['price'],
+                    'quantity': message['quantity'],
+                })
         elif message['type'] == 'orderbook':
             assert message['side'] in {'bid', 'ask'}, 'Invalid order book side'
             side = self._bid if message['side'] == 'bid' else self._ask
-            side[decimal.Decimal(message['price'])] = message['quantity']
+            key = (message['side'], decimal.Decimal(message['price']))
+            if seq >= self._levelSeqs.get(key, 0):
+                self._levelSeqs[key] = seq
+                side[key[1]] = message['quantity']
         else:
             raise ValueError('Invalid message type')
+        return self._track(seq)
+
+    def _received(self, seq: int) -> bool:
+        ''' Whether message with this sequence number was already received. '''
+        return self._next is not None and (seq < self._next or seq in self._ahead)
+
+    def _track(self, seq: int) -> Optional[int]:
+        ''' Record received sequence number, return first missing one if retransmission should be requested. '''
+        if self._next is None or seq < self._next:
+            return None
+        self._mark(seq)
+        return self._missing()
+
+    def _mark(self, seq: int) -> None:
+        ''' Record sequence number which is not missing anymore. '''
+        if self._next is None or seq < self._next:
+            return
+        if seq == self._next:
+            self._next += 1
+            while self._next in self._ahead:
+                self._ahead.remove(self._next)
+                self._next += 1
+        else:
+            self._ahead.add(seq)
+
+    def _missing(self) -> Optional[int]:
+        ''' First missing sequence number, if retransmission of it was not requested yet. '''
+        if self._ahead and self._requested != self._next:
+            self._requested = self._next
+            return self._next
+        return None
 
     def __repr__(self) -> str:
         lines = (
@@ -2,7 +2,9 @@
 #
 # Simulate a simple market participant.
 #
-# Usage: client-participant.py PrivateChannelHostname PrivateChannelPort
+# Usage: client-participant.py [--binary] PrivateChannelHostname PrivateChannelPort
+#
+# With --binary, the client talks to the binary private port of the server using binary_protocol.py.
 #
 # http://codingchallenge.wood.cz/
 
@@ -14,14 +16,17 @@ import datetime
 import json
 import sys
 import time
+import binary_protocol
 import utils
 
 
 async def main():
     # Connect to the server
-    assert len(sys.argv) == 3, 'Usage: client-participant.py PrivateChannelHostname PrivateChannelPort'
-    host = sys.argv[1]
-    port = int(sys.argv[2])
+    binary = '--binary' in sys.argv[1:]
+    args = [arg for arg in sys.argv[1:] if arg != '--binary']
+    assert len(args) == 2, 'Usage: client-participant.py [--binary] PrivateChannelHostname PrivateChannelPort'
+    host = args[0]
+    port = int(args[1])
     reader, writer = await asyncio.open_connection(host, port)
 
     # Set up stdin
@@ -34,31 +39,35 @@ async def main():
     loop.add_reader(sys.stdin.fileno(), onUserInput)
 
     # Log incoming data
-    bgLogger = asyncio.ensure_future(readIncomingData(reader))
+    bgLogger = asyncio.ensure_future(readIncomingData(reader, binary))
 
     # Run Read-Eval-Print loop.
     try:
-        await login(userInput, writer)
-        await repl(userInput, writer)
+        await login(userInput, writer, binary)
+        await repl(userInput, writer, binary)
     finally:
         bgLogger.cancel()
         writer.close()
 
-async def login(userInput: asyncio.Queue, writer: asyncio.StreamWriter) -> None:
+async def login(userInput: asyncio.Queue, writer: asyncio.StreamWriter, binary: bool) -> None:
     username = await prompt(userInput, 'Username?')
     password = await prompt(userInput, 'Password?')
     await sendMessage(writer, {
         'message': 'login',
         'username': username,
         'password': password
-    })
+    }, binary)
 
-async def readIncomingData(reader: asyncio.StreamReader) -> None:
-    async for line in utils.LineReader(reader):
-        print('\n<{!s} received {!r}>\n'.format(datetime.datetime.now(), line))
+async def readIncomingData(reader: asyncio.StreamReader, binary: bool) -> None:
+    if binary:
+        async for msg in binary_protocol.FrameReader(reader):
+            print('\n<{!s} received {!r}>\n'.format(datetime.datetime.now(), msg))
+    else:
+        async for line in utils.LineReader(reader):
+            print('\n<{!s} received {!r}>\n'.format(datetime.datetime.now(), line))
 
 
-async def repl(userInput: asyncio.Queue, writer: asyncio.StreamWriter) -> None:
+async def repl(userInput: asyncio.Queue, writer: asyncio.StreamWriter, binary: bool) -> None:
     while True:
         print('1: create order, 2: cancel order, q: quit')
         command = await prompt(userInput, 'Command?')
@@ -76,13 +85,13 @@ async def repl(userInput: asyncio.Queue, writer: asyncio.StreamWriter) -> None:
                 'side': side,
                 'price': price,
                 'quantity': quantity,
-            })
+            }, binary)
         elif command == '2':
             orderId = int(await prompt(userInput, 'Order ID to cancel?'))
             await sendMessage(writer, {
                 'message': 'cancelOrder',
                 'orderId': orderId,
-            })
+            }, binary)
         elif command == 'q':
             break
         else:
@@ -97,11 +106,15 @@ async def prompt(userInput: asyncio.Queue, p: str) -> str:
     return line.rstrip('\n')
 
 
-async def sendMessage(writer: asyncio.StreamWriter, msg: Dict[str, Any]) -> None:
+async def sendMessage(writer: asyncio.StreamWriter, msg: Dict[str, Any], binary: bool = False) -> None:
     ''' Encode and send a message to the server. '''
-    data = json.dumps(msg)
-    print('\n<{!s} sending {!r}>\n'.format(datetime.datetime.now(), data))
-    writer.write(data.encode('utf-8') + b'\n')
+    if binary:
+        print('\n<{!s} sending {!r}>\n'.format(datetime.datetime.now(), msg))
+        writer.write(binary_protocol.encode(msg))
+    else:
+        data = json.dumps(msg)
+        print('\n<{!s} sending {!r}>\n'.format(datetime.datetime.now(), data))
+        writer.write(data.encode('utf-8') + b'\n')
     await writer.drain()
 
 